@@ -0,0 +1,45 @@
+import sys
+import time
+import argparse
+import torch
+
+from dialRL.models import SelfAttention, set_attention_backend
+
+'''
+Latency and peak memory of the attention backends (--attention_backend einsum / sdpa)
+at growing sequence lengths (forward + backward).
+Their parity (outputs, gradients, Trans18 logits) is tested by tests/test_models.py.
+
+python dialRL/additional_code/benchmark_attention_backends.py --lengths 35 201 401 801
+'''
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--embed_size', default=128, type=int)
+parser.add_argument('--heads', default=8, type=int)
+parser.add_argument('--batch_size', default=32, type=int)
+parser.add_argument('--lengths', default=[35, 201, 401, 801], nargs='+', type=int)
+parser.add_argument('--repeat', default=5, type=int)
+args = parser.parse_args(sys.argv[1:])
+
+torch.manual_seed(0)
+
+# Latency / memory
+attention = SelfAttention(args.embed_size, args.heads)
+print('\n{:>8} {:>8} {:>12} {:>16}'.format('length', 'backend', 'ms', 'saved MB'))
+for length in args.lengths:
+    x = torch.randn(args.batch_size, length, args.embed_size)
+    mask = torch.ones(args.batch_size, 1, 1, length, dtype=torch.bool)
+    for backend in ['einsum', 'sdpa']:
+        set_attention_backend(attention, backend)
+        # Tensors saved for the backward
+        saved = [0]
+        def pack(tensor):
+            saved[0] += tensor.numel() * tensor.element_size()
+            return tensor
+        with torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+            attention(x, x, x, mask).sum().backward()
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            attention(x, x, x, mask).sum().backward()
+        print('{:>8} {:>8} {:>12.2f} {:>16.1f}'.format(length, backend, 1000 * (time.perf_counter() - start) / args.repeat,
+                                                     saved[0] / 1024**2))
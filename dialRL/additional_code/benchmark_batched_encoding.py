@@ -0,0 +1,80 @@
+import sys
+import time
+import argparse
+import torch
+
+from dialRL.models import Trans18, Trans19, Trans28
+from dialRL.environments import DarSeqEnv
+from dialRL.utils import collate_observations
+from dialRL.utils.reward_functions import ConstantReward
+
+'''
+Time of the batched input encodings of the Trans models (env, positions and times) against the
+per target / driver loops they replace, on observations of random episodes.
+Their equality is tested by tests/test_models.py.
+
+python dialRL/additional_code/benchmark_batched_encoding.py --sizes 16 2 96 8
+'''
+
+parser = argparse.ArgumentParser()
+# Pairs of (targets, drivers)
+parser.add_argument('--sizes', default=[16, 2, 96, 8], nargs='+', type=int)
+parser.add_argument('--batch_size', default=64, type=int)
+parser.add_argument('--repeat', default=20, type=int)
+args = parser.parse_args(sys.argv[1:])
+
+
+def observations(env, nb):
+    """ Observations of random episodes """
+    batch = []
+    observation = env.reset()
+    while len(batch) < nb:
+        batch.append(observation)
+        observation, reward, done, info = env.step(env.action_space.sample())
+        if done :
+            observation = env.reset()
+    return collate_observations(batch)
+
+
+def timing(function, *inputs):
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        function(*inputs)
+    return 1000 * (time.perf_counter() - start) / args.repeat
+
+
+for nb_target, nb_drivers in zip(args.sizes[::2], args.sizes[1::2]):
+    env = DarSeqEnv(size=10, target_population=nb_target, driver_population=nb_drivers,
+                    reward_function=ConstantReward(), rep_type='16')
+    world, targets, drivers, positions, times = observations(env, args.batch_size)[:5]
+    src = [world, targets, drivers]
+
+    for model_class, typ in [(Trans18, 16), (Trans18, 17), (Trans18, 18), (Trans18, 19), (Trans18, 26),
+                             (Trans19, 26), (Trans19, 40), (Trans28, 16)]:
+        kwargs = dict(src_vocab_size=400,
+                      trg_vocab_size=nb_target + 1,
+                      max_length=nb_target*2 + nb_drivers + 1,
+                      src_pad_idx=-1,
+                      trg_pad_idx=-1,
+                      embed_size=64,
+                      dropout=0.,
+                      extremas=env.extremas,
+                      device='cpu',
+                      num_layers=1,
+                      heads=2,
+                      forward_expansion=2,
+                      typ=typ,
+                      max_time=int(env.time_end))
+        if model_class != Trans28:
+            kwargs['classifier_type'] = 1
+        model = model_class(**kwargs).double()
+
+        for name, inputs in [('env', src), ('positional', positions), ('times', times)]:
+            if not hasattr(model, 'batched_' + name + '_encoding'):
+                continue
+            loop = getattr(model, 'loop_' + name + '_encoding')
+            batched = getattr(model, 'batched_' + name + '_encoding')
+            with torch.no_grad():
+                print('T={t} D={d} {m} typ {typ} | {n}_encoding | loop {l:.2f} ms, batched {b:.2f} ms'.format(
+                    t=nb_target, d=nb_drivers, m=model_class.__name__, typ=typ, n=name,
+                    l=timing(loop, inputs), b=timing(batched, inputs)))
@@ -0,0 +1,106 @@
+import sys
+import time
+import argparse
+import numpy as np
+import torch
+
+from dialRL.models import Trans18, CompiledPolicy
+from dialRL.environments import DarSeqEnv
+from dialRL.utils import collate_observations, torch_load
+from dialRL.utils.reward_functions import ConstantReward
+
+'''
+Per decision latency of the eager and compiled (--compile jit / compile) forward passes.
+Greedy decoding of a Cordeau instance, each decision being: collate + forward + argmax.
+The compiled policies have to take the same decisions as the eager model.
+Batched forward passes of the same observations are also timed (--batch_sizes).
+
+python dialRL/additional_code/benchmark_compiled.py --instance <rootdir>/data/instances/cordeau2006/a2-16.txt
+python dialRL/additional_code/benchmark_compiled.py --instance <...>/a2-16.txt --checkpoint <...>/best_GAP_model.pt
+'''
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--instance', type=str, required=True)
+parser.add_argument('--checkpoint', default='', type=str)
+parser.add_argument('--rep_type', default='16', type=str)
+parser.add_argument('--embed_size', default=128, type=int)
+parser.add_argument('--num_layers', default=4, type=int)
+parser.add_argument('--heads', default=8, type=int)
+parser.add_argument('--backends', default=['jit', 'compile'], nargs='+', type=str)
+parser.add_argument('--batch_sizes', default=[1, 16, 128], nargs='+', type=int)
+parser.add_argument('--repeat', default=20, type=int)
+args = parser.parse_args(sys.argv[1:])
+
+env = DarSeqEnv(size=10, target_population=1, driver_population=1, reward_function=ConstantReward(),
+                rep_type=args.rep_type, test_env=True, dataset=args.instance)
+
+if args.checkpoint :
+    model = torch_load(args.checkpoint, map_location='cpu')
+    for module in model.modules():
+        if hasattr(module, 'device'):
+            module.device = 'cpu'
+else :
+    model = Trans18(src_vocab_size=50000,
+                    trg_vocab_size=env.target_population + 1,
+                    max_length=env.target_population*2 + env.driver_population + 1,
+                    src_pad_idx=-1,
+                    trg_pad_idx=-1,
+                    embed_size=args.embed_size,
+                    dropout=0.1,
+                    extremas=env.extremas,
+                    device='cpu',
+                    num_layers=args.num_layers,
+                    heads=args.heads,
+                    forward_expansion=4,
+                    typ=26,
+                    max_time=int(env.time_end),
+                    classifier_type=1).double()
+model.eval()
+
+
+def decide(policy, observations):
+    world, targets, drivers, positions, times = collate_observations(observations, dtype=model.dtype)[:5]
+    target_tensor = world[1].unsqueeze(-1).long()
+    with torch.no_grad():
+        model_action = policy([world, targets, drivers], target_tensor, positions=positions, times=times)
+    return model_action.reshape(len(observations), -1).argmax(-1)
+
+
+def episode(policy):
+    """ Greedy episode: observations, actions and latency of each decision """
+    observation = env.reset()
+    done = False
+    observations, actions, latencies = [], [], []
+    while not done:
+        start = time.perf_counter()
+        action = decide(policy, [observation]).item()
+        latencies.append(time.perf_counter() - start)
+        observations.append(observation)
+        actions.append(action)
+        observation, reward, done, info = env.step(action)
+    return observations, actions, np.array(latencies) * 1000
+
+
+policies = [('eager', model)] + [(backend, CompiledPolicy(model, backend=backend)) for backend in args.backends]
+
+# Reference trajectory, its observations are used for every policy
+observations, actions, _ = episode(model)
+print('Instance:', args.instance, '-', len(actions), 'decisions')
+
+print('\n{:<10} {:>10} {:>10} {:>10} {:>10}'.format('policy', 'mean ms', 'p50 ms', 'p99 ms', 'same'))
+for name, policy in policies:
+    # Warm up (graph building)
+    decide(policy, observations[:1])
+    _, policy_actions, latencies = episode(policy)
+    print('{:<10} {:>10.3f} {:>10.3f} {:>10.3f} {:>10}'.format(name, latencies.mean(), np.percentile(latencies, 50),
+                                                              np.percentile(latencies, 99), str(policy_actions == actions)))
+
+print('\n{:<10} {:>6} {:>16}'.format('policy', 'batch', 'ms / decision'))
+for batch_size in args.batch_sizes:
+    batch = [observations[k % len(observations)] for k in range(batch_size)]
+    for name, policy in policies:
+        decide(policy, batch)
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            decide(policy, batch)
+        print('{:<10} {:>6} {:>16.4f}'.format(name, batch_size, 1000 * (time.perf_counter() - start) / args.repeat / batch_size))
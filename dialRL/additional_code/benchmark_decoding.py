@@ -0,0 +1,56 @@
+import sys
+import copy
+import argparse
+import torch
+
+from dialRL.models import Trans18
+from dialRL.environments import DarSeqEnv
+from dialRL.utils.reward_functions import ConstantReward
+from dialRL.rl_train.decoding import TrajectoryDecoder
+
+'''
+Deliveries, distance and time of the greedy / sampling / beam decodings (--decoding), masked or not.
+The never worse than greedy check is tests/test_decoding.py.
+
+python dialRL/additional_code/benchmark_decoding.py --targets 16 --drivers 2 --width 16
+'''
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--targets', default=16, type=int)
+parser.add_argument('--drivers', default=2, type=int)
+parser.add_argument('--width', default=16, type=int)
+parser.add_argument('--temperature', default=1., type=float)
+parser.add_argument('--instances', default=3, type=int)
+args = parser.parse_args(sys.argv[1:])
+
+torch.manual_seed(0)
+env = DarSeqEnv(size=10, target_population=args.targets, driver_population=args.drivers,
+                reward_function=ConstantReward(), rep_type='16', test_env=True)
+model = Trans18(src_vocab_size=400,
+                trg_vocab_size=args.targets + 1,
+                max_length=args.targets*2 + args.drivers + 1,
+                src_pad_idx=-1,
+                trg_pad_idx=-1,
+                embed_size=64,
+                dropout=0.,
+                extremas=env.extremas,
+                device='cpu',
+                num_layers=2,
+                heads=8,
+                forward_expansion=2,
+                typ=26,
+                max_time=int(env.time_end),
+                classifier_type=1).double().eval()
+
+print('{:>9} {:>8} {:>10} {:>10} {:>10} {:>8}'.format('instance', 'masked', 'decoding', 'delivered', 'distance', 'time s'))
+for instance in range(args.instances):
+    for masked in [False, True]:
+        env.reset(seed=instance + 1)
+        # Greedy: the first sampled trajectory of a sampling of width 1
+        for decoding, width in [('greedy', 1), ('sampling', args.width), ('beam', args.width)]:
+            decoder = TrajectoryDecoder(model, 26, decoding='beam' if decoding == 'beam' else 'sampling', width=width,
+                                        temperature=args.temperature, masked=masked, seed=0)
+            decoded_env = copy.deepcopy(env)
+            info, total_reward, steps = decoder(decoded_env)
+            print('{:>9} {:>8} {:>10} {:>10} {:>10.2f} {:>8.2f}'.format(instance, str(masked), decoding, info['delivered'],
+                                                                       decoded_env.total_distance, decoder.stats['time']))
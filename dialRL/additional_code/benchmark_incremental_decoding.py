@@ -0,0 +1,70 @@
+import sys
+import time
+import argparse
+import torch
+
+from dialRL.models import Trans28
+from dialRL.environments import DarSeqEnv
+from dialRL.utils import collate_observations
+from dialRL.utils.reward_functions import ConstantReward
+
+'''
+Incremental decoding of Trans28 (start_decoding / decode_step): time of decoding a whole
+sequence step by step against the full decoder recompute on each target prefix.
+Their equality is tested by tests/test_models.py.
+
+python dialRL/additional_code/benchmark_incremental_decoding.py --lengths 16 64 256
+'''
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--targets', default=16, type=int)
+parser.add_argument('--drivers', default=3, type=int)
+parser.add_argument('--batch_size', default=8, type=int)
+parser.add_argument('--lengths', default=[16, 64, 256], nargs='+', type=int)
+args = parser.parse_args(sys.argv[1:])
+
+torch.manual_seed(0)
+env = DarSeqEnv(size=10, target_population=args.targets, driver_population=args.drivers,
+                reward_function=ConstantReward(), rep_type='16')
+batch = []
+observation = env.reset()
+while len(batch) < args.batch_size:
+    batch.append(observation)
+    observation, reward, done, info = env.step(env.action_space.sample())
+    if done :
+        observation = env.reset()
+world, targets, drivers, positions, times = collate_observations(batch)[:5]
+src = [world, targets, drivers]
+
+model = Trans28(src_vocab_size=400,
+                trg_vocab_size=args.targets + 1,
+                max_length=args.targets*2 + args.drivers + 1,
+                src_pad_idx=-1,
+                trg_pad_idx=-1,
+                embed_size=128,
+                dropout=0.,
+                extremas=env.extremas,
+                device='cpu',
+                num_layers=2,
+                heads=8,
+                forward_expansion=2,
+                typ=16,
+                max_time=int(env.time_end)).double()
+model.eval()
+
+for length in args.lengths:
+    # Decoder tokens: drivers indices (1 to 3)
+    trg = torch.randint(1, min(args.drivers, 3) + 1, (args.batch_size, length))
+    with torch.no_grad():
+        start = time.perf_counter()
+        for t in range(length):
+            model(src, trg[:, :t+1], positions=positions, times=times)
+        full_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        cache = model.start_decoding(src, positions, times)
+        for t in range(length):
+            model.decode_step(cache, trg[:, t])
+        step_time = time.perf_counter() - start
+
+    print('L={l}: full recompute {f:.3f}s, incremental {i:.3f}s'.format(l=length, f=full_time, i=step_time))
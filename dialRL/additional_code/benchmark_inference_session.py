@@ -0,0 +1,70 @@
+import sys
+import time
+import argparse
+import torch
+
+from dialRL.models import Trans18, InferenceSession
+from dialRL.environments import DarSeqEnv
+from dialRL.utils import collate_observations
+from dialRL.utils.reward_functions import ConstantReward
+from dialRL.strategies import NNStrategy
+
+'''
+Per episode inference cache (--inference_cache): along episodes of the nearest neighbour strategy,
+decision latency of the InferenceSession and of the model forward, and the cache statistics.
+The session outputs equal to the model forward are tested by tests/test_inference.py.
+
+python dialRL/additional_code/benchmark_inference_session.py --sizes 16 2 96 8
+'''
+
+parser = argparse.ArgumentParser()
+# Pairs of (targets, drivers)
+parser.add_argument('--sizes', default=[16, 2, 96, 8], nargs='+', type=int)
+parser.add_argument('--typs', default=[16, 26], nargs='+', type=int)
+parser.add_argument('--episodes', default=2, type=int)
+parser.add_argument('--embed_size', default=128, type=int)
+args = parser.parse_args(sys.argv[1:])
+
+torch.manual_seed(0)
+for nb_target, nb_drivers in zip(args.sizes[::2], args.sizes[1::2]):
+    env = DarSeqEnv(size=10, target_population=nb_target, driver_population=nb_drivers,
+                    reward_function=ConstantReward(), rep_type='16')
+    supervision = NNStrategy(reward_function='ConstantReward', env=env)
+    for typ in args.typs:
+        model = Trans18(src_vocab_size=400,
+                        trg_vocab_size=nb_target + 1,
+                        max_length=nb_target*2 + nb_drivers + 1,
+                        src_pad_idx=-1,
+                        trg_pad_idx=-1,
+                        embed_size=args.embed_size,
+                        dropout=0.1,
+                        extremas=env.extremas,
+                        device='cpu',
+                        num_layers=2,
+                        heads=8,
+                        forward_expansion=2,
+                        typ=typ,
+                        max_time=int(env.time_end),
+                        classifier_type=1)
+        model.eval()
+        model_time = session_time = decisions = 0
+        for episode in range(args.episodes):
+            session = InferenceSession(model)
+            observation = env.reset()
+            done = False
+            while not done:
+                world, targets, drivers, positions, times = collate_observations([observation])[:5]
+                trg = world[1].unsqueeze(-1).long()
+                with torch.no_grad():
+                    start = time.perf_counter()
+                    model([world, targets, drivers], trg, positions=positions, times=times)
+                    model_time += time.perf_counter() - start
+                start = time.perf_counter()
+                session([world, targets, drivers], trg, positions=positions, times=times)
+                session_time += time.perf_counter() - start
+                decisions += 1
+                observation, reward, done, info = env.step(supervision.action_choice())
+        print('T={t} D={d} typ {typ} | {n} decisions | model {m:.2f} ms, session {s:.2f} ms per decision'.format(
+            t=nb_target, d=nb_drivers, typ=typ, n=decisions,
+            m=1000 * model_time / decisions, s=1000 * session_time / decisions))
+        print('\t', session.stats)
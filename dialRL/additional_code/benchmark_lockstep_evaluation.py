@@ -0,0 +1,65 @@
+import sys
+import copy
+import time
+import argparse
+import numpy as np
+import torch
+
+from dialRL.models import Trans18
+from dialRL.environments import DarSeqEnv
+from dialRL.utils import collate_observations
+from dialRL.utils.reward_functions import ConstantReward
+from dialRL.rl_train.lockstep import lockstep_episodes
+
+'''
+Online evaluation episodes in lockstep (--eval_batch_size): time of the evaluation,
+one by one vs in lockstep (seeded instances). Their equal episodes are tested by tests/test_lockstep.py.
+
+python dialRL/additional_code/benchmark_lockstep_evaluation.py --episodes 32 --targets 16 --drivers 2
+'''
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--episodes', default=32, type=int)
+parser.add_argument('--targets', default=16, type=int)
+parser.add_argument('--drivers', default=2, type=int)
+args = parser.parse_args(sys.argv[1:])
+
+torch.manual_seed(0)
+env = DarSeqEnv(size=10, target_population=args.targets, driver_population=args.drivers,
+                reward_function=ConstantReward(), rep_type='16', test_env=True)
+model = Trans18(src_vocab_size=400,
+                trg_vocab_size=args.targets + 1,
+                max_length=args.targets*2 + args.drivers + 1,
+                src_pad_idx=-1,
+                trg_pad_idx=-1,
+                embed_size=64,
+                dropout=0.,
+                extremas=env.extremas,
+                device='cpu',
+                num_layers=2,
+                heads=8,
+                forward_expansion=2,
+                typ=26,
+                max_time=int(env.time_end),
+                classifier_type=1).double().eval()
+
+
+def decide(indices, observations):
+    world, targets, drivers, positions, times = collate_observations(observations)[:5]
+    with torch.no_grad():
+        logits = model([world, targets, drivers], world[1].unsqueeze(-1).long(), positions=positions, times=times)
+    return logits.argmax(-1).tolist()
+
+
+seeds = np.random.RandomState(0).randint(1, 2**31 - 1, size=args.episodes)
+
+start = time.perf_counter()
+for seed in seeds:
+    lockstep_episodes([copy.deepcopy(env)], decide, seeds=[seed])
+alone_time = time.perf_counter() - start
+
+start = time.perf_counter()
+infos, rewards, steps = lockstep_episodes([copy.deepcopy(env) for _ in seeds], decide, seeds=seeds)
+lockstep_time = time.perf_counter() - start
+print('{n} episodes, {s} steps: one by one {a:.2f} s, lockstep {l:.2f} s'.format(n=args.episodes, s=sum(steps),
+                                                                                a=alone_time, l=lockstep_time))
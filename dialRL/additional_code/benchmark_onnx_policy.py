@@ -0,0 +1,76 @@
+import sys
+import time
+import argparse
+import torch
+
+from dialRL.models import Trans18, Trans19, Trans28, OnnxPolicy
+from dialRL.environments import DarSeqEnv
+from dialRL.utils import collate_observations
+from dialRL.utils.reward_functions import ConstantReward
+
+'''
+Latency of the onnxruntime policy (--onnx) against the torch models, for batches of 1 and
+--batch_size observations. Their equal logits are tested by tests/test_inference.py.
+
+python dialRL/additional_code/benchmark_onnx_policy.py --targets 16 --drivers 2
+'''
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--targets', default=16, type=int)
+parser.add_argument('--drivers', default=2, type=int)
+parser.add_argument('--batch_size', default=8, type=int)
+parser.add_argument('--repeat', default=50, type=int)
+parser.add_argument('--directory', default='/tmp/onnx_test/', type=str)
+args = parser.parse_args(sys.argv[1:])
+
+torch.manual_seed(0)
+env = DarSeqEnv(size=10, target_population=args.targets, driver_population=args.drivers,
+                reward_function=ConstantReward(), rep_type='16')
+batch = []
+observation = env.reset()
+while len(batch) < args.batch_size:
+    batch.append(observation)
+    observation, reward, done, info = env.step(env.action_space.sample())
+    if done :
+        observation = env.reset()
+
+
+def timing(function, *inputs, **kwargs):
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        function(*inputs, **kwargs)
+    return 1000 * (time.perf_counter() - start) / args.repeat
+
+
+for model_class, typ in [(Trans18, 16), (Trans18, 17), (Trans18, 26), (Trans19, 26), (Trans28, 16)]:
+    kwargs = dict(src_vocab_size=400,
+                  trg_vocab_size=args.targets + 1,
+                  max_length=args.targets*2 + args.drivers + 1,
+                  src_pad_idx=-1,
+                  trg_pad_idx=-1,
+                  embed_size=128,
+                  dropout=0.1,
+                  extremas=env.extremas,
+                  device='cpu',
+                  num_layers=2,
+                  heads=8,
+                  forward_expansion=2,
+                  typ=typ,
+                  max_time=int(env.time_end))
+    if model_class != Trans28:
+        kwargs['classifier_type'] = 1
+    model = model_class(**kwargs).double()
+    model.eval()
+    policy = OnnxPolicy(model, directory=args.directory, verbose=False)
+
+    for size in [1, args.batch_size]:
+        world, targets, drivers, positions, times = collate_observations(batch[:size])[:5]
+        src = [world, targets, drivers]
+        trg = world if typ in [17, 18, 19] else world[1].unsqueeze(-1).long()
+        with torch.no_grad():
+            torch_time = timing(model, src, trg, positions=positions, times=times)
+        # Warm up of the onnxruntime session
+        policy(src, trg, positions=positions, times=times)
+        onnx_time = timing(policy, src, trg, positions=positions, times=times)
+        print('{m} typ {typ} batch {b}: torch {t:.2f} ms, onnxruntime {o:.2f} ms'.format(
+            m=model_class.__name__, typ=typ, b=size, t=torch_time, o=onnx_time))
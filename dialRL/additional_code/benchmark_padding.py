@@ -0,0 +1,38 @@
+import sys
+import random
+import argparse
+
+from dialRL.utils import BucketBatchSampler
+
+'''
+Padding of the batches of instances of different sizes (--bucketing):
+    part of the padding tokens in the batches, random vs size bucketed batches.
+The padded batches equal to the instances alone are tested by tests/test_models.py.
+
+python dialRL/additional_code/benchmark_padding.py --batch_size 32
+'''
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--batch_size', default=32, type=int)
+args = parser.parse_args(sys.argv[1:])
+
+
+def padding_part(batches, instance_sizes):
+    """ Part of the sequence tokens (1 + 2T + D) of the batches that are padding """
+    padded_tokens = tokens = 0
+    for batch in batches:
+        nb_targets = max(instance_sizes[idx][0] for idx in batch)
+        nb_drivers = max(instance_sizes[idx][1] for idx in batch)
+        padded_tokens += len(batch) * (1 + 2*nb_targets + nb_drivers)
+        tokens += sum(1 + 2*instance_sizes[idx][0] + instance_sizes[idx][1] for idx in batch)
+    return 1 - tokens / padded_tokens
+
+
+# Padding of a dataset mixing the sizes, as a2-16 ... a8-96
+instance_sizes = [size for size in [(16, 2), (24, 3), (32, 4), (48, 5), (72, 6), (96, 8)] for _ in range(2000)]
+indices = list(range(len(instance_sizes)))
+random.Random(0).shuffle(indices)
+random_batches = [indices[k:k + args.batch_size] for k in range(0, len(indices), args.batch_size)]
+bucket_batches = list(BucketBatchSampler(instance_sizes, args.batch_size, seed=0))
+print('Padding tokens: random batches {r:.1%}, bucketed batches {b:.1%}'.format(r=padding_part(random_batches, instance_sizes),
+                                                                                b=padding_part(bucket_batches, instance_sizes)))
@@ -0,0 +1,85 @@
+import sys
+import time
+import argparse
+import torch
+
+from dialRL.models import Trans18, set_attention_backend
+from dialRL.environments import DarSeqEnv
+from dialRL.utils import collate_observations
+from dialRL.utils.reward_functions import ConstantReward
+
+'''
+Space / time sparse attention of the Trans18 encoder (--attention_backend sparse):
+forward time and attention energies of the full / sparse attention as the instances grow.
+Its parity with the full attention (every target as neighbour) is tested by tests/test_models.py.
+
+python dialRL/additional_code/benchmark_sparse_attention.py --targets 50 100 200 400 --neighbours 16
+'''
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--targets', default=[50, 100, 200, 400], nargs='+', type=int)
+parser.add_argument('--drivers', default=4, type=int)
+parser.add_argument('--neighbours', default=16, type=int)
+parser.add_argument('--repeat', default=5, type=int)
+args = parser.parse_args(sys.argv[1:])
+
+torch.manual_seed(0)
+
+
+def build_model(nb_targets, nb_drivers, max_time, extremas, typ=26):
+    return Trans18(src_vocab_size=400,
+                   trg_vocab_size=nb_targets + 1,
+                   max_length=nb_targets*2 + nb_drivers + 1,
+                   src_pad_idx=-1,
+                   trg_pad_idx=-1,
+                   embed_size=64,
+                   dropout=0.,
+                   extremas=extremas,
+                   device='cpu',
+                   num_layers=2,
+                   heads=8,
+                   forward_expansion=2,
+                   typ=typ,
+                   max_time=max_time,
+                   classifier_type=1).double().eval()
+
+
+def observations(nb_targets, nb_drivers, nb=1):
+    env = DarSeqEnv(size=10, target_population=nb_targets, driver_population=nb_drivers,
+                    reward_function=ConstantReward(), rep_type='16')
+    observation = env.reset()
+    batch = [observation]
+    while len(batch) < nb:
+        observation, reward, done, info = env.step(env.action_space.sample())
+        batch.append(observation if not done else env.reset())
+    return env, batch
+
+
+def forward(model, world, targets, drivers, positions, times, lengths=None):
+    kwargs = {} if lengths is None else {'lengths': lengths}
+    with torch.no_grad():
+        return model([world, targets, drivers], world[1].unsqueeze(-1).long(), positions=positions, times=times, **kwargs)
+
+
+def timing(model, inputs):
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        forward(model, *inputs)
+    return 1000 * (time.perf_counter() - start) / args.repeat
+
+
+print('\n{:>8} {:>8} {:>12} {:>12} {:>14} {:>14}'.format('targets', 'tokens', 'full ms', 'sparse ms', 'full energies', 'sparse energies'))
+for nb_targets in args.targets:
+    env, batch = observations(nb_targets, args.drivers)
+    model = build_model(nb_targets, args.drivers, int(env.time_end), env.extremas)
+    inputs = collate_observations(batch)[:5]
+    length = 1 + 2*nb_targets + args.drivers
+    set_attention_backend(model, 'einsum')
+    full_time = timing(model, inputs)
+    set_attention_backend(model, 'sparse', neighbours=args.neighbours)
+    forward(model, *inputs)
+    sparse_time = timing(model, inputs)
+    nb_globals = 1 + args.drivers
+    sparse_energies = nb_globals * length + 2*nb_targets * (min(args.neighbours, 2*nb_targets) + nb_globals)
+    print('{:>8} {:>8} {:>12.2f} {:>12.2f} {:>14} {:>14}'.format(nb_targets, length, full_time, sparse_time,
+                                                                 length**2, sparse_energies))
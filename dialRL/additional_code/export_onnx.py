@@ -0,0 +1,59 @@
+import sys
+import argparse
+import torch
+import torch.nn as nn
+
+from dialRL.models import export_onnx, OnnxPolicy
+from dialRL.environments import DarSeqEnv
+from dialRL.utils import collate_observations, torch_load
+from dialRL.utils.reward_functions import *
+
+'''
+ONNX export of a whole saved Trans model for an instance size (targets, drivers).
+The graph takes the flat tensor signature of dialRL.models.onnx_policy (INPUT_NAMES),
+with a dynamic batch dimension, and is checked against the model with onnxruntime.
+Serve it with OnnxPolicy(file_names=[<out>]).
+
+python dialRL/additional_code/export_onnx.py --model data/rl_experiments/<run>/models/best_GAP_model.pt \
+    --targets 16 --drivers 2 --out a2-16.onnx
+'''
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--model', type=str, required=True, help='Whole saved model (.pt)')
+parser.add_argument('--out', type=str, required=True)
+parser.add_argument('--targets', default=16, type=int)
+parser.add_argument('--drivers', default=2, type=int)
+parser.add_argument('--image_size', default=10, type=int)
+parser.add_argument('--rep_type', default='16', type=str)
+parser.add_argument('--world_trg', default=0, type=int, help='The world is the trg input (typ 17, 18, 19)')
+parser.add_argument('--opset', default=17, type=int)
+args = parser.parse_args(sys.argv[1:])
+
+model = torch_load(args.model, map_location='cpu')
+assert isinstance(model, nn.Module), 'The model file has to hold a whole saved model'
+for module in model.modules():
+    if hasattr(module, 'device'):
+        module.device = 'cpu'
+model.eval()
+
+# Example observations of the instance size
+env = DarSeqEnv(size=args.image_size, target_population=args.targets, driver_population=args.drivers,
+                rep_type=args.rep_type, reward_function=ConstantReward())
+batch = []
+observation = env.reset()
+while len(batch) < 4:
+    batch.append(observation)
+    observation, reward, done, info = env.step(env.action_space.sample())
+    if done :
+        observation = env.reset()
+world, targets, drivers, positions, times = collate_observations(batch)[:5]
+src = [world, targets, drivers]
+trg = world if args.world_trg else world[1].unsqueeze(-1).long()
+
+export_onnx(model, src, trg, positions, times, args.out, opset_version=args.opset)
+print('Exported:', args.out)
+
+with torch.no_grad():
+    reference = model(src, trg, positions=positions, times=times)
+output = OnnxPolicy(file_names=[args.out])(src, trg, positions=positions, times=times)
+print('Max diff to the torch model: {d:.2e}'.format(d=(reference - output).abs().max().item()))
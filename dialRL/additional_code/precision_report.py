@@ -0,0 +1,71 @@
+import os
+import sys
+import copy
+import argparse
+import torch
+
+from dialRL.environments import DarSeqEnv
+from dialRL.utils import collate_observations, torch_load, autocast
+from dialRL.utils.reward_functions import ConstantReward
+
+'''
+Decisions of the --precision modes:
+    The float64 model greedily decodes each Cordeau instance of the folder (matching the model sizes).
+    At each of its decisions, the float32 and bf16 (autocast) versions of the model decide on the same
+    observation. Decisions changed while the float64 logits are not tied within --tie are counted.
+The tolerance check is tests/test_precision.py (pytest --checkpoint=<...> --instances=<...>).
+
+python dialRL/additional_code/precision_report.py --checkpoint <rootdir>/data/rl_experiments/<...>/models/best_GAP_model.pt --instances <rootdir>/data/instances/cordeau2006/
+'''
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--checkpoint', type=str, required=True)
+parser.add_argument('--instances', type=str, required=True)
+parser.add_argument('--rep_type', default='16', type=str)
+parser.add_argument('--tie', default=1e-3, type=float)
+args = parser.parse_args(sys.argv[1:])
+
+model64 = torch_load(args.checkpoint, map_location='cpu').double()
+for module in model64.modules():
+    if hasattr(module, 'device'):
+        module.device = 'cpu'
+model64.eval()
+model32 = copy.deepcopy(model64).float()
+
+
+def decide(model, observation, dtype, precision):
+    world, targets, drivers, positions, times = collate_observations([observation], dtype=dtype)[:5]
+    target_tensor = world[1].unsqueeze(-1).long()
+    with torch.no_grad(), autocast(precision, 'cpu'):
+        logits = model([world, targets, drivers], target_tensor, positions=positions, times=times)
+    return logits.double().reshape(-1, logits.shape[-1])[0]
+
+
+for file in sorted(os.listdir(args.instances)):
+    if not file.endswith('.txt') or not file.startswith('a'):
+        continue
+    env = DarSeqEnv(size=10, target_population=1, driver_population=1, reward_function=ConstantReward(),
+                    rep_type=args.rep_type, test_env=True, dataset=args.instances + '/' + file)
+    if 2 * env.target_population + env.driver_population + 1 != model64.max_length:
+        continue
+
+    observation = env.reset()
+    done = False
+    decisions, mismatch = 0, {'float32': 0, 'bf16': 0}
+    max_diff = 0
+    while not done:
+        logits64 = decide(model64, observation, torch.float64, 'float64')
+        action = logits64.argmax().item()
+        top2 = logits64.topk(2).values
+        tied = (top2[0] - top2[1]).item() < args.tie
+        for precision in ['float32', 'bf16']:
+            logits = decide(model32, observation, torch.float32, precision)
+            if precision == 'float32':
+                max_diff = max(max_diff, (logits - logits64).abs().max().item())
+            if logits.argmax().item() != action and not tied:
+                mismatch[precision] += 1
+        decisions += 1
+        observation, reward, done, info = env.step(action)
+
+    print(file, 'decisions:', decisions, '| float32 mismatch:', mismatch['float32'], '| bf16 mismatch:', mismatch['bf16'],
+          '| max float32 logit diff: {d:.2e}'.format(d=max_diff), '| fit:', info['fit_solution'])
@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+import argparse
+import torch
+import torch.nn as nn
+
+from dialRL.models import quantize_model, save_quantized
+from dialRL.environments import DarSeqEnv
+from dialRL.utils import collate_observations, torch_load
+from dialRL.utils.reward_functions import *
+
+'''
+Float vs dynamic INT8 quantized model (--quantize) on the Cordeau instances:
+    - greedy episode of each model: fit solution, deliveries, GAP to the best known solution
+    - decision agreement: same greedy action as the float model along the float model episode
+    - mean decision latency (model forward) of both models
+
+python dialRL/additional_code/quantization_report.py --model data/rl_experiments/<run>/models/best_GAP_model.pt \
+    --instances a2-16 a2-20 a2-24 --out quantized_model.pt
+'''
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--model', type=str, required=True, help='Whole saved model (.pt)')
+parser.add_argument('--rootdir', default=os.getcwd(), type=str)
+parser.add_argument('--instances', default=['a2-16'], nargs='+', type=str)
+parser.add_argument('--image_size', default=10, type=int)
+parser.add_argument('--rep_type', default='16', type=str)
+parser.add_argument('--reward_function', default='ConstantReward', type=str)
+parser.add_argument('--out', default='', type=str, help='Saves the quantized model')
+parser.add_argument('--threads', default=1, type=int)
+args = parser.parse_args(sys.argv[1:])
+
+torch.set_num_threads(args.threads)
+instance_folder = args.rootdir + '/data/instances/cordeau2006/'
+
+float_model = torch_load(args.model, map_location='cpu')
+assert isinstance(float_model, nn.Module), 'The model file has to hold a whole saved model'
+for module in float_model.modules():
+    if hasattr(module, 'device'):
+        module.device = 'cpu'
+float_model.eval()
+quantized_model = quantize_model(float_model)
+if args.out :
+    save_quantized(quantized_model, args.out)
+    print('Quantized model saved as:', args.out)
+
+best_costs = {}
+with open(instance_folder + 'gschwind_results.txt') as f:
+    for line in f :
+        inst, bks = line.split(' ')
+        best_costs[inst] = float(bks)
+
+
+def decision(model, observation):
+    """ Greedy action and forward time of a model on one observation """
+    world, targets, drivers, positions, times = collate_observations([observation])[:5]
+    if model.typ in [17, 18, 19]:
+        target_tensor = world
+    else :
+        target_tensor = world[1].unsqueeze(-1).long()
+    start = time.perf_counter()
+    with torch.no_grad():
+        out = model([world, targets, drivers], target_tensor, positions=positions, times=times)
+    elapsed = time.perf_counter() - start
+    if out.dim() == 3:
+        out = out[:, 0]
+    return out.argmax(-1).item(), elapsed
+
+
+def episode(model, inst_name, reference=None):
+    """ Greedy episode on an instance, with the agreement to the reference model along it """
+    nb_drivers, nb_targets = map(int, inst_name[1:].split('-'))
+    env = DarSeqEnv(size=args.image_size, target_population=nb_targets, driver_population=nb_drivers,
+                    rep_type=args.rep_type, reward_function=globals()[args.reward_function](),
+                    test_env=True, dataset=instance_folder + inst_name + '.txt')
+    env.best_cost = best_costs.get(inst_name, 1)
+    observation = env.reset()
+    done = False
+    decisions = agreements = latency = 0
+    while not done:
+        action, elapsed = decision(model, observation)
+        if reference is not None:
+            agreements += reference(observation) == action
+        latency += elapsed
+        decisions += 1
+        observation, reward, done, info = env.step(action)
+    return {'fit': info['fit_solution'], 'delivered': info['delivered'], 'GAP': info['GAP'],
+            'distance': env.total_distance, 'decisions': decisions,
+            'latency (ms)': 1000 * latency / decisions, 'agreement': agreements / decisions}
+
+
+print('\n{:>8} {:>10} {:>5} {:>10} {:>10} {:>12} {:>10}'.format('instance', 'model', 'fit', 'delivered', 'GAP', 'latency ms', 'agreement'))
+summary = {'float': [], 'int8': []}
+for inst_name in args.instances:
+    float_stats = episode(float_model, inst_name,
+                          reference=lambda observation: decision(quantized_model, observation)[0])
+    int8_stats = episode(quantized_model, inst_name)
+    int8_stats['agreement'] = float_stats['agreement']
+    for name, stats in [('float', float_stats), ('int8', int8_stats)]:
+        summary[name].append(stats)
+        print('{:>8} {:>10} {:>5} {:>10} {:>10.2f} {:>12.2f} {:>10.3f}'.format(
+            inst_name, name, stats['fit'], stats['delivered'], stats['GAP'], stats['latency (ms)'], stats['agreement']))
+
+float_latency = sum(s['latency (ms)'] for s in summary['float']) / len(summary['float'])
+int8_latency = sum(s['latency (ms)'] for s in summary['int8']) / len(summary['int8'])
+print('\nMean decision agreement: {a:.3f}'.format(a=sum(s['agreement'] for s in summary['float']) / len(summary['float'])))
+print('Mean GAP float {f:.2f} / int8 {q:.2f}'.format(f=sum(s['GAP'] for s in summary['float']) / len(summary['float']),
+                                                      q=sum(s['GAP'] for s in summary['int8']) / len(summary['int8'])))
+print('Mean decision latency float {f:.2f} ms / int8 {q:.2f} ms (x{r:.2f})'.format(f=float_latency, q=int8_latency,
+                                                                                   r=float_latency / int8_latency))
@@ -1,5 +1,7 @@
 from dialRL.dataset.data_file_generator import DataFileGenerator
+from dialRL.dataset.manifest import add_shard, update_manifest, load_manifest, manifest_histogram, shard_labels, shard_sizes
 from dialRL.dataset.rf_generator import RFGenerator
 # from dialRL.dataset.run_rf_algo import run_rf_algo
 
-__all__ = ['DataFileGenerator', 'RFGenerator']
+__all__ = ['DataFileGenerator', 'RFGenerator', 'add_shard', 'update_manifest', 'load_manifest', 'manifest_histogram',
+           'shard_labels', 'shard_sizes']
@@ -54,12 +54,16 @@ class DataFileGenerator():
             self.data_size = data_size
 
 
-    def generate_file(self, tmp_name=None):
+    def generate_file(self, tmp_name=None, seed=None):
+        """ seed: of the random instances (seed + n), as the time seeded ones repeat within a second """
         file_names = []
         os.makedirs(self.out_dir, exist_ok=True)
         for n in range(self.data_size):
 
-            observation = self.env.reset()
+            if seed is None :
+                observation = self.env.reset()
+            else :
+                observation = self.env.reset(seed=seed + n)
             text_lists = []
 
             text_lists.append([self.env.driver_population, self.env.target_population, self.env.time_limit, self.env.drivers[0].max_capacity, self.env.max_ride_time])
@@ -0,0 +1,105 @@
+import os
+import json
+import numpy as np
+
+from dialRL.utils import torch_load
+
+'''
+The manifest.json of a supervision data folder describes its shards (dataset_element .pt files):
+    { shard file name: {'size': number of samples,
+                        'histogram': count of each supervised action} }
+The per sample values of a shard are in side files next to it:
+    <shard>.labels.npy: supervised action of each sample
+    <shard>.sizes.npy: [targets, drivers] of the instance of each sample
+They are written along the shards by the generators, so that the class balancing
+never has to go through the data itself.
+'''
+
+MANIFEST_NAME = 'manifest.json'
+LABELS_SUFFIX = '.labels.npy'
+SIZES_SUFFIX = '.sizes.npy'
+
+
+def read_manifest(directory):
+    path = os.path.join(directory, MANIFEST_NAME)
+    if not os.path.isfile(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(directory, manifest):
+    path = os.path.join(directory, MANIFEST_NAME)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f)
+    os.replace(path + '.tmp', path)
+
+
+def shard_entry(labels):
+    return {'size': len(labels),
+            'histogram': np.bincount(labels).tolist() if len(labels) else []}
+
+
+def add_shard(file_name, data):
+    """ Side files of a newly saved shard -> its manifest entry (see update_manifest) """
+    labels = np.array([int(action) for observation, action in data], dtype=np.int64)
+    sizes = np.array([[len(observation[1]), len(observation[2])] for observation, action in data], dtype=np.int64)
+    np.save(file_name + LABELS_SUFFIX, labels)
+    np.save(file_name + SIZES_SUFFIX, sizes.reshape(-1, 2))
+    return shard_entry(labels)
+
+
+def update_manifest(entries):
+    """ Records the entries {shard full name: entry} in the manifests of their folders, once per folder """
+    directories = {}
+    for file, entry in entries.items():
+        directory, name = os.path.split(file)
+        directories.setdefault(directory, {})[name] = entry
+    for directory, names in directories.items():
+        manifest = read_manifest(directory)
+        manifest.update(names)
+        write_manifest(directory, manifest)
+
+
+def shard_labels(file_name):
+    """ Supervised action of each sample of the shard """
+    return np.load(file_name + LABELS_SUFFIX)
+
+
+def shard_sizes(file_name):
+    """ Instance size [targets, drivers] of each sample of the shard """
+    return np.load(file_name + SIZES_SUFFIX).tolist()
+
+
+def load_manifest(files_names, fill=False):
+    """ Manifest entries of the shards, indexed by their full name.
+        Shards without an entry or side files (generated before the manifest existed) are read once.
+        With fill (main process only) their entries and side files are written, else they are only kept in memory.
+    """
+    entries = {}
+    missing = {}
+    manifests = {}
+    for file in files_names:
+        directory, name = os.path.split(file)
+        if directory not in manifests:
+            manifests[directory] = read_manifest(directory)
+        entry = manifests[directory].get(name, {})
+        complete = 'histogram' in entry and os.path.isfile(file + LABELS_SUFFIX) and os.path.isfile(file + SIZES_SUFFIX)
+        if not complete and fill :
+            print('Adding to the manifest:', file)
+            entry = missing[file] = add_shard(file, torch_load(file).data)
+        elif not complete :
+            entry = shard_entry([int(action) for observation, action in torch_load(file).data])
+        entries[file] = entry
+    if missing :
+        update_manifest(missing)
+    return entries
+
+
+def manifest_histogram(entries, nb_actions):
+    """ Sum of the action histograms of the manifest entries """
+    histogram = np.zeros(nb_actions)
+    for entry in entries:
+        counts = entry['histogram'][:nb_actions]
+        histogram[:len(counts)] += counts
+    return histogram
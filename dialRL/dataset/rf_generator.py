@@ -1,15 +1,14 @@
 from dialRL.strategies import CompleteRoute
 from dialRL.dataset import DataFileGenerator
+from dialRL.dataset.manifest import add_shard, update_manifest
 from dialRL.environments import DarSeqEnv
 from darp_rf import run_rf_algo
 from dialRL.utils import get_device, objdict, SupervisionDataset
 from dialRL.utils.reward_functions import  *
 
-from torch.utils.data import ConcatDataset, ChainDataset
 import os
 import torch
 import sys
-import numpy as np
 
 from icecream import ic
 
@@ -81,68 +80,7 @@ class RFGenerator():
 
     def load_dataset(self):
         files_names = os.listdir(self.saving_name)
-        return [self.saving_name + file for file in os.listdir(self.saving_name)]
-
-        datasets = []
-        for file in files_names:
-            print('Datafile folder:', self.saving_name)
-            print(file)
-            datasets.append(torch.load(self.saving_name + file))
-
-        # data, sup = datasets[0][0]
-        # world, targets, drivers, positions, time_constraints = data
-        # ic(world, targets, drivers, positions, time_constraints)
-        # data, sup = datasets[1][0]
-        # world, targets, drivers, positions, time_constraints = data
-        # ic(world, targets, drivers, positions, time_constraints)
-
-        datasets = self.refill_data(datasets)
-        # for i in range(len(datasets[0][0][0])):
-        #     ic(datasets[0][0][0][i])
-        #     ic(datasets[1][0][0][i])
-        # for i in range(len(datasets[0][0][0])):
-        #     ic(np.shape(datasets[0][0][0][i]))
-        #     ic(np.shape(datasets[1][0][0][i]))
-        return ConcatDataset(datasets)
-
-    def refill_data(self, datasets):
-        new_datasets = []
-        for sub_dataset in datasets:
-            current_target_size = len(sub_dataset[0][0][1])
-            current_driver_size = len(sub_dataset[0][0][2])
-
-            target_to_add = self.nb_target - current_target_size
-            driver_to_add = self.nb_drivers - current_driver_size
-            if target_to_add > 0 or driver_to_add > 0:
-                new_data = []
-                # Add extra zeros to match desired size.
-                for data in sub_dataset:
-                    world, targets, drivers, positions, time_constraints = data[0]
-
-                    # Adding Zeros to targets
-                    targets = targets + list(map(list, list(np.zeros((target_to_add, 3), dtype=np.float64))))
-                    positions[1] = positions[1] + list(np.zeros((target_to_add, 4), dtype=np.float64))
-                    time_constraints[1] = time_constraints[1] + list(np.zeros((target_to_add, 4), dtype=np.float64))
-                    # Adding Zeros to drivers
-                    drivers = drivers + np.zeros((driver_to_add, len(drivers[-1])), dtype=np.float64).tolist()
-                    positions[2] = positions[2] + list(np.zeros((driver_to_add, 2), dtype=np.float64))
-                    time_constraints[2].append(np.float64(0))
-
-                    obs = world, targets, drivers, positions, time_constraints
-                    new_data.append([obs, data[1]])
-
-                new_datasets.append(new_data)
-
-            elif target_to_add < 0 :
-                # Undesired case
-                raise "Error of desired size < target size in the data"
-
-            elif target_to_add == 0:
-                # Perfect data. Don't tuch it
-                new_datasets.append(sub_dataset)
-
-        return new_datasets
-
+        return [self.saving_name + file for file in files_names if file.endswith('.pt')]
 
     def generate_dataset(self):
         """
@@ -160,6 +98,7 @@ class RFGenerator():
         print('Going to generate a max of', self.instances_number, ' instances. Aiming to get a total of ', self.data_size, ' datapoints')
 
         data = []
+        shards = {}
         i = 0
 
         while (self.last_save_size + len(data) < self.data_size) and i < self.instances_number: #len(data) < self.data_size and i < self.instances_number:
@@ -217,6 +156,7 @@ class RFGenerator():
                     train_data = SupervisionDataset(data, augment=self.augment, typ=self.typ)
                     saving_name = self.partial_name(len(data))
                     torch.save(train_data, saving_name)
+                    shards[saving_name] = add_shard(saving_name, data)
                     data = []
                     print('Saving data status')
 
@@ -227,7 +167,9 @@ class RFGenerator():
             train_data = SupervisionDataset(data, augment=self.augment, typ=self.typ)
             saving_name = self.partial_name(len(data))
             torch.save(train_data, saving_name)
+            shards[saving_name] = add_shard(saving_name, data)
             print('Last data element in ', self.saving_name)
+        update_manifest(shards)
 
         if len(data) + self.last_save_size < self.data_size :
             print('***************************************************************')
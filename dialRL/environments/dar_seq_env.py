@@ -111,6 +111,17 @@ class DarSeqEnv(DarEnv):
     def is_fit_solution(self):
         return int(self.targets_states()[4] == self.target_population)
 
+    def action_mask(self):
+        """ Feasible actions of the current driver (--masked_decoding): targets it can pick up or drop off
+            in time, the wait action (0) only when no target is feasible. Boolean array of the action space.
+        """
+        driver = self.drivers[self.current_player - 1]
+        mask = np.zeros(self.target_population + 1, dtype=bool)
+        for target in self.targets :
+            mask[target.identity] = target.state in [-2, 0] and driver.can_aim(target, self.time_step)
+        mask[0] = not mask.any()
+        return mask
+
     def nearest_target(self, position):
         choosen = (None, np.inf)
         for target in self.targets :
@@ -432,7 +443,8 @@ class DarSeqEnv(DarEnv):
         return image
 
 
-    def reset(self):
+    def reset(self, seed=None):
+        """ New instance: the dataset one, or randomly generated (seeded by the time if no seed is given) """
         self.instance = DarPInstance(size=self.size,
                                     population=self.target_population,
                                     drivers=self.driver_population,
@@ -449,7 +461,7 @@ class DarSeqEnv(DarEnv):
         elif self.test_env and self.dataset:
             self.instance.dataset_generation(self.dataset)
         else :
-            self.instance.random_generation(timeless=self.timeless)
+            self.instance.random_generation(timeless=self.timeless, seed=seed)
 
         # print('* Reset - Instance image : ', self.instance.image)
         self.targets = self.instance.targets.copy()
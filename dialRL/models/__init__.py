@@ -11,6 +11,12 @@ from dialRL.models.transformer17 import Trans17
 from dialRL.models.transformer18 import Trans18
 from dialRL.models.transformer19 import Trans19
 from dialRL.models.transformer3 import Trans3
+from dialRL.models.compiled import CompiledPolicy
+from dialRL.models.attention import SelfAttention, set_attention_backend
+from dialRL.models.sparse_attention import NeighbourIndex
+from dialRL.models.session import InferenceSession
+from dialRL.models.quantization import quantize_model, is_quantized, save_quantized, load_quantized
+from dialRL.models.onnx_policy import OnnxPolicy, export_onnx
 
 __all__ = ['Trans1',
            'Trans2',
@@ -22,4 +28,15 @@ __all__ = ['Trans1',
            'Trans18',
            'Trans19',
            'Trans3',
+           'CompiledPolicy',
+           'SelfAttention',
+           'set_attention_backend',
+           'NeighbourIndex',
+           'InferenceSession',
+           'quantize_model',
+           'is_quantized',
+           'save_quantized',
+           'load_quantized',
+           'OnnxPolicy',
+           'export_onnx',
            'DQN']
@@ -0,0 +1,149 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from dialRL.models.sparse_attention import SparsePattern, NeighbourIndex
+
+
+ATTENTION_BACKENDS = ['einsum', 'sdpa', 'sparse']
+
+
+class SelfAttention(nn.Module):
+    """ Multi head attention of the Trans models.
+        The values / keys / queries projections are shared by the heads (head_dim x head_dim)
+        and the energies are scaled by sqrt(embed_size).
+        Backends (see --attention_backend, set_attention_backend):
+            - 'einsum': explicit [N, heads, query_len, key_len] energies, masked_fill and softmax
+            - 'sdpa': fused torch.nn.functional.scaled_dot_product_attention with a boolean mask,
+                      the energies are not materialised (when a fused kernel applies)
+            - 'sparse': the Trans18 encoder gives a SparsePattern as mask (see NeighbourIndex),
+                      each target token only attends to its keys of the pattern, 'einsum' otherwise
+        Both give the same outputs, but for query rows where every key is masked
+        (uniform weights with 'einsum', NaN with 'sdpa').
+    """
+    def __init__(self, embed_size, heads):
+        super(SelfAttention, self).__init__()
+        self.embed_size = embed_size
+        self.heads = heads
+        self.head_dim = embed_size // heads
+        self.backend = 'einsum'
+
+        assert (
+            self.head_dim * heads == embed_size
+        ), "Embedding size needs to be divisible by heads"
+
+        self.values = nn.Linear(self.head_dim, self.head_dim, bias=False)
+        self.keys = nn.Linear(self.head_dim, self.head_dim, bias=False)
+        self.queries = nn.Linear(self.head_dim, self.head_dim, bias=False)
+        self.fc_out = nn.Linear(heads * self.head_dim, embed_size)
+
+    def forward(self, values, keys, query, mask):
+        keys, values = self.project_keys_values(values, keys)
+        return self.attend(query, keys, values, mask)
+
+    def project_keys_values(self, values, keys):
+        """ Keys and values projections, (N, len, heads, head_dim): they only depend on their own
+            token, so that they can be kept along an incremental decoding (see Trans28.decode_step)
+        """
+        # Split the embedding into self.heads different pieces
+        values = values.reshape(values.shape[0], values.shape[1], self.heads, self.head_dim)
+        keys = keys.reshape(keys.shape[0], keys.shape[1], self.heads, self.head_dim)
+
+        values = self.values(values)  # (N, value_len, heads, head_dim)
+        keys = self.keys(keys)  # (N, key_len, heads, head_dim)
+        return keys, values
+
+    def attend(self, query, keys, values, mask):
+        """ Attention of the query tokens over projected keys and values """
+        # Get number of training examples
+        N, query_len = query.shape[0], query.shape[1]
+
+        query = query.reshape(N, query_len, self.heads, self.head_dim)
+        queries = self.queries(query)  # (N, query_len, heads, heads_dim)
+
+        # Modules pickled before the backends have no attribute
+        if isinstance(mask, SparsePattern):
+            out = self.sparse_attention(queries, keys, values, mask)
+        elif getattr(self, 'backend', 'einsum') == 'sdpa':
+            out = self.fused_attention(queries, keys, values, mask)
+        else :
+            out = self.einsum_attention(queries, keys, values, mask)
+
+        out = self.fc_out(out.reshape(N, query_len, self.heads * self.head_dim))
+        # Linear layer doesn't modify the shape, final shape will be
+        # (N, query_len, embed_size)
+
+        return out
+
+    def einsum_attention(self, queries, keys, values, mask):
+        energy = torch.einsum("nqhd,nkhd->nhqk", [queries, keys])
+        # queries shape: (N, query_len, heads, heads_dim),
+        # keys shape: (N, key_len, heads, heads_dim)
+        # energy: (N, heads, query_len, key_len)
+
+        # Mask padded indices so their weights become 0
+        if mask is not None:
+            energy = energy.masked_fill(mask == 0, float("-1e20"))
+
+        # Normalize energy values similarly to seq2seq + attention
+        # so that they sum to 1. Also divide by scaling factor for
+        # better stability
+        attention = torch.softmax(energy / (self.embed_size ** (1 / 2)), dim=3)
+        # attention shape: (N, heads, query_len, key_len)
+
+        return torch.einsum("nhql,nlhd->nqhd", [attention, values])
+        # values shape: (N, value_len, heads, heads_dim)
+        # out: (N, query_len, heads, head_dim)
+
+    def fused_attention(self, queries, keys, values, mask):
+        # (N, heads, len, head_dim) layout, the default scale of sdpa (1 / sqrt(head_dim))
+        # is brought to the 1 / sqrt(embed_size) of the model on the queries
+        queries = queries.transpose(1, 2) * (self.head_dim / self.embed_size) ** (1 / 2)
+        keys = keys.transpose(1, 2)
+        values = values.transpose(1, 2)
+        if mask is not None:
+            # True: attend, broadcasted over (N, heads, query_len, key_len)
+            mask = mask != 0
+        out = F.scaled_dot_product_attention(queries, keys, values, attn_mask=mask)
+        return out.transpose(1, 2)
+
+    def sparse_attention(self, queries, keys, values, pattern):
+        """ Global tokens over every key, target tokens over the keys of their pattern:
+            [N, heads, G, L] and [N, heads, 2T, K + G] energies instead of [N, heads, L, L]
+        """
+        N, length, heads, head_dim = keys.shape
+        nb_tokens, nb_keys = pattern.index.shape[1:]
+        out = torch.empty_like(queries)
+        out[:, pattern.global_index] = self.einsum_attention(queries[:, pattern.global_index], keys, values, pattern.mask)
+
+        index = pattern.index.reshape(N, nb_tokens * nb_keys, 1, 1).expand(-1, -1, heads, head_dim)
+        local_keys = keys.gather(1, index).reshape(N, nb_tokens, nb_keys, heads, head_dim)
+        local_values = values.gather(1, index).reshape(N, nb_tokens, nb_keys, heads, head_dim)
+        energy = torch.einsum("nqhd,nqkhd->nhqk", [queries[:, 1:nb_tokens+1], local_keys])
+        energy = energy.masked_fill(~pattern.valid.unsqueeze(1), float("-1e20"))
+        attention = torch.softmax(energy / (self.embed_size ** (1 / 2)), dim=3)
+        out[:, 1:nb_tokens+1] = torch.einsum("nhqk,nqkhd->nqhd", [attention, local_values])
+        return out
+
+
+def set_attention_backend(model, backend, neighbours=16, time_weight=1.):
+    """ Attention backend ('einsum', 'sdpa' or 'sparse') of every SelfAttention of the model.
+        'sparse': the encoder of a Trans18 attends to the `neighbours` nearest target tokens (NeighbourIndex)
+    """
+    if backend not in ATTENTION_BACKENDS:
+        raise ValueError('Unknown attention backend: ' + str(backend))
+    if backend == 'sdpa' and not hasattr(F, 'scaled_dot_product_attention'):
+        print('/!\\ scaled_dot_product_attention is not available in this torch version, using einsum')
+        backend = 'einsum'
+    if backend == 'sparse' and not hasattr(model, 'sparse_attention'):
+        print('/!\\ The sparse attention is only available for the Trans18 encoder, using einsum')
+        backend = 'einsum'
+    elif backend == 'sparse' and model.typ not in [16, 17, 18, 19, 26]:
+        print('/!\\ The sparse attention needs the env encodings typ 16, 17, 18, 19 or 26, using einsum')
+        backend = 'einsum'
+    if hasattr(model, 'sparse_attention'):
+        model.sparse_attention = NeighbourIndex(neighbours, time_weight) if backend == 'sparse' else None
+    for module in model.modules():
+        if isinstance(module, SelfAttention):
+            module.backend = backend
+    return backend
@@ -0,0 +1,127 @@
+import time
+import torch
+import torch.nn as nn
+
+
+def flatten_inputs(inputs):
+    """ Nested lists of tensors -> (list of the tensors, structure)
+        The structure holds the nesting and the non tensor leaves.
+    """
+    if torch.is_tensor(inputs):
+        return [inputs], None
+    elif isinstance(inputs, (list, tuple)):
+        leaves, structure = [], []
+        for elmt in inputs:
+            elmt_leaves, elmt_structure = flatten_inputs(elmt)
+            structure.append((len(elmt_leaves), elmt_structure))
+            leaves += elmt_leaves
+        return leaves, structure
+    return [], ('constant', inputs)
+
+
+def unflatten_inputs(leaves, structure):
+    """ Inverse of flatten_inputs """
+    if structure is None:
+        return leaves[0]
+    elif isinstance(structure, tuple):
+        return structure[1]
+    out, start = [], 0
+    for nb_leaves, elmt_structure in structure:
+        out.append(unflatten_inputs(leaves[start:start + nb_leaves], elmt_structure))
+        start += nb_leaves
+    return out
+
+
+def freeze_structure(structure):
+    """ Hashable version of the structure """
+    if isinstance(structure, list):
+        return tuple((nb, freeze_structure(elmt)) for nb, elmt in structure)
+    return structure
+
+
+class FlatForward(nn.Module):
+    """ forward(*leaves) of a Trans model for a given structure of inputs:
+        the (src, trg, positions, times (, lengths)) nested lists are rebuilt inside the graph.
+    """
+    def __init__(self, model, structure):
+        super(FlatForward, self).__init__()
+        self.model = model
+        self.structure = structure
+
+    def forward(self, *leaves):
+        inputs = unflatten_inputs(list(leaves), self.structure)
+        src, trg, positions, times = inputs[:4]
+        if len(inputs) > 4:
+            return self.model(src, trg, positions=positions, times=times, lengths=inputs[4])
+        return self.model(src, trg, positions=positions, times=times)
+
+
+class CompiledPolicy(nn.Module):
+    """ Compiled forward of the Trans models (see --compile).
+        The first call with a new input shape traces the model (backend 'jit', torch.jit.trace)
+        or compiles it (backend 'compile', torch.compile with static shapes). The `typ` and
+        `classifier_type` branches and the per target / driver loops of the encodings are
+        resolved at that time, the graph only holds the operations of this configuration.
+        Graphs are kept in a cache keyed by the input shapes, dtypes and train / eval mode.
+        The parameters are the ones of the wrapped model (training and saving go through it).
+    """
+    def __init__(self, model, backend='jit', verbose=True):
+        super(CompiledPolicy, self).__init__()
+        if backend == 'compile' and not hasattr(torch, 'compile'):
+            print('/!\\ torch.compile is not available in this torch version, using torch.jit.trace')
+            backend = 'jit'
+        if backend not in ['jit', 'compile']:
+            raise ValueError('Unknown compile backend: ' + str(backend))
+        self.model = model
+        self.backend = backend
+        self.verbose = verbose
+        self.graphs = {}
+
+    @property
+    def dtype(self):
+        return self.model.dtype
+
+    def summary(self):
+        self.model.summary()
+
+    def key(self, leaves, structure):
+        return (freeze_structure(structure),
+                tuple((tuple(leaf.shape), leaf.dtype) for leaf in leaves),
+                self.model.training)
+
+    def build(self, leaves, structure):
+        flat_forward = FlatForward(self.model, structure)
+        start = time.time()
+        if self.backend == 'jit':
+            # Traced graphs keep the random ops (dropout) of the training mode
+            graph = torch.jit.trace(flat_forward, tuple(leaves), check_trace=False)
+        else :
+            graph = torch.compile(flat_forward, dynamic=False)
+        # Warm up: the first runs of a graph are profiled and optimized
+        with torch.no_grad():
+            for _ in range(3):
+                graph(*leaves)
+        if self.verbose :
+            print(' - Compiled ({b}) forward for batches of {s} in {t:.2f}s'.format(b=self.backend,
+                                                                                s=leaves[0].shape[0],
+                                                                                t=time.time() - start))
+        return graph
+
+    def warmup(self, src, trg, positions, times):
+        """ Builds the graph of these inputs ahead of time """
+        leaves, structure = flatten_inputs([src, trg, positions, times])
+        key = self.key(leaves, structure)
+        if key not in self.graphs:
+            self.graphs[key] = self.build(leaves, structure)
+        return self.graphs[key]
+
+    def forward(self, src, trg, positions, times, lengths=None):
+        inputs = [src, trg, positions, times]
+        if lengths is not None:
+            inputs.append(lengths)
+        leaves, structure = flatten_inputs(inputs)
+        key = self.key(leaves, structure)
+        graph = self.graphs.get(key)
+        if graph is None:
+            graph = self.graphs[key] = self.build(leaves, structure)
+        return graph(*leaves)
@@ -0,0 +1,144 @@
+import os
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+
+try :
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+
+# Flat tensor signature of the Trans models, B: batch, T: targets, D: drivers
+INPUT_NAMES = ['world',             # [B, W] world features (current time, current player, ...)
+               'targets',           # [B, T, F] targets features
+               'drivers',           # [B, D, F] drivers features
+               'depot_position',    # [B, 2]
+               'targets_positions', # [B, T, 4] pickup and dropoff positions
+               'drivers_positions', # [B, D, 2]
+               'current_time',      # [B]
+               'targets_times',     # [B, T, 4] pickup and dropoff time windows
+               'drivers_times',     # [B, D]
+               'trg']               # [B, 1] current player (absent when the world is the trg, typ 17 / 18 / 19)
+ONNX_TYPES = {'tensor(double)': np.float64, 'tensor(float)': np.float32,
+              'tensor(int64)': np.int64, 'tensor(int32)': np.int32, 'tensor(bool)': np.bool_}
+
+
+def stack_inputs(src, trg, positions, times):
+    """ Nested lists inputs of the Trans models -> tensors of the flat signature (INPUT_NAMES) """
+    world, targets, drivers = src
+    inputs = [torch.stack(world, dim=-1),
+              torch.stack([torch.stack(target, dim=-1) for target in targets], dim=1),
+              torch.stack([torch.stack(driver, dim=-1) for driver in drivers], dim=1),
+              positions[0],
+              torch.stack(positions[1], dim=1),
+              torch.stack(positions[2], dim=1),
+              times[0],
+              torch.stack(times[1], dim=1),
+              torch.stack(times[2], dim=1)]
+    if torch.is_tensor(trg):
+        inputs.append(trg)
+    return inputs
+
+
+class StackedForward(nn.Module):
+    """ forward of a Trans model on the flat tensor signature (INPUT_NAMES):
+        the nested lists are rebuilt inside the graph, so that the model can be exported.
+    """
+    def __init__(self, model, world_trg=False):
+        super(StackedForward, self).__init__()
+        self.model = model
+        self.world_trg = world_trg
+
+    def forward(self, world, targets, drivers, depot_position, targets_positions, drivers_positions,
+                current_time, targets_times, drivers_times, trg=None):
+        world = list(world.unbind(-1))
+        src = [world,
+               [list(target.unbind(-1)) for target in targets.unbind(1)],
+               [list(driver.unbind(-1)) for driver in drivers.unbind(1)]]
+        positions = [depot_position, list(targets_positions.unbind(1)), list(drivers_positions.unbind(1))]
+        times = [current_time, list(targets_times.unbind(1)), list(drivers_times.unbind(1))]
+        if self.world_trg :
+            trg = world
+        return self.model(src, trg, positions=positions, times=times)
+
+
+def export_onnx(model, src, trg, positions, times, file_name, opset_version=17):
+    """ ONNX export of a Trans model for the sizes (targets, drivers) of the example inputs,
+        the batch dimension is dynamic.
+    """
+    world_trg = not torch.is_tensor(trg)
+    inputs = stack_inputs(src, trg, positions, times)
+    names = INPUT_NAMES[:len(inputs)]
+    was_training = model.training
+    model.eval()
+    os.makedirs(os.path.dirname(os.path.abspath(file_name)), exist_ok=True)
+    kwargs = {}
+    if 'dynamo' in torch.onnx.export.__code__.co_varnames:
+        # TorchScript based exporter (the dynamo one needs onnxscript)
+        kwargs['dynamo'] = False
+    with torch.no_grad():
+        torch.onnx.export(StackedForward(model, world_trg=world_trg), tuple(inputs), file_name,
+                          input_names=names,
+                          output_names=['logits'],
+                          dynamic_axes={name: {0: 'batch'} for name in names + ['logits']},
+                          opset_version=opset_version,
+                          **kwargs)
+    model.train(was_training)
+    return file_name
+
+
+class OnnxPolicy():
+    """ onnxruntime inference of a Trans model (see --onnx), called as the model:
+        policy(src, trg, positions=, times=) -> logits (torch tensor).
+        An ONNX graph holds one instance size (targets, drivers): the graphs are kept in a cache
+        keyed by these sizes, the missing ones are exported from the model on their first call.
+        reset() drops the graphs, to be called when the model weights changed.
+        Graphs exported beforehand (export_onnx) are given with file_names, without a model.
+    """
+    def __init__(self, model=None, directory='onnx/', file_names=[], threads=1, device='cpu', verbose=True):
+        if onnxruntime is None:
+            raise ImportError('onnxruntime is needed for the ONNX policy (pip install onnxruntime)')
+        self.model = model
+        self.directory = directory
+        self.device = device
+        self.threads = threads
+        self.verbose = verbose
+        self.sessions = {}
+        for file_name in file_names:
+            self.load(file_name)
+
+    def reset(self):
+        self.sessions = {}
+
+    def load(self, file_name):
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = self.threads
+        session = onnxruntime.InferenceSession(file_name, options, providers=['CPUExecutionProvider'])
+        shapes = {node.name: node.shape for node in session.get_inputs()}
+        self.sessions[(shapes['targets'][1], shapes['drivers'][1])] = session
+        return session
+
+    def build(self, src, trg, positions, times):
+        if self.model is None:
+            raise ValueError('No ONNX graph for these input shapes and no model to export')
+        nb_targets, nb_drivers = len(src[1]), len(src[2])
+        file_name = os.path.join(self.directory, '{m}_{t}_{d}.onnx'.format(m=type(self.model).__name__, t=nb_targets, d=nb_drivers))
+        start = time.time()
+        export_onnx(self.model, src, trg, positions, times, file_name)
+        session = self.load(file_name)
+        if self.verbose :
+            print(' - ONNX export of the model for {t} targets and {d} drivers in {s:.2f}s: {f}'.format(
+                t=nb_targets, d=nb_drivers, s=time.time() - start, f=file_name))
+        return session
+
+    def __call__(self, src, trg, positions=None, times=None):
+        session = self.sessions.get((len(src[1]), len(src[2])))
+        if session is None:
+            session = self.build(src, trg, positions, times)
+        # The inputs that the model does not use are not in the graph
+        inputs = dict(zip(INPUT_NAMES, stack_inputs(src, trg, positions, times)))
+        feed = {node.name: inputs[node.name].detach().cpu().numpy().astype(ONNX_TYPES[node.type], copy=False)
+                for node in session.get_inputs()}
+        return torch.from_numpy(session.run(None, feed)[0]).to(self.device)
@@ -0,0 +1,55 @@
+import copy
+import torch
+import torch.nn as nn
+
+from dialRL.models.transformer18 import Trans18
+from dialRL.models.transformer19 import Trans19
+from dialRL.models.transformer28 import Trans28
+from dialRL.utils import torch_load
+
+try :
+    from torch.ao.quantization import quantize_dynamic
+except ImportError:
+    from torch.quantization import quantize_dynamic
+
+
+QUANTIZED_MODELS = (Trans18, Trans19, Trans28)
+# Linear layers of the transformer (attention output projections, feed forward, classifier heads),
+# the input embeddings of the raw coordinates / features stay in float
+QUANTIZED_MODULES = ('encoder.', 'decoder.', 'classifier.')
+# Per head (head_dim x head_dim) projections: too small for the int8 kernels to pay off
+HEAD_PROJECTIONS = ('.values', '.keys', '.queries')
+
+
+def quantize_model(model, dtype=torch.qint8, head_projections=False):
+    """ Dynamic INT8 quantization of a Trans18 / Trans19 / Trans28 for CPU inference (--quantize):
+        the weights of the transformer nn.Linear layers are stored in int8 and their inputs
+        quantized on the fly. Returns a float32 CPU copy of the model in eval mode.
+    """
+    if not isinstance(model, QUANTIZED_MODELS):
+        raise ValueError('Dynamic quantization is only supported for Trans18, Trans19 and Trans28, not ' + type(model).__name__)
+    model = copy.deepcopy(model).to('cpu', torch.float32).eval()
+    for module in model.modules():
+        if hasattr(module, 'device'):
+            module.device = 'cpu'
+    layers = {name for name, module in model.named_modules()
+              if isinstance(module, nn.Linear) and name.startswith(QUANTIZED_MODULES)
+              and (head_projections or not name.endswith(HEAD_PROJECTIONS))}
+    return quantize_dynamic(model, layers, dtype=dtype)
+
+
+def is_quantized(model):
+    return any(type(module).__module__.startswith(('torch.ao.nn.quantized', 'torch.nn.quantized'))
+               for module in model.modules())
+
+
+def save_quantized(model, file_name):
+    """ Whole quantized module, as the saved best models """
+    torch.save(model, file_name)
+
+
+def load_quantized(file_name):
+    model = torch_load(file_name, map_location='cpu')
+    if not is_quantized(model):
+        raise ValueError(file_name + ' is not a quantized model')
+    return model.eval()
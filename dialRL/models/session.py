@@ -0,0 +1,154 @@
+import torch
+
+from dialRL.models.transformer18 import Trans18
+from dialRL.models.compiled import flatten_inputs
+from dialRL.utils import stack_features, assemble_sequence
+
+
+class TokenCache():
+    """ Pickup / dropoff tokens of the targets for one part of the encoding (env, positions, times).
+        The [B, T, k] inputs of the previous call are kept: only the targets whose inputs
+        changed are recomputed (rowwise functions, the embedding lookups), the other
+        functions or changes of most of the targets are recomputed as a whole.
+    """
+    def __init__(self, function, rowwise=True):
+        self.function = function
+        self.rowwise = rowwise
+        self.inputs = None
+        self.tokens = None
+        self.recomputed = self.cached = 0
+
+    def __call__(self, inputs):
+        if self.inputs is None or self.inputs.shape != inputs.shape:
+            changed = None
+        else :
+            changed = (inputs != self.inputs).any(-1)
+            nb_changed = int(changed.sum())
+            if self.rowwise and 0 < 2 * nb_changed < changed.numel():
+                pickups, dropoffs = self.function(inputs[changed])
+                self.tokens[0][changed] = pickups
+                self.tokens[1][changed] = dropoffs
+            elif nb_changed :
+                changed = None
+
+        if changed is None:
+            self.tokens = self.function(inputs)
+            self.recomputed += inputs.shape[0] * inputs.shape[1]
+        else :
+            self.recomputed += nb_changed
+            self.cached += changed.numel() - nb_changed
+        self.inputs = inputs
+        return self.tokens
+
+
+class InferenceSession():
+    """ Inference of a Trans model along one episode (a new session per episode, opt-in --inference_cache 1).
+        Same outputs as model(src, trg, positions=, times=) with less work per decision:
+            - an observation equal to the previous one (e.g. several decisions at the same
+              time step before the environment moves) reuses the previous output;
+            - Trans18 with the env encoding typ 16, 17, 18, 19, 26 in eval mode: the target tokens
+              of the env, positions and times encodings are cached, only the targets whose
+              features changed (state, can_aim, distances), whose positions changed or whose
+              time windows moved (new current time) are encoded again.
+        The world / depot and drivers tokens and the encoder layers run at every new observation:
+        the world token and the target features depend on the current player, so an observation
+        that only differs by its current player still needs its encoder pass.
+        Other models, the sparse attention, training mode and inputs without positions / times use the model forward.
+        The cached encodings mirror Trans18.forward: keep them in step with it, tests/test_inference.py checks both agree.
+    """
+    def __init__(self, model):
+        self.model = model
+        self.cached_encodings = isinstance(model, Trans18) and model.typ in [16, 17, 18, 19, 26] and model.sparse_attention is None
+        self.reset()
+
+    def reset(self):
+        """ New episode """
+        self.leaves = None
+        self.structure = None
+        self.output = None
+        self.calls = self.reused = 0
+        if self.cached_encodings :
+            self.env_tokens = TokenCache(self.model.target_env_tokens)
+            # Linear layers: recomputed as a whole, positions do not move along an episode
+            self.position_tokens = TokenCache(self.model.target_position_tokens, rowwise=False)
+            self.window_tokens = TokenCache(self.model.target_window_tokens)
+
+    @property
+    def stats(self):
+        stats = {'calls': self.calls, 'reused outputs': self.reused}
+        if self.cached_encodings :
+            for name, cache in [('env', self.env_tokens), ('positions', self.position_tokens), ('times', self.window_tokens)]:
+                stats[name + ' recomputed tokens'] = cache.recomputed
+                stats[name + ' cached tokens'] = cache.cached
+        return stats
+
+    def same_inputs(self, leaves, structure):
+        return self.leaves is not None and structure == self.structure and len(leaves) == len(self.leaves) \
+            and all(a.shape == b.shape and a.dtype == b.dtype and torch.equal(a, b) for a, b in zip(leaves, self.leaves))
+
+    def __call__(self, src, trg, positions=None, times=None):
+        self.calls += 1
+        if self.model.training :
+            return self.model(src, trg, positions=positions, times=times)
+
+        cached = self.cached_encodings and positions is not None and times is not None
+        if cached :
+            # Compared as a few stacked tensors rather than the nested lists
+            inputs = self.stacked_inputs(src, positions, times)
+            leaves, structure = flatten_inputs(trg)
+            leaves = leaves + list(inputs.values())
+        else :
+            leaves, structure = flatten_inputs([src, trg, positions, times])
+        if self.same_inputs(leaves, structure):
+            self.reused += 1
+            return self.output
+
+        with torch.no_grad():
+            if cached :
+                output = self.cached_forward(inputs, trg)
+            else :
+                output = self.model(src, trg, positions=positions, times=times)
+        self.leaves, self.structure, self.output = leaves, structure, output
+        return output
+
+    def stacked_inputs(self, src, positions, times):
+        """ Observation as [B, ...] tensors, in the layout of the batched encodings of Trans18 """
+        w, ts, ds = src
+        current_time = times[0]
+        return {'world': w[0],
+                'targets': stack_features(ts),
+                'drivers': stack_features(ds),
+                'depot position': positions[0],
+                'targets positions': torch.stack(positions[1], dim=1),
+                'drivers positions': torch.stack(positions[2], dim=1),
+                'current time': current_time,
+                'targets windows': torch.stack(times[1], dim=1) - current_time.view(-1, 1, 1) + self.model.max_time,
+                'drivers times': torch.stack(times[2], dim=1)}
+
+    def cached_forward(self, inputs, trg):
+        """ Trans18.forward with the cached target tokens """
+        model = self.model
+
+        # Env encoding
+        pickups, dropoffs = self.env_tokens(inputs['targets'].to(model.device))
+        env = assemble_sequence(model.ind_embedding1(inputs['world'].long().to(model.device)),
+                                pickups, dropoffs,
+                                model.ind_embedding4(inputs['drivers'].to(model.dtype).to(model.device)))
+
+        # Positional encoding
+        pickups, dropoffs = self.position_tokens(inputs['targets positions'].to(model.dtype).to(model.device))
+        position = assemble_sequence(model.input_emb1(inputs['depot position'].to(model.dtype).to(model.device)),
+                                     pickups, dropoffs,
+                                     model.input_emb1(inputs['drivers positions'].to(model.dtype).to(model.device)))
+
+        # Times encoding
+        pickups, dropoffs = self.window_tokens(inputs['targets windows'].to(model.device))
+        time = assemble_sequence(model.time_embedding1(inputs['current time'].long().to(model.device)),
+                                 pickups, dropoffs,
+                                 model.time_embedding1(inputs['drivers times'].long().to(model.device)))
+
+        src_mask = model.make_src_mask(env)
+        layers_out, out_process = model.encoder_outputs()
+        tokens = model.encoder.dropout(env.to(model.device) + (position + time))
+        enc_src = model.encoder.layers_forward(tokens, src_mask, layers_out=layers_out, out_process=out_process)
+        return model.classify(enc_src, trg, src_mask)
@@ -0,0 +1,95 @@
+from collections import OrderedDict
+import numpy as np
+import torch
+
+try :
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
+
+class SparsePattern():
+    """ Keys of each query token of the sparse attention, given to the encoder layers as their mask.
+        index / valid: [N, 2T, K + G] keys of the target tokens (pickups and dropoffs, tokens 1 .. 2T):
+            their K nearest target tokens, then the G global tokens.
+        global_index: [G] global tokens (world and drivers), they attend to every token.
+        mask: [N, 1, 1, L] padding mask of the global tokens attention (or None).
+    """
+    def __init__(self, index, valid, global_index, mask=None):
+        self.index = index
+        self.valid = valid
+        self.global_index = global_index
+        self.mask = mask
+
+
+class NeighbourIndex():
+    """ Sparse attention pattern of the Trans18 encoder (--attention_backend sparse):
+        each target token attends to its `neighbours` nearest target tokens in a space / time metric
+        (pickup or dropoff position and centre of its time window, each scaled by its spread over the
+        instance, the time weighted by `time_weight`), plus the world and drivers tokens.
+        The world and drivers tokens attend to every token: the attention grows linearly with the targets.
+        The neighbour lists only depend on the targets of the instance: they are computed once per
+        instance with a k-d tree (scipy, else a torch top k) and kept in a cache.
+    """
+    def __init__(self, neighbours=16, time_weight=1., cache_size=1024):
+        self.neighbours = neighbours
+        self.time_weight = time_weight
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def __getstate__(self):
+        # The cache is not saved along the models
+        state = self.__dict__.copy()
+        state['cache'] = OrderedDict()
+        return state
+
+    def instance_neighbours(self, points):
+        """ [n, 3] (x, y, time) points of the target tokens of an instance -> [n, k] nearest tokens """
+        key = points.tobytes()
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        spread = np.array([points[:, :2].std(), points[:, :2].std(), points[:, 2].std() / self.time_weight])
+        points = points / np.maximum(spread, 1e-9)
+        k = min(self.neighbours, len(points))
+        if cKDTree is not None:
+            neighbours = cKDTree(points).query(points, k=k)[1].reshape(len(points), k)
+        else :
+            points = torch.from_numpy(points)
+            neighbours = torch.cdist(points, points).topk(k, largest=False).indices.numpy()
+        self.cache[key] = neighbours
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return neighbours
+
+    def __call__(self, targets_positions, targets_times, nb_drivers, mask=None, lengths=None):
+        """ T [N, 4] pickup / dropoff positions and time windows (or None) of the targets -> SparsePattern """
+        device = targets_positions[0].device
+        nb_targets = len(targets_positions)
+        bsz = targets_positions[0].shape[0]
+        positions = torch.stack(targets_positions, dim=1).detach().cpu().double().numpy().reshape(bsz, nb_targets, 2, 2)
+        if targets_times is None:
+            windows = np.zeros_like(positions)
+        else :
+            windows = torch.stack(targets_times, dim=1).detach().cpu().double().numpy().reshape(bsz, nb_targets, 2, 2)
+        # Tokens in the sequence order: pickup and dropoff of each target
+        points = np.concatenate([positions, windows.mean(-1, keepdims=True)], axis=-1).reshape(bsz, 2*nb_targets, 3)
+
+        k = min(self.neighbours, 2*nb_targets)
+        index = np.zeros((bsz, 2*nb_targets, k), dtype=np.int64)
+        valid = np.zeros((bsz, 2*nb_targets, k), dtype=bool)
+        for b in range(bsz):
+            nb_tokens = 2*nb_targets if lengths is None else 2*int(lengths[b][0])
+            if nb_tokens == 0:
+                continue
+            neighbours = self.instance_neighbours(np.ascontiguousarray(points[b, :nb_tokens]))
+            index[b, :nb_tokens, :neighbours.shape[1]] = neighbours + 1
+            valid[b, :nb_tokens, :neighbours.shape[1]] = True
+
+        global_index = torch.tensor([0] + list(range(2*nb_targets + 1, 2*nb_targets + 1 + nb_drivers)), device=device)
+        global_valid = torch.ones(bsz, 1 + nb_drivers, dtype=torch.bool, device=device)
+        if lengths is not None:
+            global_valid[:, 1:] = torch.arange(nb_drivers, device=device) < torch.as_tensor(lengths, device=device)[:, 1:2]
+        index = torch.cat([torch.from_numpy(index).to(device), global_index.expand(bsz, 2*nb_targets, -1)], dim=-1)
+        valid = torch.cat([torch.from_numpy(valid).to(device), global_valid.unsqueeze(1).expand(-1, 2*nb_targets, -1)], dim=-1)
+        return SparsePattern(index, valid, global_index, mask=mask)
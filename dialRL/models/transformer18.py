@@ -4,72 +4,9 @@ import math
 import torch
 import torch.nn as nn
 
-from dialRL.utils import get_device, plotting, quinconx
-
-class SelfAttention(nn.Module):
-    def __init__(self, embed_size, heads):
-        super(SelfAttention, self).__init__()
-        self.embed_size = embed_size
-        self.heads = heads
-        self.head_dim = embed_size // heads
-
-        assert (
-            self.head_dim * heads == embed_size
-        ), "Embedding size needs to be divisible by heads"
-
-        self.values = nn.Linear(self.head_dim, self.head_dim, bias=False)
-        self.keys = nn.Linear(self.head_dim, self.head_dim, bias=False)
-        self.queries = nn.Linear(self.head_dim, self.head_dim, bias=False)
-        self.fc_out = nn.Linear(heads * self.head_dim, embed_size)
-
-    def forward(self, values, keys, query, mask):
-        # Get number of training examples
-        N = query.shape[0]
-
-        value_len, key_len, query_len = values.shape[1], keys.shape[1], query.shape[1]
-
-        # Split the embedding into self.heads different pieces
-        values = values.reshape(N, value_len, self.heads, self.head_dim)
-        keys = keys.reshape(N, key_len, self.heads, self.head_dim)
-        query = query.reshape(N, query_len, self.heads, self.head_dim)
-
-        values = self.values(values)  # (N, value_len, heads, head_dim)
-        keys = self.keys(keys)  # (N, key_len, heads, head_dim)
-        queries = self.queries(query)  # (N, query_len, heads, heads_dim)
-
-        # Einsum does matrix mult. for query*keys for each training example
-        # with every other training example, don't be confused by einsum
-        # it's just how I like doing matrix multiplication & bmm
-
-        energy = torch.einsum("nqhd,nkhd->nhqk", [queries, keys])
-        # queries shape: (N, query_len, heads, heads_dim),
-        # keys shape: (N, key_len, heads, heads_dim)
-        # energy: (N, heads, query_len, key_len)
-
-        # Mask padded indices so their weights become 0
-        if mask is not None:
-            energy = energy.masked_fill(mask == 0, float("-1e20"))
-
-        # Normalize energy values similarly to seq2seq + attention
-        # so that they sum to 1. Also divide by scaling factor for
-        # better stability
-        attention = torch.softmax(energy / (self.embed_size ** (1 / 2)), dim=3)
-        # attention shape: (N, heads, query_len, key_len)
-
-        out = torch.einsum("nhql,nlhd->nqhd", [attention, values]).reshape(
-            N, query_len, self.heads * self.head_dim
-        )
-        # attention shape: (N, heads, query_len, key_len)
-        # values shape: (N, value_len, heads, heads_dim)
-        # out after matrix multiply: (N, query_len, heads, head_dim), then
-        # we reshape and flatten the last two dimensions.
-
-        out = self.fc_out(out)
-        # Linear layer doesn't modify the shape, final shape will be
-        # (N, query_len, embed_size)
-
-        return out
-
+from dialRL.utils import get_device, plotting, quinconx, stack_features, assemble_sequence, sequence_padding_mask
+from dialRL.utils import batched_positional_encoding, batched_times_encoding
+from dialRL.models.attention import SelfAttention
 
 class TransformerBlock(nn.Module):
     def __init__(self, embed_size, heads, dropout, forward_expansion, batch_norm=False):
@@ -172,7 +109,10 @@ class Encoder(nn.Module):
             (x.to(self.device) + postim)
         )
         #self.word_embedding(
+        return self.layers_forward(out, mask, layers_out=layers_out, out_process=out_process)
 
+    def layers_forward(self, out, mask, layers_out=1, out_process=1):
+        """ Transformer layers on the encoder input tokens """
         # In the Encoder the query, key, value are all the same, it's in the
         # decoder this will change. This might look a bit odd in this case.
         saving_layers = []
@@ -388,9 +328,11 @@ class Trans18(nn.Module):
             self.ind_embedding3 = nn.Embedding(100, self.embed_size // 2)
             self.ind_embedding4 = nn.Linear(4 + 3, self.embed_size)         # 4 pour info et 3 pour le trunk
         elif self.typ in [16, 17, 18, 19, 26] :
+            # Target ids are embedded with their state (up to 2T + 5) and aim flag (up to T + 10),
+            # the 100 rows of the tables are kept while they suffice (same checkpoints)
             self.ind_embedding1 = nn.Embedding(100, self.embed_size)
-            self.ind_embedding2 = nn.Embedding(100, self.embed_size // 2)
-            self.ind_embedding3 = nn.Embedding(100, self.embed_size // 4)
+            self.ind_embedding2 = nn.Embedding(max(100, 2 * trg_vocab_size + 4), self.embed_size // 2)
+            self.ind_embedding3 = nn.Embedding(max(100, trg_vocab_size + 12), self.embed_size // 4)
             self.ind_embedding33 = nn.Embedding(100, self.embed_size // 4)
             self.ind_embedding4 = nn.Linear(4 + 3, self.embed_size)         # 4 pour info et 3 pour le trunk
         elif self.typ in [7]:
@@ -443,6 +385,11 @@ class Trans18(nn.Module):
             self.time_embedding2 = nn.Embedding(self.max_time, self.embed_size // 4)
 
 
+    @property
+    def dtype(self):
+        """ Floating type of the model parameters (float64, or float32 see --precision) """
+        return self.pos_embedding.weight.dtype
+
     def summary(self):
         txt = '***** Model Summary *****\n'
         txt += ' - This model is a Transformer with an input of the decoder that loops the old outputs \n'
@@ -466,27 +413,55 @@ class Trans18(nn.Module):
         )
         return trg_mask.to(self.device)
 
-    def forward(self, src, trg, positions, times):
+    # Sparse attention pattern of the encoder (set_attention_backend 'sparse'), None: full attention
+    sparse_attention = None
+
+    def padding_supported(self):
+        """ Padded batches (forward lengths): sequence of the batched env encodings,
+            classifiers that do not depend on the sequence length nor on the token indices
+        """
+        return self.typ in [16, 17, 18, 19, 26] and self.classifier_type in [1, 2, 4]
+
+    def forward(self, src, trg, positions, times, lengths=None):
+        """ lengths: [B, 2] (targets, drivers) of the instances of a padded batch (see collate_padded),
+            the padding tokens are masked out of the attention
+        """
         # Encoode positoin and env
         nb_targets = len(positions[1])
         nb_drivers = len(positions[2])
+        # Raw targets positions and time windows of the sparse attention neighbours
+        targets_positions, targets_times = positions[1], None if times is None else times[1]
         src = self.env_encoding(src)
         if not positions is None :
             positions = self.positional_encoding(positions)
         if not times is None :
             times = self.times_encoding(times)
 
-        src_mask = self.make_src_mask(src)
+        if lengths is None:
+            src_mask = self.make_src_mask(src)
+        else :
+            src_mask = sequence_padding_mask(lengths, nb_targets, nb_drivers).unsqueeze(1).unsqueeze(2).to(self.device)
 
+        encoder_mask = src_mask
+        if self.sparse_attention is not None:
+            encoder_mask = self.sparse_attention(targets_positions, targets_times, nb_drivers, mask=src_mask, lengths=lengths)
+
+        encodded_layers_out, out_process = self.encoder_outputs()
+        enc_src = self.encoder(src, encoder_mask, positions=positions, times=times, layers_out=encodded_layers_out, out_process=out_process)#[:, :nb_targets])
+
+        return self.classify(enc_src, trg, src_mask)
+
+    def encoder_outputs(self):
+        """ Encoder layers given to the classifier (layers_out) and how they are merged (out_process) """
         encodded_layers_out = 1
         out_process=1
         if self.classifier_type in [10, 11, 12]:
             encodded_layers_out = 4
         if self.classifier_type in [12]:
             out_process = 2
+        return encodded_layers_out, out_process
 
-        enc_src = self.encoder(src, src_mask, positions=positions, times=times, layers_out=encodded_layers_out, out_process=out_process)#[:, :nb_targets])
-
+    def classify(self, enc_src, trg, src_mask):
         if self.classifier_type in [6, 7]:
             classification = self.classifier(enc_src, trg=trg)
         elif self.classifier_type in [9] :
@@ -516,8 +491,8 @@ class Trans18(nn.Module):
     def fourier_feature(self, coordonates):
         # coordonates = torch.stack(coordonates).permute(1, 0)
         pi = torch.tensor(torch.acos(torch.zeros(1)).item() * 2 * 2)
-        x = (pi * coordonates).double()
-        transB = torch.transpose(self.B_gauss, 0, 1).double()
+        x = (pi * coordonates).to(self.dtype)
+        transB = torch.transpose(self.B_gauss, 0, 1).to(self.dtype)
         if x.shape[1] == 4:
             transB = torch.cat([transB, transB])
         x_proj = x.matmul(transB)
@@ -529,19 +504,53 @@ class Trans18(nn.Module):
         return h.add(w * self.siderange).long()
 
     def quinconx(self, l):
+        # Interleaves the last dimension ([B, e] or batched [B, T, e] embeddings)
         nb = len(l)
         if nb==2:
             a, b = l
-            return torch.cat([a.unsqueeze(-1), b.unsqueeze(-1)], dim=-1).flatten(start_dim=1)
+            return torch.cat([a.unsqueeze(-1), b.unsqueeze(-1)], dim=-1).flatten(start_dim=-2)
         elif nb==3:
             a, b, c = l
-            q1 = torch.cat([b.unsqueeze(-1), c.unsqueeze(-1)], dim=-1).flatten(start_dim=1)
-            return torch.cat([a.unsqueeze(-1), q1.unsqueeze(-1)], dim=-1).flatten(start_dim=1)
+            q1 = torch.cat([b.unsqueeze(-1), c.unsqueeze(-1)], dim=-1).flatten(start_dim=-2)
+            return torch.cat([a.unsqueeze(-1), q1.unsqueeze(-1)], dim=-1).flatten(start_dim=-2)
 
 
 
 
     def env_encoding(self, src):
+        if self.typ in [16, 17, 18, 19, 26]:
+            return self.batched_env_encoding(src)
+        return self.loop_env_encoding(src)
+
+    def batched_env_encoding(self, src):
+        """ env_encoding of the typ 16, 17, 18, 19, 26 with one lookup per embedding table.
+            The targets / drivers features are stacked as [B, T, F] / [B, D, F] tensors and
+            the pickup and dropoff embeddings of each target interleaved in the sequence:
+            same values as the per target loop (loop_env_encoding).
+        """
+        w, ts, ds = src
+
+        # World
+        world_emb = self.ind_embedding1(w[0].long().to(self.device))
+
+        # Targets
+        pickups, dropoffs = self.target_env_tokens(stack_features(ts).to(self.device))
+
+        # Drivers
+        drivers_emb = self.ind_embedding4(stack_features(ds).to(self.dtype).to(self.device))
+
+        return assemble_sequence(world_emb, pickups, dropoffs, drivers_emb)
+
+    def target_env_tokens(self, targets):
+        """ [..., F] targets features -> env embeddings of their pickup and dropoff tokens """
+        em1 = self.ind_embedding2((targets[..., 0] + self.trg_vocab_size + targets[..., 1]+2).long())
+        em2 = self.ind_embedding3((targets[..., 1]+2 + targets[..., 2]*10).long())
+        em3 = self.ind_embedding3((targets[..., 0] + targets[..., 2]*10).long())
+        di1 = self.ind_embedding33(targets[..., 3].long())
+        di2 = self.ind_embedding33(targets[..., 4].long())
+        return self.quinconx([em1, em2, di1]), self.quinconx([em1, em3, di2])
+
+    def loop_env_encoding(self, src):
         w, ts, ds = src
         embeddig_size = self.embed_size
         bsz = w[0].shape[-1]
@@ -554,9 +563,9 @@ class Trans18(nn.Module):
         elif self.typ in [7]:
             world_emb = [self.ind_embedding11(self.ind_embedding1(w[0].long().to(self.device)))]
         elif self.typ in [3]:
-            world_emb = [self.ind_embedding(torch.stack([w[0], w[0]], dim=-1).double().to(self.device))]
+            world_emb = [self.ind_embedding(torch.stack([w[0], w[0]], dim=-1).to(self.dtype).to(self.device))]
         elif self.typ in [4]:
-            world_emb = [self.ind_embedding1(torch.stack([w[0], w[0]], dim=-1).double().to(self.device))]
+            world_emb = [self.ind_embedding1(torch.stack([w[0], w[0]], dim=-1).to(self.dtype).to(self.device))]
         else :
             raise "Nah"
 
@@ -605,16 +614,16 @@ class Trans18(nn.Module):
                 em1 = self.ind_embedding2((target[0] + self.trg_vocab_size + target[1]+2).long().to(self.device))
                 em2 = self.ind_embedding3((target[1]+2).long().to(self.device))
                 em3 = self.ind_embedding3((target[0]).long().to(self.device))
-                em = self.ind_embedding22(self.quinconx([em1, em2])).double().to(self.device)
+                em = self.ind_embedding22(self.quinconx([em1, em2])).to(self.dtype).to(self.device)
                 targets_emb.append(em)
-                em = self.ind_embedding22(self.quinconx([em1, em3])).double().to(self.device)
+                em = self.ind_embedding22(self.quinconx([em1, em3])).to(self.dtype).to(self.device)
                 targets_emb.append(em)
             elif self.typ in [3]:
-                targets_emb.append(self.ind_embedding(torch.stack([target[0], target[1]+2], dim=-1).double().to(self.device)))
-                targets_emb.append(self.ind_embedding(torch.stack([target[0], target[0]], dim=-1).double().to(self.device)))
+                targets_emb.append(self.ind_embedding(torch.stack([target[0], target[1]+2], dim=-1).to(self.dtype).to(self.device)))
+                targets_emb.append(self.ind_embedding(torch.stack([target[0], target[0]], dim=-1).to(self.dtype).to(self.device)))
             elif self.typ in [4]:
-                targets_emb.append(self.ind_embedding2(torch.stack([target[0], target[1]+2], dim=-1).double().to(self.device)))
-                targets_emb.append(self.ind_embedding3(torch.stack([target[0], target[1]+2], dim=-1).double().to(self.device)))
+                targets_emb.append(self.ind_embedding2(torch.stack([target[0], target[1]+2], dim=-1).to(self.dtype).to(self.device)))
+                targets_emb.append(self.ind_embedding3(torch.stack([target[0], target[1]+2], dim=-1).to(self.dtype).to(self.device)))
             else :
                 raise "Nah"
 
@@ -627,15 +636,15 @@ class Trans18(nn.Module):
         elif self.typ in [14, 15, 16, 17, 18, 19, 26]:
             # em1 = [self.ind_embedding1(driver[0].long().to(self.device)) for driver in ds]
 
-            drivers_emb = [self.ind_embedding4(torch.stack(driver, dim=-1).double().to(self.device)) for driver in ds]
+            drivers_emb = [self.ind_embedding4(torch.stack(driver, dim=-1).to(self.dtype).to(self.device)) for driver in ds]
             # drivers_emb = [self.quinconx(em1, em2)]
 
         elif self.typ in [7]:
             drivers_emb = [self.ind_embedding11(self.ind_embedding1(driver[0].long().to(self.device))) for driver in ds]
         elif self.typ in [3]:
-            drivers_emb = [self.ind_embedding(torch.stack([driver[0], driver[0]], dim=-1).double().to(self.device)) for driver in ds]
+            drivers_emb = [self.ind_embedding(torch.stack([driver[0], driver[0]], dim=-1).to(self.dtype).to(self.device)) for driver in ds]
         elif self.typ in [4]:
-            drivers_emb = [self.ind_embedding1(torch.stack([driver[0], driver[0]], dim=-1).double().to(self.device)) for driver in ds]
+            drivers_emb = [self.ind_embedding1(torch.stack([driver[0], driver[0]], dim=-1).to(self.dtype).to(self.device)) for driver in ds]
         else :
             raise "Nah"
 
@@ -648,6 +657,18 @@ class Trans18(nn.Module):
 
 
     def positional_encoding(self, position):
+        if self.typ in [4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 26]:
+            return self.batched_positional_encoding(position)
+        return self.loop_positional_encoding(position)
+
+    def batched_positional_encoding(self, position):
+        return batched_positional_encoding(position, self.input_emb1, self.input_emb2, self.input_emb3, self.dtype, self.device)
+
+    def target_position_tokens(self, targets):
+        """ [..., 4] pickup and dropoff positions -> embeddings of the pickup and dropoff tokens """
+        return self.input_emb2(targets[..., 0:2]), self.input_emb3(targets[..., 2:])
+
+    def loop_positional_encoding(self, position):
         # bsz = position[0][0].shape[-2]
         depot_position = position[0]
         targets_pickups = [pos[:, 0:2] for pos in position[1]]
@@ -660,7 +681,7 @@ class Trans18(nn.Module):
         elif self.typ in [2]:
             d1 = [torch.stack([self.input_emb(self.fourier_feature(depot_position).to(self.device))])]
         elif self.typ in [4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 26]:
-            d1 = [torch.stack([self.input_emb1(depot_position.double().to(self.device))])]
+            d1 = [torch.stack([self.input_emb1(depot_position.to(self.dtype).to(self.device))])]
         else :
             raise "Na"
 
@@ -673,8 +694,8 @@ class Trans18(nn.Module):
                 d2 = torch.stack([self.input_emb(self.fourier_feature(pick).to(self.device))])
                 d25 = torch.stack([self.input_emb(self.fourier_feature(doff).to(self.device))])
             elif self.typ in [4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 26]:
-                d2 = torch.stack([self.input_emb2(pick.double().to(self.device))])
-                d25 = torch.stack([self.input_emb3(doff.double().to(self.device))])
+                d2 = torch.stack([self.input_emb2(pick.to(self.dtype).to(self.device))])
+                d25 = torch.stack([self.input_emb3(doff.to(self.dtype).to(self.device))])
             else :
                 raise "Nah"
             d1.append(d2)
@@ -687,7 +708,7 @@ class Trans18(nn.Module):
             elif self.typ in [2]:
                 d3 = torch.stack([self.input_emb(self.fourier_feature(driver).to(self.device))])
             elif self.typ in [4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 26]:
-                d3 = torch.stack([self.input_emb1(driver.double().to(self.device))])
+                d3 = torch.stack([self.input_emb1(driver.to(self.dtype).to(self.device))])
             else :
                 raise "Nah"
             d1.append(d3)
@@ -697,6 +718,19 @@ class Trans18(nn.Module):
 
 
     def times_encoding(self, times):
+        if self.typ in [13, 14, 15, 16, 17, 18, 19, 26]:
+            return self.batched_times_encoding(times)
+        return self.loop_times_encoding(times)
+
+    def batched_times_encoding(self, times):
+        return batched_times_encoding(times, self.time_embedding1, self.time_embedding2, self.max_time, self.device)
+
+    def target_window_tokens(self, offsets):
+        """ [..., 4] time windows relative to the current time -> embeddings of the pickup and dropoff tokens """
+        windows = self.time_embedding2(offsets.long())
+        return self.quinconx([windows[..., 0, :], windows[..., 1, :]]), self.quinconx([windows[..., 2, :], windows[..., 3, :]])
+
+    def loop_times_encoding(self, times):
         bsz = times[0].shape[-1]
         current_time = times[0]
         targets_4d = times[1]
@@ -706,7 +740,7 @@ class Trans18(nn.Module):
         if self.typ in [1, 2, 3, 4, 5, 6, 7, 9, 12, 13, 14, 15, 16, 17,  18, 19, 26]:
             d1 = [self.time_embedding1(current_time.long().to(self.device)).unsqueeze(0)]
         elif self.typ in [8, 10, 11] :
-            d1 = [self.time_embedding1(torch.stack([current_time, current_time], dim=-1).double().to(self.device))]
+            d1 = [self.time_embedding1(torch.stack([current_time, current_time], dim=-1).to(self.dtype).to(self.device))]
 
         # Targets
         for target in targets_4d :
@@ -727,8 +761,8 @@ class Trans18(nn.Module):
                 d22 = torch.stack([self.quinconx([em3, em4])])
 
             elif self.typ in [8, 10, 11]:
-                d2 = self.time_embedding2(torch.stack([target[:, 0], target[:, 1]], dim=-1).double().to(self.device))
-                d22 = self.time_embedding2(torch.stack([target[:, 2], target[:, 3]], dim=-1).double().to(self.device))
+                d2 = self.time_embedding2(torch.stack([target[:, 0], target[:, 1]], dim=-1).to(self.dtype).to(self.device))
+                d22 = self.time_embedding2(torch.stack([target[:, 2], target[:, 3]], dim=-1).to(self.dtype).to(self.device))
             else :
                 raise "Nah"
             d1.append(d2)
@@ -741,7 +775,7 @@ class Trans18(nn.Module):
             elif self.typ in [13, 14, 15, 16, 17, 18, 19, 26]:
                 d3 = torch.stack([self.time_embedding1((driver).long().to(self.device))])
             elif self.typ in [8, 10, 11]:
-                d3 = self.time_embedding3(torch.stack([driver, current_time], dim=-1).double().to(self.device))
+                d3 = self.time_embedding3(torch.stack([driver, current_time], dim=-1).to(self.dtype).to(self.device))
             else :
                 raise "Nah"
             d1.append(d3)
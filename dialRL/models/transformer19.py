@@ -4,72 +4,8 @@ import math
 import torch
 import torch.nn as nn
 
-from dialRL.utils import get_device, plotting, quinconx
-
-class SelfAttention(nn.Module):
-    def __init__(self, embed_size, heads):
-        super(SelfAttention, self).__init__()
-        self.embed_size = embed_size
-        self.heads = heads
-        self.head_dim = embed_size // heads
-
-        assert (
-            self.head_dim * heads == embed_size
-        ), "Embedding size needs to be divisible by heads"
-
-        self.values = nn.Linear(self.head_dim, self.head_dim, bias=False)
-        self.keys = nn.Linear(self.head_dim, self.head_dim, bias=False)
-        self.queries = nn.Linear(self.head_dim, self.head_dim, bias=False)
-        self.fc_out = nn.Linear(heads * self.head_dim, embed_size)
-
-    def forward(self, values, keys, query, mask):
-        # Get number of training examples
-        N = query.shape[0]
-
-        value_len, key_len, query_len = values.shape[1], keys.shape[1], query.shape[1]
-
-        # Split the embedding into self.heads different pieces
-        values = values.reshape(N, value_len, self.heads, self.head_dim)
-        keys = keys.reshape(N, key_len, self.heads, self.head_dim)
-        query = query.reshape(N, query_len, self.heads, self.head_dim)
-
-        values = self.values(values)  # (N, value_len, heads, head_dim)
-        keys = self.keys(keys)  # (N, key_len, heads, head_dim)
-        queries = self.queries(query)  # (N, query_len, heads, heads_dim)
-
-        # Einsum does matrix mult. for query*keys for each training example
-        # with every other training example, don't be confused by einsum
-        # it's just how I like doing matrix multiplication & bmm
-
-        energy = torch.einsum("nqhd,nkhd->nhqk", [queries, keys])
-        # queries shape: (N, query_len, heads, heads_dim),
-        # keys shape: (N, key_len, heads, heads_dim)
-        # energy: (N, heads, query_len, key_len)
-
-        # Mask padded indices so their weights become 0
-        if mask is not None:
-            energy = energy.masked_fill(mask == 0, float("-1e20"))
-
-        # Normalize energy values similarly to seq2seq + attention
-        # so that they sum to 1. Also divide by scaling factor for
-        # better stability
-        attention = torch.softmax(energy / (self.embed_size ** (1 / 2)), dim=3)
-        # attention shape: (N, heads, query_len, key_len)
-
-        out = torch.einsum("nhql,nlhd->nqhd", [attention, values]).reshape(
-            N, query_len, self.heads * self.head_dim
-        )
-        # attention shape: (N, heads, query_len, key_len)
-        # values shape: (N, value_len, heads, heads_dim)
-        # out after matrix multiply: (N, query_len, heads, head_dim), then
-        # we reshape and flatten the last two dimensions.
-
-        out = self.fc_out(out)
-        # Linear layer doesn't modify the shape, final shape will be
-        # (N, query_len, embed_size)
-
-        return out
-
+from dialRL.utils import get_device, plotting, quinconx, batched_positional_encoding, batched_times_encoding
+from dialRL.models.attention import SelfAttention
 
 class TransformerBlock(nn.Module):
     def __init__(self, embed_size, heads, dropout, forward_expansion, batch_norm=False):
@@ -554,6 +490,11 @@ class Trans19(nn.Module):
             self.time_embedding2 = nn.Embedding(self.max_time, self.embed_size // 4)
 
 
+    @property
+    def dtype(self):
+        """ Floating type of the model parameters (float64, or float32 see --precision) """
+        return self.pos_embedding.weight.dtype
+
     def summary(self):
         txt = '***** Model Summary *****\n'
         txt += ' - This model is a Transformer with an input of the decoder that loops the old outputs \n'
@@ -632,8 +573,8 @@ class Trans19(nn.Module):
     def fourier_feature(self, coordonates):
         # coordonates = torch.stack(coordonates).permute(1, 0)
         pi = torch.tensor(torch.acos(torch.zeros(1)).item() * 2 * 2)
-        x = (pi * coordonates).double()
-        transB = torch.transpose(self.B_gauss, 0, 1).double()
+        x = (pi * coordonates).to(self.dtype)
+        transB = torch.transpose(self.B_gauss, 0, 1).to(self.dtype)
         if x.shape[1] == 4:
             transB = torch.cat([transB, transB])
         x_proj = x.matmul(transB)
@@ -645,14 +586,15 @@ class Trans19(nn.Module):
         return h.add(w * self.siderange).long()
 
     def quinconx(self, l):
+        # Interleaves the last dimension ([B, e] or batched [B, T, e] embeddings)
         nb = len(l)
         if nb==2:
             a, b = l
-            return torch.cat([a.unsqueeze(-1), b.unsqueeze(-1)], dim=-1).flatten(start_dim=1)
+            return torch.cat([a.unsqueeze(-1), b.unsqueeze(-1)], dim=-1).flatten(start_dim=-2)
         elif nb==3:
             a, b, c = l
-            q1 = torch.cat([b.unsqueeze(-1), c.unsqueeze(-1)], dim=-1).flatten(start_dim=1)
-            return torch.cat([a.unsqueeze(-1), q1.unsqueeze(-1)], dim=-1).flatten(start_dim=1)
+            q1 = torch.cat([b.unsqueeze(-1), c.unsqueeze(-1)], dim=-1).flatten(start_dim=-2)
+            return torch.cat([a.unsqueeze(-1), q1.unsqueeze(-1)], dim=-1).flatten(start_dim=-2)
 
 
 
@@ -670,9 +612,9 @@ class Trans19(nn.Module):
         elif self.typ in [7]:
             world_emb = [self.ind_embedding11(self.ind_embedding1(w[0].long().to(self.device)))]
         elif self.typ in [3]:
-            world_emb = [self.ind_embedding(torch.stack([w[0], w[0]], dim=-1).double().to(self.device))]
+            world_emb = [self.ind_embedding(torch.stack([w[0], w[0]], dim=-1).to(self.dtype).to(self.device))]
         elif self.typ in [4]:
-            world_emb = [self.ind_embedding1(torch.stack([w[0], w[0]], dim=-1).double().to(self.device))]
+            world_emb = [self.ind_embedding1(torch.stack([w[0], w[0]], dim=-1).to(self.dtype).to(self.device))]
         else :
             raise "Nah"
 
@@ -730,16 +672,16 @@ class Trans19(nn.Module):
                 em1 = self.ind_embedding2((target[0] + self.trg_vocab_size + target[1]+2).long().to(self.device))
                 em2 = self.ind_embedding3((target[1]+2).long().to(self.device))
                 em3 = self.ind_embedding3((target[0]).long().to(self.device))
-                em = self.ind_embedding22(self.quinconx([em1, em2])).double().to(self.device)
+                em = self.ind_embedding22(self.quinconx([em1, em2])).to(self.dtype).to(self.device)
                 targets_emb.append(em)
-                em = self.ind_embedding22(self.quinconx([em1, em3])).double().to(self.device)
+                em = self.ind_embedding22(self.quinconx([em1, em3])).to(self.dtype).to(self.device)
                 targets_emb.append(em)
             elif self.typ in [3]:
-                targets_emb.append(self.ind_embedding(torch.stack([target[0], target[1]+2], dim=-1).double().to(self.device)))
-                targets_emb.append(self.ind_embedding(torch.stack([target[0], target[0]], dim=-1).double().to(self.device)))
+                targets_emb.append(self.ind_embedding(torch.stack([target[0], target[1]+2], dim=-1).to(self.dtype).to(self.device)))
+                targets_emb.append(self.ind_embedding(torch.stack([target[0], target[0]], dim=-1).to(self.dtype).to(self.device)))
             elif self.typ in [4]:
-                targets_emb.append(self.ind_embedding2(torch.stack([target[0], target[1]+2], dim=-1).double().to(self.device)))
-                targets_emb.append(self.ind_embedding3(torch.stack([target[0], target[1]+2], dim=-1).double().to(self.device)))
+                targets_emb.append(self.ind_embedding2(torch.stack([target[0], target[1]+2], dim=-1).to(self.dtype).to(self.device)))
+                targets_emb.append(self.ind_embedding3(torch.stack([target[0], target[1]+2], dim=-1).to(self.dtype).to(self.device)))
             else :
                 raise "Nah"
 
@@ -752,15 +694,15 @@ class Trans19(nn.Module):
         elif self.typ in [14, 15, 16, 17, 18, 19, 26, 40]:
             # em1 = [self.ind_embedding1(driver[0].long().to(self.device)) for driver in ds]
 
-            drivers_emb = [self.ind_embedding4(torch.stack(driver, dim=-1).double().to(self.device)) for driver in ds]
+            drivers_emb = [self.ind_embedding4(torch.stack(driver, dim=-1).to(self.dtype).to(self.device)) for driver in ds]
             # drivers_emb = [self.quinconx(em1, em2)]
 
         elif self.typ in [7]:
             drivers_emb = [self.ind_embedding11(self.ind_embedding1(driver[0].long().to(self.device))) for driver in ds]
         elif self.typ in [3]:
-            drivers_emb = [self.ind_embedding(torch.stack([driver[0], driver[0]], dim=-1).double().to(self.device)) for driver in ds]
+            drivers_emb = [self.ind_embedding(torch.stack([driver[0], driver[0]], dim=-1).to(self.dtype).to(self.device)) for driver in ds]
         elif self.typ in [4]:
-            drivers_emb = [self.ind_embedding1(torch.stack([driver[0], driver[0]], dim=-1).double().to(self.device)) for driver in ds]
+            drivers_emb = [self.ind_embedding1(torch.stack([driver[0], driver[0]], dim=-1).to(self.dtype).to(self.device)) for driver in ds]
         else :
             raise "Nah"
 
@@ -773,6 +715,14 @@ class Trans19(nn.Module):
 
 
     def positional_encoding(self, position):
+        if self.typ in [4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 26, 40]:
+            return self.batched_positional_encoding(position)
+        return self.loop_positional_encoding(position)
+
+    def batched_positional_encoding(self, position):
+        return batched_positional_encoding(position, self.input_emb1, self.input_emb2, self.input_emb3, self.dtype, self.device)
+
+    def loop_positional_encoding(self, position):
         # bsz = position[0][0].shape[-2]
         depot_position = position[0]
         targets_pickups = [pos[:, 0:2] for pos in position[1]]
@@ -785,7 +735,7 @@ class Trans19(nn.Module):
         elif self.typ in [2]:
             d1 = [torch.stack([self.input_emb(self.fourier_feature(depot_position).to(self.device))])]
         elif self.typ in [4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 26, 40]:
-            d1 = [torch.stack([self.input_emb1(depot_position.double().to(self.device))])]
+            d1 = [torch.stack([self.input_emb1(depot_position.to(self.dtype).to(self.device))])]
         else :
             raise "Na"
 
@@ -798,8 +748,8 @@ class Trans19(nn.Module):
                 d2 = torch.stack([self.input_emb(self.fourier_feature(pick).to(self.device))])
                 d25 = torch.stack([self.input_emb(self.fourier_feature(doff).to(self.device))])
             elif self.typ in [4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 26, 40]:
-                d2 = torch.stack([self.input_emb2(pick.double().to(self.device))])
-                d25 = torch.stack([self.input_emb3(doff.double().to(self.device))])
+                d2 = torch.stack([self.input_emb2(pick.to(self.dtype).to(self.device))])
+                d25 = torch.stack([self.input_emb3(doff.to(self.dtype).to(self.device))])
             else :
                 raise "Nah"
             d1.append(d2)
@@ -812,7 +762,7 @@ class Trans19(nn.Module):
             elif self.typ in [2]:
                 d3 = torch.stack([self.input_emb(self.fourier_feature(driver).to(self.device))])
             elif self.typ in [4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 26, 40]:
-                d3 = torch.stack([self.input_emb1(driver.double().to(self.device))])
+                d3 = torch.stack([self.input_emb1(driver.to(self.dtype).to(self.device))])
             else :
                 raise "Nah"
             d1.append(d3)
@@ -822,6 +772,21 @@ class Trans19(nn.Module):
 
 
     def times_encoding(self, times):
+        if self.typ in [13, 14, 15, 16, 17, 18, 19, 26, 40]:
+            return self.batched_times_encoding(times)
+        return self.loop_times_encoding(times)
+
+    def batched_times_encoding(self, times):
+        if self.typ in [40]:
+            # Current time for the world and each driver
+            current_time = times[0]
+            world = self.time_embedding1(torch.stack([current_time, current_time], dim=-1).to(self.dtype).to(self.device))
+            drivers = self.time_embedding3(current_time.long().to(self.device)).unsqueeze(1).expand(-1, self.nb_drivers, -1)
+            return batched_times_encoding(times, self.time_embedding1, self.time_embedding2, self.max_time, self.device,
+                                          world=world, drivers=drivers)
+        return batched_times_encoding(times, self.time_embedding1, self.time_embedding2, self.max_time, self.device)
+
+    def loop_times_encoding(self, times):
         bsz = times[0].shape[-1]
         current_time = times[0]
         targets_4d = times[1]
@@ -834,9 +799,9 @@ class Trans19(nn.Module):
         if self.typ in [1, 2, 3, 4, 5, 6, 7, 9, 12, 13, 14, 15, 16, 17,  18, 19, 26]:
             d1 = [self.time_embedding1(current_time.long().to(self.device)).unsqueeze(0)]
         elif self.typ in [40]:
-            d1 = [self.time_embedding1(torch.stack([current_time, current_time], dim=-1).double().to(self.device)).unsqueeze(0)]
+            d1 = [self.time_embedding1(torch.stack([current_time, current_time], dim=-1).to(self.dtype).to(self.device)).unsqueeze(0)]
         elif self.typ in [8, 10, 11] :
-            d1 = [self.time_embedding1(torch.stack([current_time, current_time], dim=-1).double().to(self.device))]
+            d1 = [self.time_embedding1(torch.stack([current_time, current_time], dim=-1).to(self.dtype).to(self.device))]
 
         # Targets
         for target in targets_4d :
@@ -857,8 +822,8 @@ class Trans19(nn.Module):
                 d22 = torch.stack([self.quinconx([em3, em4])])
 
             elif self.typ in [8, 10, 11]:
-                d2 = self.time_embedding2(torch.stack([target[:, 0], target[:, 1]], dim=-1).double().to(self.device))
-                d22 = self.time_embedding2(torch.stack([target[:, 2], target[:, 3]], dim=-1).double().to(self.device))
+                d2 = self.time_embedding2(torch.stack([target[:, 0], target[:, 1]], dim=-1).to(self.dtype).to(self.device))
+                d22 = self.time_embedding2(torch.stack([target[:, 2], target[:, 3]], dim=-1).to(self.dtype).to(self.device))
             else :
                 raise "Nah"
             d1.append(d2)
@@ -873,7 +838,7 @@ class Trans19(nn.Module):
             elif self.typ in [40]:
                 d3 = torch.stack([self.time_embedding3(current_time.long().to(self.device))])
             elif self.typ in [8, 10, 11]:
-                d3 = self.time_embedding3(torch.stack([driver, current_time], dim=-1).double().to(self.device))
+                d3 = self.time_embedding3(torch.stack([driver, current_time], dim=-1).to(self.dtype).to(self.device))
             else :
                 raise "Nah"
             d1.append(d3)
@@ -0,0 +1,155 @@
+import os
+import csv
+import json
+import time
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.multiprocessing as mp
+
+from dialRL.environments import DarSeqEnv
+from dialRL.environments.parser import tabu_parse_info
+from dialRL.utils import collate_observations, mask_logits, torch_load
+from dialRL.utils.reward_functions import *
+
+BKS_FILE = 'gschwind_results.txt'
+COLUMNS = ['instance', 'model', 'targets', 'drivers', 'fit', 'delivered', 'distance', 'bks', 'GAP',
+           'decisions', 'latency p50 (ms)', 'latency p99 (ms)', 'time (s)', 'skipped']
+
+# Models loaded by the worker process
+_models = {}
+
+
+def benchmark_instances(directory):
+    """ Instance files of a Cordeau folder (cordeau2006 a2-16 ... a8-96, cordeau2003 tabu1 ...)
+        -> [(file, best known solution or None)]. The best known solutions are read from the
+        gschwind_results.txt table of the folder, else by the env (res/res<k>.txt of the tabu instances).
+    """
+    best_costs = {}
+    if os.path.isfile(directory + '/' + BKS_FILE):
+        with open(directory + '/' + BKS_FILE) as f:
+            for line in f :
+                inst, bks = line.split()
+                best_costs[inst] = float(bks)
+    instances = []
+    for file in sorted(os.listdir(directory)):
+        if not file.endswith('.txt') or file == BKS_FILE:
+            continue
+        try :
+            tabu_parse_info(directory + '/' + file)
+        except (ValueError, IndexError):
+            print('/!\\ Not an instance file, skipped:', file)
+            continue
+        instances.append((directory + '/' + file, best_costs.get(file[:-len('.txt')])))
+    return instances
+
+
+def load_model(file_name, threads=1):
+    """ Whole saved model (models/best_*_model.pt), on cpu in eval mode """
+    if file_name not in _models:
+        torch.set_num_threads(threads)
+        model = torch_load(file_name, map_location='cpu')
+        if not isinstance(model, nn.Module):
+            raise ValueError('The benchmark needs whole saved models (models/best_*_model.pt), not training checkpoints')
+        for module in model.modules():
+            if hasattr(module, 'device'):
+                module.device = 'cpu'
+        _models[file_name] = model.eval()
+    return _models[file_name]
+
+
+def evaluate_instance(instance_file, bks, model_files, rep_type='16', reward_function='ConstantReward',
+                      masked_decoding=False, threads=1):
+    """ Greedy episode of the first model of the instance size (sequence of 1 + 2T + D tokens)
+        on an instance: a row of the benchmark table (COLUMNS)
+    """
+    start = time.time()
+    nb_targets, nb_drivers = tabu_parse_info(instance_file)[1:3]
+    row = {'instance': os.path.basename(instance_file)[:-len('.txt')], 'targets': nb_targets, 'drivers': nb_drivers,
+           'bks': bks, 'skipped': ''}
+    model_file = None
+    for file_name in model_files:
+        model = load_model(file_name, threads)
+        if getattr(model, 'max_length', 2*nb_targets + nb_drivers + 1) == 2*nb_targets + nb_drivers + 1:
+            model_file = file_name
+            break
+    if model_file is None:
+        row['skipped'] = 'no model of the instance size'
+        return row
+
+    env = DarSeqEnv(size=10, target_population=nb_targets, driver_population=nb_drivers, rep_type=rep_type,
+                    reward_function=globals()[reward_function](), test_env=True, dataset=instance_file)
+    if bks is not None:
+        env.best_cost = bks
+    row['bks'] = env.best_cost
+    dtype = next((param.dtype for param in model.parameters() if param.is_floating_point()), torch.float32)
+
+    latencies = []
+    observation = env.reset()
+    done = False
+    while not done:
+        decision_start = time.perf_counter()
+        world, targets, drivers, positions, time_contraints = collate_observations([observation], dtype=dtype)[:5]
+        if model.typ in [17, 18, 19]:
+            target_tensor = world
+        else :
+            target_tensor = world[1].unsqueeze(-1).type(torch.LongTensor)
+        with torch.no_grad():
+            model_action = model([world, targets, drivers], target_tensor, positions=positions, times=time_contraints)
+        logits = model_action if model.typ > 25 else model_action[:, 0]
+        if masked_decoding :
+            logits = mask_logits(logits, [env.action_mask()])
+        action = logits.argmax(-1).item()
+        latencies.append(1000 * (time.perf_counter() - decision_start))
+        observation, reward, done, info = env.step(action)
+
+    row.update({'model': model_file,
+                'fit': info['fit_solution'],
+                'delivered': info['delivered'],
+                'distance': env.total_distance,
+                'GAP': info['GAP'] if info['fit_solution'] and env.best_cost is not None else None,
+                'decisions': len(latencies),
+                'latency p50 (ms)': float(np.percentile(latencies, 50)),
+                'latency p99 (ms)': float(np.percentile(latencies, 99)),
+                'time (s)': time.time() - start})
+    return row
+
+
+def run_benchmark(directories, model_files, out='', processes=1, threads=1, **kwargs):
+    """ Benchmark of the models over the instances of the directories, evaluated by a pool of
+        spawned processes (instances of different sizes in parallel). Writes <out>.csv and
+        <out>.json (rows and summary) when out is given. Returns the rows and the summary.
+    """
+    start = time.time()
+    instances = [instance for directory in directories for instance in benchmark_instances(directory)]
+    arguments = [(instance_file, bks, model_files) for instance_file, bks in instances]
+    kwargs['threads'] = threads
+    if processes > 1 :
+        with mp.get_context('spawn').Pool(processes) as pool:
+            results = [pool.apply_async(evaluate_instance, argument, kwargs) for argument in arguments]
+            rows = [result.get() for result in results]
+    else :
+        rows = [evaluate_instance(*argument, **kwargs) for argument in arguments]
+
+    evaluated = [row for row in rows if not row['skipped']]
+    gaps = [row['GAP'] for row in evaluated if row['GAP'] is not None]
+    summary = {'models': list(model_files),
+               'instances': len(rows),
+               'evaluated': len(evaluated),
+               'fit': sum(row['fit'] for row in evaluated),
+               'mean GAP': float(np.mean(gaps)) if gaps else None,
+               'decisions': sum(row['decisions'] for row in evaluated),
+               'mean latency p50 (ms)': float(np.mean([row['latency p50 (ms)'] for row in evaluated])) if evaluated else None,
+               'max latency p99 (ms)': max([row['latency p99 (ms)'] for row in evaluated], default=None),
+               'wall time (s)': time.time() - start}
+
+    if out :
+        os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+        with open(out + '.csv', 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=COLUMNS)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow({column: row.get(column) for column in COLUMNS})
+        with open(out + '.json', 'w') as f:
+            json.dump({'summary': summary, 'instances': rows}, f, indent=2)
+    return rows, summary
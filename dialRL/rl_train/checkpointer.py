@@ -0,0 +1,130 @@
+import os
+import re
+import copy
+import random
+import threading
+from queue import Queue
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+from dialRL.utils import torch_load
+
+
+def cpu_snapshot(state):
+    """ Copy of the (nested) state with every tensor cloned to the CPU """
+    if torch.is_tensor(state):
+        return state.detach().to('cpu', copy=True)
+    elif isinstance(state, dict):
+        return type(state)((key, cpu_snapshot(value)) for key, value in state.items())
+    elif isinstance(state, (list, tuple)):
+        return type(state)(cpu_snapshot(value) for value in state)
+    return copy.deepcopy(state)
+
+
+def rng_state():
+    """ State of every random generator used by the training """
+    state = {'python': random.getstate(),
+             'numpy': np.random.get_state(),
+             'torch': torch.get_rng_state()}
+    if torch.cuda.is_available():
+        state['cuda'] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def set_rng_state(state):
+    random.setstate(state['python'])
+    np.random.set_state(state['numpy'])
+    torch.set_rng_state(state['torch'])
+    if 'cuda' in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state['cuda'])
+
+
+CHECKPOINT_PATTERN = re.compile(r'checkpoint_(\d+)_(\d+)\.pt$')
+
+
+def list_checkpoints(directory):
+    """ Training checkpoints (checkpoint_<epoch>_<step>.pt) of the directory, oldest first """
+    found = []
+    if os.path.isdir(directory):
+        for file in os.listdir(directory):
+            match = CHECKPOINT_PATTERN.match(file)
+            if match:
+                found.append((int(match.group(1)), int(match.group(2)), os.path.join(directory, file)))
+    return [file for epoch, step, file in sorted(found)]
+
+
+def read_model_state(path, map_location='cpu'):
+    """ state_dict of a saved model: training checkpoint or (legacy) whole pickled module """
+    saved = torch_load(path, map_location=map_location)
+    if isinstance(saved, nn.Module):
+        return saved.state_dict()
+    return saved['model']
+
+
+class Checkpointer():
+    """ Asynchronous checkpoint writer.
+        The states are snapshotted to the CPU by the caller (so that training can
+        go on modifying the parameters) and written to disk by a background thread,
+        through a temporary file so that a preempted job never leaves a truncated one.
+        The training checkpoints (checkpoint_<epoch>_<step>.pt) are rotated, only the last
+        `keep_last` are kept on disk. A failed write is raised by the next save / wait call.
+    """
+    def __init__(self, directory, keep_last=3):
+        self.directory = directory
+        self.keep_last = keep_last
+        os.makedirs(self.directory, exist_ok=True)
+        self.queue = Queue()
+        self.error = None
+        self.writer = threading.Thread(target=self.write_loop, daemon=True)
+        self.writer.start()
+
+    def write_loop(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                break
+            obj, file_name, rotate = item
+            try :
+                torch.save(obj, file_name + '.tmp')
+                os.replace(file_name + '.tmp', file_name)
+                if rotate :
+                    self.rotate()
+            except Exception as err:
+                self.error = err
+                print('/!\\ Checkpoint writing failed:', file_name, err)
+            self.queue.task_done()
+
+    def rotate(self):
+        for file in list_checkpoints(self.directory)[:-self.keep_last]:
+            os.remove(file)
+
+    def check(self):
+        """ Raises the error of a failed write in the training process """
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+    def save(self, state, epoch, step=0):
+        """ Training checkpoint (dict of state_dicts) """
+        self.check()
+        file_name = os.path.join(self.directory, 'checkpoint_{e}_{s}.pt'.format(e=epoch, s=step))
+        self.queue.put((cpu_snapshot(state), file_name, True))
+        return file_name
+
+    def save_module(self, module, file_name):
+        """ Whole module (best models, as loaded by the Tester) """
+        self.check()
+        snapshot = copy.deepcopy(module)
+        self.queue.put((snapshot, file_name, False))
+
+    def wait(self):
+        """ Blocks until every pending checkpoint is written """
+        self.queue.join()
+        self.check()
+
+    def close(self):
+        self.queue.put(None)
+        self.writer.join()
@@ -0,0 +1,184 @@
+import copy
+import time
+import torch
+import torch.multiprocessing as mp
+from torch.nn.functional import softmax, log_softmax
+
+from dialRL.utils import collate_observations, mask_logits, autocast
+from dialRL.rl_train.lockstep import lockstep_episodes
+
+DECODINGS = ['greedy', 'sampling', 'beam']
+
+
+def solution_key(info, total_distance):
+    """ Ranking of the solutions: fit ones first, then the most deliveries, then the shortest """
+    return (info['fit_solution'], info['delivered'], -total_distance)
+
+
+class TrajectoryDecoder():
+    """ Decoding of one episode by a Trans* policy beyond the greedy decisions (--decoding):
+            - sampling: best of --decoding_width trajectories sampled from the policy (at
+              --decoding_temperature), the first one greedy. The trajectories run in lockstep,
+              by batch_size, split over --decoding_workers processes if any.
+            - beam: the --decoding_width most likely partial trajectories, each step expanding
+              them over copies of their env, the greedy trajectory being one of the finished ones.
+        The env is given reset: the trajectories run on copies of it, the best solution found
+        (solution_key) is then replayed on the env. Within a wall clock --decoding_budget
+        (seconds, 0: none), no new sampling batch is started and the beams are completed greedily.
+    """
+    def __init__(self, policy, typ, decoding='sampling', width=16, temperature=1., budget=0., masked=False,
+                 batch_size=64, workers=0, model=None, dtype=torch.float64, device='cpu', precision='float64', seed=None):
+        if decoding not in DECODINGS[1:]:
+            raise ValueError('Decoding should be one of ' + str(DECODINGS[1:]) + ', not ' + str(decoding))
+        self.policy = policy
+        self.typ = typ
+        self.decoding = decoding
+        self.width = width
+        self.temperature = temperature
+        self.budget = budget
+        self.masked = masked
+        self.batch_size = batch_size
+        self.workers = workers
+        # Plain model sent to the worker processes (the policy may not be picklable)
+        self.model = model if model is not None else policy
+        self.dtype = dtype
+        self.device = device
+        self.precision = precision
+        self.seed = seed
+        self.stats = {'trajectories': 0, 'time': 0.}
+
+    def logits(self, observations, envs):
+        """ [B, V] logits of the policy on the observations, masked by the actions masks of the envs if asked """
+        world, targets, drivers, positions, time_contraints = collate_observations(observations, dtype=self.dtype)[:5]
+        if self.typ in [17, 18, 19]:
+            target_tensor = world
+        else :
+            target_tensor = world[1].unsqueeze(-1).type(torch.LongTensor).to(self.device)
+        with torch.no_grad(), autocast(self.precision, self.device):
+            model_action = self.policy([world, targets, drivers],
+                                       target_tensor,
+                                       positions=positions,
+                                       times=time_contraints)
+        logits = (model_action if self.typ > 25 else model_action[:, 0]).to(self.dtype)
+        if self.masked :
+            logits = mask_logits(logits, [env.action_mask() for env in envs])
+        return logits
+
+    def sample(self, env, nb_samples, deadline=None, seed=None, greedy_first=True):
+        """ Best of nb_samples trajectories sampled from env: (key, actions) """
+        generator = torch.Generator()
+        generator.manual_seed(seed if seed is not None else torch.seed() % 2**31)
+        best = None
+        sampled = 0
+        while sampled < nb_samples and (best is None or deadline is None or time.time() < deadline):
+            envs = [copy.deepcopy(env) for _ in range(min(self.batch_size, nb_samples - sampled))]
+            actions = [[] for _ in envs]
+            greedy = greedy_first and sampled == 0
+
+            def decide(indices, observations):
+                logits = self.logits(observations, [envs[k] for k in indices])
+                choices = torch.multinomial(softmax(logits.double() / self.temperature, dim=-1).cpu(), 1, generator=generator)[:, 0]
+                if greedy and indices[0] == 0 :
+                    choices[0] = logits[0].argmax(-1).item()
+                for k, action in zip(indices, choices.tolist()):
+                    actions[k].append(action)
+                return choices.tolist()
+
+            infos, rewards, steps = lockstep_episodes(envs, decide, observations=[e.representation() for e in envs])
+            for k, info in enumerate(infos):
+                key = solution_key(info, envs[k].total_distance)
+                if best is None or key > best[0]:
+                    best = (key, actions[k])
+            sampled += len(envs)
+        return best, sampled
+
+    def complete(self, beams):
+        """ Greedy completion of the beams, in lockstep: [(last info, env, actions)] """
+        envs = [beam_env for _, beam_env, _ in beams]
+
+        def decide(indices, observations):
+            choices = self.logits(observations, [envs[k] for k in indices]).argmax(-1).tolist()
+            for k, action in zip(indices, choices):
+                beams[k][2].append(action)
+            return choices
+
+        infos, _, _ = lockstep_episodes(envs, decide, observations=[e.representation() for e in envs])
+        return [(info, beam_env, beam_actions) for info, (_, beam_env, beam_actions) in zip(infos, beams)]
+
+    def beam(self, env, deadline=None):
+        """ Beam search from env: (key, actions) of the best finished trajectory,
+            the greedy one among them (never worse than greedy)
+        """
+        # Beams: (log probability, env, actions)
+        beams = [(0., copy.deepcopy(env), [])]
+        finished = self.complete([(0., copy.deepcopy(env), [])])
+        while beams and len(finished) <= self.width:
+            if deadline is not None and time.time() >= deadline:
+                # Out of time: the beams are completed greedily
+                finished += self.complete(beams)
+                break
+
+            envs = [beam_env for _, beam_env, _ in beams]
+            log_probs = log_softmax(self.logits([e.representation() for e in envs], envs).double(), dim=-1).cpu()
+            candidates = []
+            for b, (score, _, _) in enumerate(beams):
+                top = log_probs[b].topk(min(self.width, int(torch.isfinite(log_probs[b]).sum())))
+                candidates += [(score + lp, b, action) for lp, action in zip(top.values.tolist(), top.indices.tolist())]
+            candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+
+            new_beams = []
+            for score, b, action in candidates[:self.width]:
+                beam_env = copy.deepcopy(beams[b][1])
+                observation, reward, done, info = beam_env.step(action)
+                if done :
+                    finished.append((info, beam_env, beams[b][2] + [action]))
+                else :
+                    new_beams.append((score, beam_env, beams[b][2] + [action]))
+            beams = new_beams
+        self.stats['trajectories'] += len(finished)
+        info, beam_env, actions = max(finished, key=lambda final: solution_key(final[0], final[1].total_distance))
+        return solution_key(info, beam_env.total_distance), actions
+
+    def fan_out(self, env, deadline):
+        """ Sampling split over worker processes """
+        shares = [self.width // self.workers + (w < self.width % self.workers) for w in range(self.workers)]
+        seed = self.seed if self.seed is not None else torch.seed() % 2**31
+        arguments = [(self.model, self.typ, env, share, deadline, seed + w, w == 0,
+                      dict(temperature=self.temperature, masked=self.masked, batch_size=self.batch_size,
+                           dtype=self.dtype, device=self.device, precision=self.precision))
+                     for w, share in enumerate(shares) if share > 0]
+        with mp.get_context('spawn').Pool(len(arguments)) as pool:
+            results = pool.starmap(sampling_worker, arguments)
+        self.stats['trajectories'] += sum(sampled for _, sampled in results)
+        return max((best for best, _ in results), key=lambda best: best[0])
+
+    def __call__(self, env):
+        """ Decodes the episode of the (reset) env, left in the state of the best solution:
+            (last info, total reward, steps)
+        """
+        start = time.time()
+        deadline = start + self.budget if self.budget > 0 else None
+        self.stats = {'trajectories': 0, 'time': 0.}
+        if self.decoding == 'beam':
+            _, actions = self.beam(env, deadline)
+        elif self.workers > 1 :
+            _, actions = self.fan_out(env, deadline)
+        else :
+            best, sampled = self.sample(env, self.width, deadline, seed=self.seed)
+            self.stats['trajectories'] += sampled
+            actions = best[1]
+
+        # Replay of the best solution
+        total_reward = 0
+        for action in actions:
+            observation, reward, done, info = env.step(action)
+            total_reward += reward
+        self.stats['time'] = time.time() - start
+        return info, total_reward, len(actions)
+
+
+def sampling_worker(model, typ, env, nb_samples, deadline, seed, greedy_first, kwargs):
+    """ Sampling share of a worker process: ((key, actions), number of trajectories) """
+    torch.set_num_threads(1)
+    decoder = TrajectoryDecoder(model, typ, decoding='sampling', **kwargs)
+    return decoder.sample(env, nb_samples, deadline, seed=seed, greedy_first=greedy_first)
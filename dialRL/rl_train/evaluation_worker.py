@@ -0,0 +1,129 @@
+import os
+import time
+import json
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+
+from dialRL.utils import objdict, torch_load
+from dialRL.rl_train.checkpointer import CHECKPOINT_PATTERN, list_checkpoints
+
+
+class EvaluationWorker():
+    """ Evaluation of a training run, apart from the training process (--eval_process 1).
+        Watches the checkpoints folder of the run and evaluates the model of the latest
+        end of epoch checkpoint (every --eval_every epochs) with the full evaluation suite.
+        The evaluator is a SupervisedTrainer of the same parameters: it has its own envs,
+        supervision and validation data, reports to the same logger and saves the best
+        models of the run. Checkpoints that got superseded while evaluating are skipped,
+        so that a slow evaluation never holds back the training.
+    """
+    def __init__(self, trainer, stop=None, poll=10):
+        self.trainer = trainer
+        self.stop = stop
+        self.poll = poll
+        self.directory = trainer.path_name + '/checkpoints/'
+        self.state_file = trainer.path_name + '/evaluation.json'
+        self.final_epoch = min(trainer.rl, trainer.epochs)
+        self.validation_data = None
+
+        # Evaluation state of the run (a restarted worker goes on with the same best metrics)
+        self.last_epoch = 0
+        if os.path.isfile(self.state_file):
+            with open(self.state_file) as f:
+                state = json.load(f)
+            self.last_epoch = state['last_epoch']
+            self.trainer.best_eval_metric = state['best_eval_metric']
+
+    def due(self, epoch):
+        return epoch > self.last_epoch and (epoch % self.trainer.eval_every == 0 or epoch == self.final_epoch)
+
+    def next_checkpoint(self):
+        """ Latest end of epoch checkpoint still to evaluate """
+        for file in reversed(list_checkpoints(self.directory)):
+            epoch, step = map(int, CHECKPOINT_PATTERN.search(file).groups())
+            if step == 0 and self.due(epoch):
+                return epoch, file
+        return None, None
+
+    def load_validation_data(self):
+        """ Validation data of the offline evaluations (first data part) """
+        trainer = self.trainer
+        if trainer.supervision_function == 'rf' or trainer.pretrain:
+            if trainer.streaming :
+                _, self.validation_data = trainer.updating_stream_data()
+            else :
+                _, self.validation_data = trainer.updating_data()
+
+    def evaluate(self, epoch, file):
+        try :
+            state = torch_load(file, map_location='cpu')
+        except (FileNotFoundError, EOFError, RuntimeError) as err:
+            # Rotated away by the training
+            print('/!\\ Evaluation skipped checkpoint', file, err)
+            return
+        if self.validation_data is None:
+            self.load_validation_data()
+
+        start = time.time()
+        trainer = self.trainer
+        trainer.model.load_state_dict(state['model'])
+        # checkpoint_<e>_0 holds the model trained by the epoch e-1
+        trainer.current_epoch = epoch - 1
+        trainer.round_counter = state['round_counter']
+        trainer.evaluate(self.validation_data)
+
+        self.last_epoch = epoch
+        with open(self.state_file, 'w') as f:
+            json.dump({'last_epoch': self.last_epoch,
+                       'best_eval_metric': list(trainer.best_eval_metric)}, f)
+        print(' - Evaluated epoch', epoch - 1, 'in {t:.1f}s'.format(t=time.time() - start))
+
+    def run(self):
+        print('\t ** Evaluation START ! **', self.directory)
+        while self.last_epoch < self.final_epoch:
+            stopping = self.stop is not None and self.stop.is_set()
+            epoch, file = self.next_checkpoint()
+            if file is None:
+                if stopping :
+                    break
+                time.sleep(self.poll)
+            else :
+                self.evaluate(epoch, file)
+        self.trainer.checkpointer.wait()
+        print('\t ** Evaluation DONE ! **')
+
+
+def evaluation_process(flags, path_name, task_id=None, stop=None):
+    """ Entry point of the spawned evaluation process """
+    from dialRL.rl_train.supervised_trainer import SupervisedTrainer
+
+    flags = objdict(dict(flags))
+    flags.evaluation_dir = path_name
+    flags.resume = ''
+    flags.world_size, flags.rank, flags.local_rank = 1, 0, 0
+    # Daemonic process: no data loading workers
+    flags.num_workers = 0
+    torch.set_num_threads(flags.eval_threads)
+    if flags.seed is not None:
+        np.random.seed(flags.seed)
+        torch.manual_seed(flags.seed)
+
+    sacred = None
+    if task_id is not None:
+        from clearml import Task
+        sacred = Task.get_task(task_id=task_id)
+
+    evaluator = SupervisedTrainer(flags, sacred=sacred)
+    EvaluationWorker(evaluator, stop=stop, poll=flags.eval_poll).run()
+
+
+def start_evaluation_process(flags, path_name, task_id=None):
+    """ Spawns the evaluation process of a run, returns it with its stop event """
+    context = mp.get_context('spawn')
+    stop = context.Event()
+    process = context.Process(target=evaluation_process,
+                              args=(dict(flags), path_name, task_id, stop),
+                              daemon=True)
+    process.start()
+    return process, stop
@@ -0,0 +1,52 @@
+import contextlib
+
+
+def lockstep_episodes(envs, decide, seeds=None, profiler=None, on_step=None, observations=None):
+    """ Episodes of several environments run in lockstep (online evaluations, --eval_batch_size):
+        at each step, decide(indices, observations) takes the observations of the still active
+        environments (one batched forward of the model) and returns their actions.
+        Finished environments leave the batch. on_step(index, reward) is called after each step.
+        seeds: of the random instances, the environments being reset at the same time.
+        observations: current observations of environments already reset (not reset again).
+        Returns the last info, total reward and number of steps of each environment.
+    """
+    if observations is None:
+        observations = [env.reset() if seeds is None else env.reset(seed=int(seeds[k])) for k, env in enumerate(envs)]
+    observations = list(observations)
+    infos = [None] * len(envs)
+    rewards = [0] * len(envs)
+    steps = [0] * len(envs)
+    active = list(range(len(envs)))
+    while active:
+        actions = decide(active, [observations[k] for k in active])
+        still_active = []
+        with profiler.phase('Env step') if profiler is not None else contextlib.nullcontext():
+            for k, action in zip(active, actions):
+                observations[k], reward, done, infos[k] = envs[k].step(action)
+                rewards[k] += reward
+                steps[k] += 1
+                if on_step is not None:
+                    on_step(k, reward)
+                if not done:
+                    still_active.append(k)
+        if profiler is not None:
+            profiler.count('Env steps', len(active))
+        active = still_active
+    return infos, rewards, steps
+
+
+def add_episodes(totals, infos, rewards, gap_counted=None):
+    """ Adds finished episodes (last info and total reward of each) to the totals of an evaluation
+        run by --eval_batch_size chunks: fit solutions, delivered targets, rewards and GAP of the
+        fit solutions (only of the episodes whose gap_counted is True, if given).
+        totals: {'fit_solution', 'delivered', 'reward', 'gap'}, None for the first chunk.
+    """
+    if totals is None:
+        totals = {'fit_solution': 0, 'delivered': 0, 'reward': 0, 'gap': 0}
+    for k, info in enumerate(infos):
+        totals['fit_solution'] += info['fit_solution']
+        totals['delivered'] += info['delivered']
+        totals['reward'] += rewards[k]
+        if info['fit_solution'] and (gap_counted is None or gap_counted[k]):
+            totals['gap'] += info['GAP']
+    return totals
@@ -0,0 +1,86 @@
+import time
+import json
+import contextlib
+from collections import defaultdict
+
+import torch
+
+try :
+    import resource
+except ImportError:
+    resource = None
+
+
+class TrainingProfiler():
+    """ Time and throughput metrics of the training epochs and evaluations (--profile).
+        A section (an epoch, an evaluation) starts with start() and ends with report():
+            - phase(name): wall clock time spent in a phase, on CUDA the device is synchronised
+              at the end of the phase so that its asynchronous kernels are accounted to it.
+            - count(name, n): events of the section, reported per second.
+        The metrics are reported to the logger (report_scalar) and appended to a JSONL file.
+    """
+    def __init__(self, device, file_name=None, sacred=None, enabled=True):
+        self.cuda = str(device).startswith('cuda')
+        self.device = device
+        self.file_name = file_name
+        self.sacred = sacred
+        self.enabled = enabled
+        self.start()
+
+    def synchronize(self):
+        if self.cuda :
+            torch.cuda.synchronize(self.device)
+
+    def start(self):
+        self.times = defaultdict(float)
+        self.counts = defaultdict(int)
+        if self.enabled and self.cuda :
+            torch.cuda.reset_peak_memory_stats(self.device)
+        self.start_time = time.perf_counter()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        yield
+        if self.enabled :
+            self.synchronize()
+            self.times[name] += time.perf_counter() - start
+
+    def add(self, name, seconds):
+        """ Time of a phase measured by the caller """
+        self.times[name] += seconds
+
+    def count(self, name, n=1):
+        self.counts[name] += n
+
+    def peak_memory(self):
+        """ Peak memory of the section (CUDA) or of the process (CPU resident set), in MB """
+        if self.cuda :
+            return torch.cuda.max_memory_allocated(self.device) / 1024**2
+        elif resource is not None:
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        return 0
+
+    def report(self, title, iteration, **metrics):
+        """ Metrics of the section since start() """
+        if not self.enabled :
+            return {}
+        self.synchronize()
+        elapsed = time.perf_counter() - self.start_time
+        values = {'Time (s)': elapsed}
+        for name, seconds in self.times.items():
+            values[name + ' (s)'] = seconds
+            values[name + ' %'] = 100 * seconds / elapsed
+        for name, count in self.counts.items():
+            values[name + '/s'] = count / elapsed
+        values['Peak memory (MB)'] = self.peak_memory()
+        values.update(metrics)
+
+        if self.sacred :
+            for series, value in values.items():
+                self.sacred.get_logger().report_scalar(title=title,
+                    series=series, value=value, iteration=iteration)
+        if self.file_name :
+            with open(self.file_name, 'a') as f:
+                f.write(json.dumps(dict(title=title, iteration=iteration, time=time.time(), **values)) + '\n')
+        return values
@@ -6,6 +6,9 @@ import json
 import numpy as np
 import math
 import copy
+import contextlib
+import shutil
+from functools import partial
 
 # from stable_baselines.common.policies import MlpPolicy, MlpLstmPolicy
 # from stable_baselines.common import make_vec_env
@@ -26,11 +29,13 @@ import matplotlib
 matplotlib.use('Agg')
 
 
-from torch.utils.data import DataLoader, SubsetRandomSampler, Dataset, ConcatDataset
+from torch.utils.data import DataLoader, SubsetRandomSampler, WeightedRandomSampler, DistributedSampler, Dataset, ConcatDataset
 from torch.distributions.categorical import Categorical
 import torch
 import torch.nn as nn
-from torch.nn.functional import softmax
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.nn.functional import softmax, log_softmax, kl_div
 from torch.optim.lr_scheduler import MultiStepLR, ReduceLROnPlateau
 import torch.optim as optim
 from sklearn.metrics import confusion_matrix, f1_score
@@ -38,12 +43,19 @@ from sklearn.metrics import confusion_matrix, f1_score
 from dialRL.models import *
 from dialRL.utils.reward_functions import *
 from dialRL.environments import DarEnv, DarPixelEnv, DarSeqEnv
-from dialRL.utils import get_device, trans25_coord2int, objdict, SupervisionDataset
+from dialRL.utils import get_device, torch_load, autocast, trans25_coord2int, objdict, SupervisionDataset, StreamingSupervisionDataset, BucketBatchSampler, BatchAugmentation
+from dialRL.utils import collate_observations, collate_supervision, move_to_device, split_batch, mask_logits
 # from dialRL.rl_train.callback import MonitorCallback
 from dialRL.strategies import NNStrategy, NNStrategyV2
 from dialRL.dataset import RFGenerator
 from dialRL.dataset import DataFileGenerator
+from dialRL.dataset import add_shard, update_manifest, load_manifest, manifest_histogram, shard_labels, shard_sizes
 
+from dialRL.rl_train.checkpointer import Checkpointer, list_checkpoints, rng_state, set_rng_state, read_model_state
+from dialRL.rl_train.evaluation_worker import EvaluationWorker, start_evaluation_process
+from dialRL.rl_train.profiler import TrainingProfiler
+from dialRL.rl_train.lockstep import lockstep_episodes
+from dialRL.rl_train.decoding import TrajectoryDecoder, DECODINGS
 from dialRL.strategies.external.darp_rf.run_rf_algo import run_rf_algo
 
 
@@ -70,7 +82,15 @@ class SupervisedTrainer():
         # Create saving experient dir
         if False :#self.sacred :
             self.path_name = '/'.join([self.sacred.experiment_info['base_dir'], self.file_dir, str(self.sacred._id)])
-        else :
+        elif self.evaluation_dir :
+            # Evaluation process of a run (see evaluation_worker.py), no new folder
+            self.path_name = self.evaluation_dir.rstrip('/')
+            print(' ** Evaluating train path: ', self.path_name)
+        elif self.resume :
+            # A resumed training goes on in the folder of the interrupted one
+            self.path_name, self.resume_file = self.resume_paths()
+            print(' ** Resuming train path: ', self.path_name)
+        elif self.rank == 0 :
             self.path_name = self.rootdir + '/data/rl_experiments/' + self.alias + time.strftime("%d-%H-%M") + '_typ' + str(self.typ)
             print(' ** Saving train path: ', self.path_name)
             if not os.path.exists(self.path_name):
@@ -80,13 +100,33 @@ class SupervisedTrainer():
                 self.path_name = self.path_name + '#' + str(torch.randint(0, 10000, [1]).item())
                 os.makedirs(self.path_name, exist_ok=True)
 
-        # Save parameters
-        with open(self.path_name + '/parameters.json', 'w') as f:
-            json.dump(vars(self), f)
+            # Save parameters
+            with open(self.path_name + '/parameters.json', 'w') as f:
+                json.dump(vars(self), f)
+
+        # Distributed training: every process shares the path of the main one (rank 0)
+        self.distributed = self.world_size > 1
+        if self.distributed :
+            if self.rl < self.epochs:
+                raise ValueError('The RL fine tuning is not distributed, use --world_size 1')
+            path_name = [getattr(self, 'path_name', None)]
+            dist.broadcast_object_list(path_name, src=0)
+            self.path_name = path_name[0]
 
         self.sacred = sacred
+        self.flags = dict(flags)
 
         self.device = get_device()
+        if self.distributed and str(self.device).startswith('cuda'):
+            self.device = 'cuda:' + str(self.local_rank % torch.cuda.device_count())
+
+        # Numerical precision of the models and data pipeline (bf16 autocasts float32 models)
+        if self.precision == 'float64':
+            self.dtype = torch.float64
+        elif self.precision in ['float32', 'bf16']:
+            self.dtype = torch.float32
+        else :
+            raise ValueError('Unknown precision: ' + self.precision)
 
         #### RL elements
 
@@ -334,7 +374,7 @@ class SupervisedTrainer():
                                                  src_pad_idx=self.image_size,
                                                  trg_pad_idx=self.image_size,
                                                  dropout=self.dropout,
-                                                 device=self.device).to(self.device).double()
+                                                 device=self.device).to(self.device, self.dtype)
         elif self.model=='Trans2':
             self.model = globals()[self.model](src_vocab_size=1000,
                                                  trg_vocab_size=self.nb_target + 1,
@@ -346,7 +386,7 @@ class SupervisedTrainer():
                                                  heads=self.heads,
                                                  forward_expansion=self.forward_expansion,
                                                  extremas=self.env.extremas,
-                                                 device=self.device).to(self.device).double()
+                                                 device=self.device).to(self.device, self.dtype)
         elif self.model=='Trans25':
             self.model = globals()[self.model](src_vocab_size=1000,
                                                  trg_vocab_size=1000,
@@ -358,7 +398,7 @@ class SupervisedTrainer():
                                                  heads=self.heads,
                                                  forward_expansion=self.forward_expansion,
                                                  extremas=self.env.extremas,
-                                                 device=self.device).to(self.device).double()
+                                                 device=self.device).to(self.device, self.dtype)
         elif self.model=='Trans27':
             self.model = globals()[self.model](src_vocab_size=50000,
                                                  trg_vocab_size=self.nb_target + 1,
@@ -371,7 +411,7 @@ class SupervisedTrainer():
                                                  heads=self.heads,
                                                  forward_expansion=self.forward_expansion,
                                                  device=self.device,
-                                                 typ=self.typ).to(self.device).double()
+                                                 typ=self.typ).to(self.device, self.dtype)
         elif self.model=='Trans28':
             self.model = globals()[self.model](src_vocab_size=50000,
                                                  trg_vocab_size=self.vocab_size + 1,
@@ -386,7 +426,7 @@ class SupervisedTrainer():
                                                  heads=self.heads,
                                                  forward_expansion=self.forward_expansion,
                                                  typ=self.emb_typ,
-                                                 max_time=int(self.env.time_end)).to(self.device).double()
+                                                 max_time=int(self.env.time_end)).to(self.device, self.dtype)
         elif self.model=='Trans17':
             self.model = globals()[self.model](src_vocab_size=50000,
                                                  trg_vocab_size=self.vocab_size + 1,
@@ -403,7 +443,7 @@ class SupervisedTrainer():
                                                  typ=self.emb_typ,
                                                  max_time=int(self.env.time_end),
                                                  encoder_bn=self.encoder_bn,
-                                                 decoder_bn=self.decoder_bn).to(self.device).double()
+                                                 decoder_bn=self.decoder_bn).to(self.device, self.dtype)
         elif self.model=='Trans18':
             self.model = globals()[self.model](src_vocab_size=50000,
                                                  trg_vocab_size=self.vocab_size + 1,
@@ -421,7 +461,7 @@ class SupervisedTrainer():
                                                  max_time=int(self.env.time_end),
                                                  classifier_type=self.classifier_type,
                                                  encoder_bn=self.encoder_bn,
-                                                 decoder_bn=self.decoder_bn).to(self.device).double()
+                                                 decoder_bn=self.decoder_bn).to(self.device, self.dtype)
         elif self.model=='Trans19':
             self.model = globals()[self.model](src_vocab_size=50000,
                                                  trg_vocab_size=self.vocab_size + 1,
@@ -443,7 +483,7 @@ class SupervisedTrainer():
                                                  max_capacity=self.env.max_capacity,
                                                  image_size=self.image_size,
                                                  pretrain=self.pretrain,
-                                                 unfreezing_strat=self.unfreezing_strat).to(self.device).double()
+                                                 unfreezing_strat=self.unfreezing_strat).to(self.device, self.dtype)
         else :
             raise "self.model in PPOTrainer is not found"
 
@@ -481,19 +521,79 @@ class SupervisedTrainer():
         elif self.scheduler == 'step':
             self.scheduler = MultiStepLR(self.optimizer, milestones=self.milestones, gamma=self.gamma)
 
-        # Checkpoint
+        # Checkpoint (saved model or training checkpoint)
         if self.checkpoint_dir :
             print(' -- -- -- -- -- Loading  -- -- -- -- -- --')
             if self.typ >= 40 :
-                self.model.load_state_dict(torch.load(self.rootdir + '/data/rl_experiments/' + self.checkpoint_dir).state_dict(), strict=False)
+                self.model.load_state_dict(read_model_state(self.rootdir + '/data/rl_experiments/' + self.checkpoint_dir), strict=False)
             else:
-                self.model.load_state_dict(torch.load(self.rootdir + '/data/rl_experiments/' + self.checkpoint_dir).state_dict())
+                self.model.load_state_dict(read_model_state(self.rootdir + '/data/rl_experiments/' + self.checkpoint_dir))
             print(' -- The model weights has been loaded ! --')
             print(' -----------------------------------------')
 
+        # Training checkpoints and saved models are written in the background
+        self.checkpointer = Checkpointer(self.path_name + '/checkpoints/', keep_last=self.keep_checkpoints)
+        # Time / throughput metrics of the epochs and evaluations, mirrored in metrics.jsonl
+        self.profiler = TrainingProfiler(self.device, self.path_name + '/metrics.jsonl', sacred=self.sacred, enabled=bool(self.profile))
+        self.resume_state = None
+        self.data_state = None
+        self.round_counter = 0
+
+        # Attention kernels (--attention_backend einsum, sdpa or sparse), same weights
+        self.attention_backend = set_attention_backend(self.model, self.attention_backend,
+                                                       neighbours=self.neighbours, time_weight=self.time_weight)
+        if self.attention_backend == 'sparse' and (self.compile or self.onnx):
+            print('/!\\ The sparse attention neighbours are computed outside of the model graph, no compiled / ONNX forward')
+            self.compile, self.onnx = '', 0
+
         if self.rl < 10000:
             self.baseline_model = copy.deepcopy(self.model)
 
+        # Compiled forward passes (--compile jit or compile), self.model keeps the parameters
+        if self.compile :
+            self.policy = CompiledPolicy(self.model, backend=self.compile)
+        else :
+            self.policy = self.model
+
+        # Training forward passes go through the DDP wrapper (gradients all reduced)
+        # self.model stays the plain module for the evaluations and the saved models
+        if self.distributed :
+            self.parallel_model = DistributedDataParallel(self.policy,
+                                                          device_ids=[self.device] if str(self.device).startswith('cuda') else None,
+                                                          find_unused_parameters=True)
+        else :
+            self.parallel_model = self.policy
+
+        # onnxruntime inference of the evaluation episodes (--onnx), graphs exported from self.model
+        self.onnx_policy = None
+        if self.onnx :
+            self.onnx_policy = OnnxPolicy(self.model, directory=self.path_name + '/onnx/',
+                                          threads=torch.get_num_threads(), device=self.device)
+        self.onnx_epoch = None
+
+        # Instances of different sizes: padded batches (lengths masked in the attention),
+        # grouped by size when possible (--bucketing)
+        if self.bucketing :
+            if self.pretrain or not (isinstance(self.model, Trans18) and self.model.padding_supported()):
+                raise ValueError('--bucketing needs a Trans18 of typ 16, 17, 18, 19 or 26 with a classifier_type 1, 2 or 4')
+
+        # Knowledge distillation (--teacher): the model learns the soft action distributions of the teacher
+        self.teacher_model = None
+        self.teacher_stats = None
+        if self.teacher :
+            self.teacher_model = self.load_teacher(self.rootdir + '/data/rl_experiments/' + self.teacher)
+
+        # Feasibility masked decoding: decisions changed by the mask, per evaluation
+        self.masking_stats = {'decisions': 0, 'changed': 0}
+        if self.decoding not in DECODINGS :
+            raise ValueError('--decoding should be one of ' + str(DECODINGS) + ', not ' + str(self.decoding))
+
+        # Data augmentation of the training batches
+        if self.augmentation :
+            self.augmenter = BatchAugmentation(device=self.device if self.augmentation_device else None)
+        else :
+            self.augmenter = None
+
         # number of elements passed throgh the model for each epoch
         self.testing_size = self.batch_size * (10000 // self.batch_size)    #About 10k
         self.training_size = self.batch_size * (100000 // self.batch_size)   #About 100k
@@ -598,7 +698,7 @@ class SupervisedTrainer():
         self.data_part = 0
 
         def load_dataset():
-            return [saving_name + file for file in os.listdir(saving_name)]
+            return [saving_name + file for file in os.listdir(saving_name) if file.endswith('.pt')]
             # files_names = os.listdir(saving_name)
             # datasets = []
             # for file in files_names:
@@ -618,13 +718,14 @@ class SupervisedTrainer():
             # for data in dataset:
             #     o, a = data
             #     action_counter[a] += 1
-            # self.criterion.weight = torch.from_numpy(action_counter).to(self.device)
+            # self.criterion.weight = torch.from_numpy(action_counter).to(self.device, self.dtype)
             return dataset
         else :
             os.makedirs(saving_name)
 
         done = True
         last_save_size = 0
+        shards = {}
         sub_data = []
         sub_action_counter = np.zeros(self.vocab_size + 1)
         observation = self.env.reset()
@@ -648,6 +749,7 @@ class SupervisedTrainer():
                     train_data = SupervisionDataset(data, augment=self.augmentation, typ=self.typ)
                     name = partial_name(len(data))
                     torch.save(train_data, name)
+                    shards[name] = add_shard(name, data)
                     data = []
                     print('Saving data status')
 
@@ -670,9 +772,11 @@ class SupervisedTrainer():
         train_data = SupervisionDataset(data, augment=self.augmentation, typ=self.typ)
         name = partial_name(len(data))
         torch.save(train_data, name)
+        shards[name] = add_shard(name, data)
+        update_manifest(shards)
 
         print('Done Generating !')
-        self.criterion.weight = torch.from_numpy(action_counter).to(self.device)
+        self.criterion.weight = torch.from_numpy(action_counter).to(self.device, self.dtype)
         data = load_dataset()
         return data
 
@@ -726,66 +830,259 @@ class SupervisedTrainer():
         return final_loss, time_distance, pick_distance, drop_distance, correct_loaded, correct_available
 
 
-    def train(self, dataloader):
-        max_test_accuracy = 0
-        running_loss = 0
-        total = 0
-        correct = nearest_accuracy = pointing_accuracy = 0
-        mean_time_distance, mean_pick_distance, mean_drop_distance, mean_correct_loaded, mean_correct_available = 0, 0, 0, 0, 0
-
-        self.model.train()
-        for i, data in enumerate(dataloader):
-            # set the parameter gradients to zero
-            self.optimizer.zero_grad()
-
-            observation, supervised_action = data
-
-            if self.typ >= 40 :
-                world, targets, drivers, positions, time_constraints, prior_kwlg = observation
-            else :
-                world, targets, drivers, positions, time_constraints = observation
-            info_block = [world, targets, drivers]
-            # Current player as trg elmt
-            if self.typ in [17, 18, 19]:
-                target_tensor = world
-            else :
-                target_tensor = world[1].unsqueeze(-1).type(torch.LongTensor).to(self.device)
-            # target_tensor = torch.tensor([0 for _ in range(self.batch_size)]).unsqueeze(-1).type(torch.LongTensor).to(self.device)
-            # coord_int = trans25_coord2int(positions[1][supervised_action])
-            model_action = self.model(info_block,
-                                      target_tensor,
-                                      positions=positions,
-                                      times=time_constraints)
+    def batch_weight(self, supervised_action):
+        """ Normalisation of the batch loss: its number of samples, or the sum of their
+            class weights with a weighted cross entropy (as its 'mean' reduction does)
+        """
+        if not self.pretrain and getattr(self.criterion, 'weight', None) is not None:
+            return self.criterion.weight[supervised_action.squeeze(-1)].sum().item()
+        return supervised_action.size(0)
+
+    def load_teacher(self, file_name):
+        """ Whole saved model (best models) used as teacher, frozen in eval mode """
+        teacher = torch_load(file_name, map_location=self.device)
+        if not isinstance(teacher, nn.Module):
+            raise ValueError('--teacher needs a whole saved model (models/best_*_model.pt), not a training checkpoint')
+        for module in teacher.modules():
+            if hasattr(module, 'device'):
+                module.device = self.device
+        teacher = teacher.to(self.device, self.dtype).eval()
+        for param in teacher.parameters():
+            param.requires_grad = False
+        if self.bucketing and not (isinstance(teacher, Trans18) and teacher.padding_supported()):
+            raise ValueError('--bucketing needs a teacher supporting the padded batches (see Trans18.padding_supported)')
+        nb_params = lambda model: sum(param.numel() for param in model.parameters())
+        print(' -- Distillation of the teacher {t} ({p} parameters) into a {s} of {n} parameters'.format(
+            t=type(teacher).__name__, p=nb_params(teacher), s=type(self.model).__name__, n=nb_params(self.model)))
+        return teacher
+
+    def distillation_loss(self, model_action, teacher_action, supervised_action):
+        """ Kullback-Leibler divergence to the teacher distribution softened by the temperature (scaled by its
+            square to keep the gradients magnitude) and cross entropy on the supervised action, each weighted
+            by its share of the mix. The two terms are returned apart: the first is a mean over the samples,
+            the second over their class weights with a weighted criterion.
+        """
+        if teacher_action.shape != model_action.shape:
+            raise ValueError('The teacher and the model do not have the same actions: {t} / {m}'.format(
+                t=list(teacher_action.shape), m=list(model_action.shape)))
+        temperature = self.distillation_temperature
+        soft_loss = kl_div(log_softmax(model_action / temperature, dim=-1),
+                           softmax(teacher_action / temperature, dim=-1),
+                           reduction='batchmean') * temperature**2
+        hard_loss = self.criterion(model_action, supervised_action)
+        return self.distillation_weight * soft_loss, (1 - self.distillation_weight) * hard_loss
+
+    def padding_kwargs(self, lengths):
+        """ lengths of the padded batches (--bucketing) as model kwargs """
+        if lengths is None:
+            return {}
+        return {'lengths': lengths}
+
+    def micro_step(self, observation, supervised_action, batch_weight, batch_size, lengths=None):
+        """ Forward and backward pass of a micro batch.
+            Its mean loss is weighted by its share of the batch (batch_weight, or batch_size for the
+            distillation term, a mean over the samples) so that the accumulated gradients and losses
+            are the ones of the whole batch.
+        """
+        if self.typ >= 40 :
+            world, targets, drivers, positions, time_constraints, prior_kwlg = observation
+        else :
+            world, targets, drivers, positions, time_constraints = observation
+        info_block = [world, targets, drivers]
+        # Current player as trg elmt
+        if self.typ in [17, 18, 19]:
+            target_tensor = world
+        else :
+            target_tensor = world[1].unsqueeze(-1).type(torch.LongTensor).to(self.device)
+        # target_tensor = torch.tensor([0 for _ in range(self.batch_size)]).unsqueeze(-1).type(torch.LongTensor).to(self.device)
+        # coord_int = trans25_coord2int(positions[1][supervised_action])
+        with self.profiler.phase('Forward'):
+            with autocast(self.precision, self.device):
+                model_action = self.parallel_model(info_block,
+                                                   target_tensor,
+                                                   positions=positions,
+                                                   times=time_constraints,
+                                                   **self.padding_kwargs(lengths))
+            model_action = self.autocast_output(model_action)
             # Typ > 40: model action (time, int)xd , (bool, dist, dist)xt
 
-            supervised_action = supervised_action.to(self.device)
-
+            share = self.batch_weight(supervised_action) / batch_weight
             if self.pretrain :
                 loss, time_distance, pick_distance, drop_distance, correct_loaded, correct_available = self.pretrain_loss(model_action, prior_kwlg)
-                total += supervised_action.size(0)
-                running_loss += loss.item()
-                mean_time_distance += time_distance
-                mean_pick_distance += pick_distance
-                mean_drop_distance += drop_distance
-                mean_correct_loaded += correct_loaded
-                mean_correct_available += correct_available
-                correct += (correct_available + correct_loaded)/2
+                loss = loss * share
+            elif self.teacher_model is not None :
+                with torch.no_grad(), autocast(self.precision, self.device):
+                    teacher_action = self.teacher_model(info_block,
+                                                        target_tensor,
+                                                        positions=positions,
+                                                        times=time_constraints,
+                                                        **self.padding_kwargs(lengths))
+                teacher_action = self.autocast_output(teacher_action)
+                soft_loss, hard_loss = self.distillation_loss(model_action.squeeze(1), teacher_action.squeeze(1), supervised_action.squeeze(-1))
+                loss = soft_loss * supervised_action.size(0) / batch_size + hard_loss * share
             else :
-                loss = self.criterion(model_action.squeeze(1), supervised_action.squeeze(-1))
-                total += supervised_action.size(0)
-                correct += np.sum((model_action.squeeze(1).argmax(-1) == supervised_action.squeeze(-1)).cpu().numpy())
-                running_loss += loss.item()
+                loss = self.criterion(model_action.squeeze(1), supervised_action.squeeze(-1)) * share
 
+        with self.profiler.phase('Backward'):
             loss.backward()
-            # update the gradients
-            self.optimizer.step()
 
-            if i == self.train_rounds:
-                break
+        if self.pretrain :
+            return (loss.item(), (correct_available + correct_loaded)/2,
+                    time_distance * share, pick_distance * share, drop_distance * share, correct_loaded, correct_available)
+        else :
+            correct = np.sum((model_action.squeeze(1).argmax(-1) == supervised_action.squeeze(-1)).cpu().numpy())
+            return loss.item(), correct
+
+    def probe_micro_batch(self, observation, supervised_action, lengths=None):
+        """ Micro batch size fitting in the memory budget (--memory_budget GB, 0: free memory).
+            The peak memory of a forward / backward pass on a probe micro batch is measured
+            (CUDA allocator peak, or the tensors saved for the backward on CPU) and scaled linearly.
+        """
+        bsz = supervised_action.size(0)
+        probe_size = min(bsz, 8)
+        probe_observation = split_batch(observation, probe_size)[0]
+        probe_action = split_batch(supervised_action, probe_size)[0]
+        probe_lengths = None if lengths is None else split_batch(lengths, probe_size)[0]
+        on_cuda = str(self.device).startswith('cuda')
+
+        saved_bytes = [0]
+        def pack(tensor):
+            saved_bytes[0] += tensor.numel() * tensor.element_size()
+            return tensor
+
+        if on_cuda :
+            torch.cuda.synchronize(self.device)
+            torch.cuda.reset_peak_memory_stats(self.device)
+            base_memory = torch.cuda.memory_allocated(self.device)
+            with self.no_sync(True):
+                self.micro_step(probe_observation, probe_action, self.batch_weight(probe_action), probe_size, probe_lengths)
+            peak = torch.cuda.max_memory_allocated(self.device) - base_memory
+            available = torch.cuda.mem_get_info(self.device)[0] * 0.9
+        elif hasattr(torch.autograd, 'graph') :
+            with self.no_sync(True), torch.autograd.graph.saved_tensors_hooks(pack, lambda tensor: tensor):
+                self.micro_step(probe_observation, probe_action, self.batch_weight(probe_action), probe_size, probe_lengths)
+            peak = saved_bytes[0]
+            available = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') * 0.5
+        else :
+            print(' /!\ The memory can not be measured on CPU with this torch version, no micro batches')
+            return bsz
+        self.optimizer.zero_grad()
+
+        budget = self.memory_budget * 1024**3 if self.memory_budget > 0 else available
+        micro_batch_size = int(max(1, min(bsz, budget * probe_size / max(peak, 1))))
+        print(' - Micro batch size: {m} ({p:.1f} MB for {s} samples, budget {b:.1f} MB)'.format(m=micro_batch_size,
+                                                                                              p=peak / 1024**2,
+                                                                                              s=probe_size,
+                                                                                              b=budget / 1024**2))
+        if self.sacred :
+            self.sacred.get_logger().report_scalar(title='Train stats',
+                series='Micro batch size', value=micro_batch_size, iteration=self.current_epoch)
+        return micro_batch_size
+
+    def train(self, dataloader):
+        max_test_accuracy = 0
+        running_loss = 0
+        total = 0
+        correct = nearest_accuracy = pointing_accuracy = 0
+        mean_time_distance, mean_pick_distance, mean_drop_distance, mean_correct_loaded, mean_correct_available = 0, 0, 0, 0, 0
 
+        # Time spent waiting on the DataLoader
+        data_time = 0
+        epoch_time = time.time()
+        last_time = time.time()
+        self.profiler.start()
+
+        # Random state of the data iteration (samplers draw their permutation at its start)
+        self.epoch_rng = rng_state()
+        skip = 0
+        if self.resume_state is not None and self.resume_state['step'] > 0 :
+            # Mid epoch resume: same permutation, the batches already trained on are skipped
+            set_rng_state(self.resume_state['epoch_rng'])
+            self.epoch_rng = self.resume_state['epoch_rng']
+            skip = self.resume_state['step']
+            running_loss, correct, total, mean_time_distance, mean_pick_distance, mean_drop_distance, mean_correct_loaded, mean_correct_available = \
+                self.resume_state['train_stats']
+            print(' - Resuming the epoch after {s} batches'.format(s=skip))
+
+        self.model.train()
+        with self.join():
+            for i, data in enumerate(dataloader):
+                if i < skip :
+                    if i == skip - 1 :
+                        set_rng_state(self.resume_state['rng'])
+                    last_time = time.time()
+                    continue
+                data_time += time.time() - last_time
+                # set the parameter gradients to zero
+                self.optimizer.zero_grad()
+
+                observation, supervised_action = data[:2]
+                # Padded batches (--bucketing) come with the lengths of their instances
+                lengths = data[2] if len(data) > 2 else None
+                if self.augmenter is not None and not self.pretrain:
+                    observation = self.augmenter(observation)
+                with self.profiler.phase('Host to device'):
+                    observation = move_to_device(observation, self.device, non_blocking=bool(self.pin_memory))
+                    supervised_action = supervised_action.to(self.device)
+                    if lengths is not None:
+                        lengths = lengths.to(self.device)
+
+                if self.micro_batch_size < 0 :
+                    self.micro_batch_size = self.probe_micro_batch(observation, supervised_action, lengths)
+
+                # Gradients of the batch accumulated over its micro batches,
+                # each loss is weighted by its share of the batch (see micro_step)
+                bsz = supervised_action.size(0)
+                micro_size = self.micro_batch_size if self.micro_batch_size > 0 else bsz
+                micro_observations = split_batch(observation, micro_size)
+                micro_actions = split_batch(supervised_action, micro_size)
+                micro_lengths = [None] * len(micro_actions) if lengths is None else split_batch(lengths, micro_size)
+                batch_weight = self.batch_weight(supervised_action)
+                for k, (micro_observation, micro_action, micro_length) in enumerate(zip(micro_observations, micro_actions, micro_lengths)):
+                    # Gradients are all reduced once, with the last micro batch
+                    with self.no_sync(k < len(micro_actions) - 1):
+                        stats = self.micro_step(micro_observation, micro_action, batch_weight, bsz, micro_length)
+                    running_loss += stats[0]
+                    correct += stats[1]
+                    if self.pretrain :
+                        mean_time_distance += stats[2]
+                        mean_pick_distance += stats[3]
+                        mean_drop_distance += stats[4]
+                        mean_correct_loaded += stats[5]
+                        mean_correct_available += stats[6]
+                total += bsz
+
+                # update the gradients
+                with self.profiler.phase('Optimizer'):
+                    self.optimizer.step()
+
+                if self.checkpoint_every and (i + 1) % self.checkpoint_every == 0 :
+                    self.save_checkpoint(self.current_epoch, step=i + 1,
+                                         train_stats=[running_loss, correct, total, mean_time_distance, mean_pick_distance,
+                                                      mean_drop_distance, mean_correct_loaded, mean_correct_available])
+
+                last_time = time.time()
+                # A streamed epoch goes through its whole window of shards
+                if i == self.train_rounds and not self.streaming:
+                    break
+
+        self.resume_state = None
+        epoch_time = time.time() - epoch_time
+        # Statistics of the whole distributed batch, every process steps its scheduler on the same loss
+        running_loss, correct, total, mean_time_distance, mean_pick_distance, mean_drop_distance, mean_correct_loaded, mean_correct_available = \
+            self.all_reduce(running_loss, correct, total, mean_time_distance, mean_pick_distance, mean_drop_distance, mean_correct_loaded, mean_correct_available)
         acc = 100 * correct/total
-        print('-> Réussite: ', acc, '%')
-        print('-> Loss:', 100*running_loss/total)
+        if self.rank == 0 :
+            print('-> Réussite: ', acc, '%')
+            print('-> Loss:', 100*running_loss/total)
+            print('-> Waiting on data: {d:.2f}s / {e:.2f}s'.format(d=data_time, e=epoch_time))
+            self.profiler.add('Data wait', data_time)
+            self.profiler.count('Samples', total)
+            metrics = self.profiler.report('Train speed', self.current_epoch)
+            if metrics and self.verbose :
+                print('-> {s:.1f} samples/s | forward {f:.2f}s | backward {b:.2f}s | optimizer {o:.2f}s | peak memory {m:.0f} MB'.format(
+                    s=metrics['Samples/s'], f=metrics.get('Forward (s)', 0), b=metrics.get('Backward (s)', 0),
+                    o=metrics.get('Optimizer (s)', 0), m=metrics['Peak memory (MB)']))
         self.scheduler.step(running_loss)
         if self.pretrain :
             self.pretrain_log('Pretrain train',
@@ -801,6 +1098,10 @@ class SupervisedTrainer():
                 series='train loss', value=100*running_loss/total, iteration=self.current_epoch)
             self.sacred.get_logger().report_scalar(title='Train stats',
                 series='Train accuracy', value=acc, iteration=self.current_epoch)
+            self.sacred.get_logger().report_scalar(title='Data loading',
+                series='Data wait %', value=100*data_time/epoch_time, iteration=self.current_epoch)
+            self.sacred.get_logger().report_scalar(title='Data loading',
+                series='Data wait (s)', value=data_time, iteration=self.current_epoch)
 
 
     def generate_rl_data(self):
@@ -863,28 +1164,21 @@ class SupervisedTrainer():
             while not done :
                 # Pass in learning model
                 if not rl_done:
-                    world, targets, drivers, positions, time_contraints = rl_observation
-                    w_t = [torch.tensor([winfo],  dtype=torch.float64) for winfo in world]
-                    t_t = [[torch.tensor([tinfo], dtype=torch.float64 ) for tinfo in target] for target in targets]
-                    d_t = [[torch.tensor([dinfo],  dtype=torch.float64) for dinfo in driver] for driver in drivers]
-                    info_block = [w_t, t_t, d_t]
-
-                    positions = [torch.tensor([positions[0]], dtype=torch.float64),
-                                 [torch.tensor([position], dtype=torch.float64) for position in positions[1]],
-                                 [torch.tensor([position], dtype=torch.float64) for position in positions[2]]]
-
-                    time_contraints = [torch.tensor([time_contraints[0]], dtype=torch.float64),
-                                     [torch.tensor([time], dtype=torch.float64) for time in time_contraints[1]],
-                                     [torch.tensor([time], dtype=torch.float64) for time in time_contraints[2]]]
+                    world, targets, drivers, positions, time_contraints = collate_observations([rl_observation], dtype=self.dtype)
+                    info_block = [world, targets, drivers]
 
                     if self.typ in [17, 18, 19]:
-                        target_tensor = torch.tensor(world).unsqueeze(-1).type(torch.LongTensor).to(self.device)
+                        target_tensor = torch.cat(world).unsqueeze(-1).type(torch.LongTensor).to(self.device)
                     else :
-                        target_tensor = torch.tensor([world[1]]).unsqueeze(-1).type(torch.LongTensor).to(self.device)
-                    rl_action = self.model(info_block,
-                                              target_tensor,
-                                              positions=positions,
-                                              times=time_contraints)
+                        target_tensor = world[1].unsqueeze(-1).type(torch.LongTensor).to(self.device)
+                    with autocast(self.precision, self.device):
+                        rl_action = self.policy(info_block,
+                                                target_tensor,
+                                                positions=positions,
+                                                times=time_contraints)
+                    rl_action = self.autocast_output(rl_action)
+                    if self.masked_decoding :
+                        rl_action = mask_logits(rl_action, [self.env.action_mask()])
                     bernouie_action = Categorical(softmax(rl_action)).sample()
 
                     rl_observation, rl_reward, rl_done, info = self.env.step(bernouie_action)
@@ -894,24 +1188,13 @@ class SupervisedTrainer():
 
                 # Pass in Baseline
                 if not baseline_done and not get_optimal_baseline:
-                    world, targets, drivers, positions, time_contraints = baseline_observation
-                    w_t = [torch.tensor([winfo],  dtype=torch.float64) for winfo in world]
-                    t_t = [[torch.tensor([tinfo], dtype=torch.float64 ) for tinfo in target] for target in targets]
-                    d_t = [[torch.tensor([dinfo],  dtype=torch.float64) for dinfo in driver] for driver in drivers]
-                    info_block = [w_t, t_t, d_t]
-
-                    positions = [torch.tensor([positions[0]], dtype=torch.float64),
-                                 [torch.tensor([position], dtype=torch.float64) for position in positions[1]],
-                                 [torch.tensor([position], dtype=torch.float64) for position in positions[2]]]
-
-                    time_contraints = [torch.tensor([time_contraints[0]], dtype=torch.float64),
-                                     [torch.tensor([time], dtype=torch.float64) for time in time_contraints[1]],
-                                     [torch.tensor([time], dtype=torch.float64) for time in time_contraints[2]]]
+                    world, targets, drivers, positions, time_contraints = collate_observations([baseline_observation], dtype=self.dtype)
+                    info_block = [world, targets, drivers]
 
                     if self.typ in [17, 18, 19]:
-                        target_tensor = torch.tensor(world).unsqueeze(-1).type(torch.LongTensor).to(self.device)
+                        target_tensor = torch.cat(world).unsqueeze(-1).type(torch.LongTensor).to(self.device)
                     else :
-                        target_tensor = torch.tensor([world[1]]).unsqueeze(-1).type(torch.LongTensor).to(self.device)
+                        target_tensor = world[1].unsqueeze(-1).type(torch.LongTensor).to(self.device)
                     baseline_action = self.baseline_model(info_block,
                                               target_tensor,
                                               positions=positions,
@@ -927,8 +1210,8 @@ class SupervisedTrainer():
             cathegorical_choices = torch.stack(cathegorical_choices).squeeze()
             sumLogProbOfActions = torch.log(softmax(torch.stack(rl_actions).squeeze(1)).gather(1, cathegorical_choices.unsqueeze(-1))).double()
             sumLogProbOfActions = sumLogProbOfActions.squeeze().sum(0)
-            rl_rewards = torch.tensor(rl_rewards).sum(-1).to(self.device).double()
-            baseline_rewards = torch.tensor(baseline_rewards).sum(-1).to(self.device).double()
+            rl_rewards = torch.tensor(rl_rewards).sum(-1).to(self.device, self.dtype)
+            baseline_rewards = torch.tensor(baseline_rewards).sum(-1).to(self.device, self.dtype)
 
             final_data.append([rl_rewards, baseline_rewards, sumLogProbOfActions])
             rl_actions = []
@@ -997,116 +1280,305 @@ class SupervisedTrainer():
             self.sacred.get_logger().report_scalar(title='RL stats',
                 series='Training reward', value=running_reward/total, iteration=self.current_epoch)
 
+    def resume_paths(self):
+        """ Run folder and checkpoint file to resume from.
+            --resume is a training checkpoint, or a run folder (its latest checkpoint),
+            absolute or relative to the rl_experiments folder.
+        """
+        resume = self.resume
+        if not os.path.exists(resume):
+            resume = self.rootdir + '/data/rl_experiments/' + resume
+        if os.path.isfile(resume):
+            return os.path.dirname(os.path.dirname(os.path.abspath(resume))), resume
+        path_name = resume.rstrip('/')
+        checkpoints = list_checkpoints(path_name + '/checkpoints/')
+        if not checkpoints:
+            raise ValueError('No checkpoint to resume from in ' + path_name)
+        return path_name, checkpoints[-1]
+
+    def save_checkpoint(self, epoch, step=0, train_stats=None):
+        """ Training checkpoint to resume at `step` batches of `epoch` (written in the background) """
+        if self.rank != 0 :
+            return
+        state = {'model': self.model.state_dict(),
+                 'optimizer': self.optimizer.state_dict(),
+                 'scheduler': self.scheduler.state_dict(),
+                 'epoch': epoch,
+                 'step': step,
+                 'round_counter': self.round_counter,
+                 'best_eval_metric': list(self.best_eval_metric),
+                 'micro_batch_size': self.micro_batch_size,
+                 'rng': rng_state(),
+                 'epoch_rng': getattr(self, 'epoch_rng', None),
+                 'data_state': self.data_state,
+                 'train_stats': train_stats}
+        file_name = self.checkpointer.save(state, epoch, step)
+        if self.verbose :
+            print(' - Checkpoint:', file_name)
+
+    def resume_checkpoint(self):
+        """ Restores the training state of the --resume checkpoint.
+            Returns the epoch to start from and the data rounds counter.
+        """
+        print(' -- -- -- -- -- Resuming  -- -- -- -- -- --')
+        print(' -- From:', self.resume_file)
+        state = torch_load(self.resume_file, map_location='cpu')
+        self.model.load_state_dict(state['model'])
+        self.optimizer.load_state_dict(state['optimizer'])
+        self.scheduler.load_state_dict(state['scheduler'])
+        self.best_eval_metric = state['best_eval_metric']
+        self.micro_batch_size = state['micro_batch_size']
+        self.round_counter = state['round_counter']
+        self.data_state = state['data_state']
+        set_rng_state(state['rng'])
+        self.resume_state = state
+        print(' -- Epoch', state['epoch'], 'step', state['step'])
+        print(' -----------------------------------------')
+        return state['epoch'], state['round_counter']
+
+    def barrier(self):
+        """ Wait for every process of the distributed training """
+        if self.distributed :
+            dist.barrier()
+
+    def no_sync(self, skip=True):
+        """ Context of the accumulated micro batches, the gradients are all reduced at the last one """
+        if self.distributed and skip :
+            return self.parallel_model.no_sync()
+        return contextlib.nullcontext()
+
+    def join(self):
+        """ Context of the training loop, processes running out of batches
+            shadow the gradient all reduce of the others (uneven shards)
+        """
+        if self.distributed :
+            return self.parallel_model.join()
+        return contextlib.nullcontext()
+
+    def all_reduce(self, *values):
+        """ Sum of the values over the processes """
+        if not self.distributed :
+            return values
+        values = torch.tensor([float(value) for value in values], dtype=torch.float64)
+        dist.all_reduce(values)
+        return values.tolist()
+
+    def shard_indices(self, indices):
+        """ Part of the indices (shuffled identically by every process) seen by this process.
+            As with DistributedSampler, the indices are wrapped to the same length on every rank.
+        """
+        if not self.distributed :
+            return indices
+        per_rank = int(math.ceil(len(indices) / self.world_size))
+        indices = list(indices) + list(indices[:per_rank * self.world_size - len(indices)])
+        return indices[self.rank::self.world_size]
+
+    def autocast_output(self, output):
+        """ bf16 outputs of the model back to the pipeline dtype """
+        if self.precision != 'bf16':
+            return output
+        elif torch.is_tensor(output):
+            return output.to(self.dtype)
+        return [self.autocast_output(elmt) for elmt in output]
+
+    def loader_kwargs(self, streaming=False, batch_sampler=None):
+        """ DataLoader options of the supervision data (workers, pinned memory, prefetching) """
+        kwargs = {'batch_size': self.batch_size,
+                  'collate_fn': partial(collate_supervision, dtype=self.dtype, pad=bool(self.bucketing)),
+                  'num_workers': self.num_workers,
+                  'pin_memory': bool(self.pin_memory) and str(self.device).startswith('cuda')}
+        if self.num_workers > 0:
+            kwargs['prefetch_factor'] = self.prefetch_factor
+            # Persistent workers would keep a stale copy of the streamed dataset epoch
+            kwargs['persistent_workers'] = bool(self.persistent_workers) and not streaming
+        if batch_sampler is not None:
+            del kwargs['batch_size']
+            kwargs['batch_sampler'] = batch_sampler
+        return kwargs
+
+    def bucket_sampler(self, indices, distributed=False):
+        """ Batches of the samples of one instance size (--bucketing), from the manifest sizes """
+        return BucketBatchSampler(self.sizes, self.batch_size,
+                                  indices=indices,
+                                  shuffle=self.shuffle,
+                                  seed=self.seed if self.seed is not None else 0,
+                                  rank=self.rank if distributed else 0,
+                                  world_size=self.world_size if distributed else 1)
+
     def load_partial_data(self):
+        # Load a 20th of the files at a time, cycling on all the parts
+        nb_parts = min(20, len(self.dataset_names))
         if len(self.dataset_names) > 10:
-            part_size = len(self.dataset_names) // 20
-            files_names = self.dataset_names[self.partial_data_state*part_size:(self.partial_data_state+1)*part_size - 1]
+            part_size = len(self.dataset_names) / nb_parts
+            files_names = self.dataset_names[int(round(self.partial_data_state*part_size)):int(round((self.partial_data_state+1)*part_size))]
             ic(len(files_names))
         else :
             files_names = self.dataset_names
         datasets = []
         for file in files_names:
             print('Datafile folder:', file)
-            datasets.append(torch.load(file))
+            datasets.append(torch_load(file))
+        self.partial_files = files_names
         self.partial_data_state += 1
-        self.partial_data_state = self.partial_data_state % 10
+        self.partial_data_state = self.partial_data_state % nb_parts
         return ConcatDataset(datasets)
 
-    def updating_data(self):
-        if self.current_epoch == 0 :
-            # First time (generate) and get files names of the data
+    def loss_weights(self, action_counter):
+        """ Cross entropy weights respectivly to max_size/size of each action """
+        min_nb = int(min(action_counter[action_counter > 0]))
+        max_nb = int(max(action_counter[action_counter > 0]))
+        action_counter[action_counter == 0] = min_nb
+        ic(min_nb/max_nb)
+        weights = max_nb/action_counter
+        if self.balanced_dataset == 3 :
+            weights[0] = 0.5
+        elif self.balanced_dataset == 4 :
+            weights[0] = 0.9
+        return weights
+
+    def class_rates(self, action_counter):
+        """ Relative sampling rate of each action to balance the data:
+            under sampling to the rarest action (1) or over sampling to the most common (2)
+        """
+        rates = np.zeros(len(action_counter))
+        present = action_counter > 0
+        if self.balanced_dataset == 1 :
+            rates[present] = min(action_counter[present]) / action_counter[present]
+        else :
+            rates[present] = max(action_counter[present]) / action_counter[present]
+        return rates
+
+    def supervision_files(self):
+        """ File names of the supervision data shards.
+            In distributed training the main process generates the missing data and manifest
+            entries, the others wait for it before reading the saved shards.
+        """
+        if self.rank != 0 :
+            self.barrier()
+        if self.supervision_function == 'rf':
+            files_names = self.supervision.generate_dataset()
+        else :
+            files_names = self.generate_supervision_data()
+        if self.rank == 0 :
+            if not self.evaluation_dir :
+                load_manifest(files_names, fill=True)
+            self.barrier()
+        return files_names
+
+    def updating_stream_data(self):
+        """ Streaming alternative to updating_data.
+            About 10% of the shards are held out for validation. The other ones are streamed
+            through a shuffle buffer, the whole of them being visited every `epochs_per_pass` epochs.
+        """
+        self.dataset_names = self.supervision_files()
+
+        files_names = sorted(self.dataset_names)
+        ic(len(files_names))
+        if len(files_names) > 1:
+            split = max(1, int(np.floor(0.1 * len(files_names))))
+            train_files, val_files = files_names[split:], files_names[:split]
+        else :
+            print(' /!\ A single shard of data, it is used for training and validation')
+            train_files, val_files = files_names, files_names
+
+        if self.bucketing :
+            print(' /!\ The streamed batches are padded but not grouped by instance size')
+        class_rates = None
+        if not self.pretrain :
+            # Per shard histograms of the manifest only
+            manifest = load_manifest(train_files)
+            action_counter = manifest_histogram([manifest[file] for file in train_files], self.vocab_size + 1)
             if self.supervision_function == 'rf':
-                self.dataset_names = self.supervision.generate_dataset()
-            elif self.pretrain :
-                self.dataset_names = self.generate_supervision_data()
+                if self.balanced_dataset in [1, 2]:
+                    class_rates = self.class_rates(action_counter)
+                else :
+                    self.criterion.weight = torch.from_numpy(self.loss_weights(action_counter)).to(self.device, self.dtype)
             else :
-                self.dataset_names = self.generate_supervision_data()
+                self.criterion.weight = torch.from_numpy(action_counter).to(self.device, self.dtype)
+
+        seed = self.seed if self.seed is not None else 0
+        self.train_dataset = StreamingSupervisionDataset(train_files,
+                                                         shuffle_buffer=self.shuffle_buffer,
+                                                         epochs_per_pass=self.epochs_per_pass,
+                                                         read_ahead=self.read_ahead,
+                                                         shuffle=self.shuffle,
+                                                         seed=seed,
+                                                         class_rates=class_rates,
+                                                         rank=self.rank,
+                                                         world_size=self.world_size)
+        self.validation_dataset = StreamingSupervisionDataset(val_files,
+                                                              shuffle_buffer=self.shuffle_buffer,
+                                                              read_ahead=self.read_ahead,
+                                                              shuffle=self.shuffle,
+                                                              seed=seed)
+        supervision_data = DataLoader(self.train_dataset, **self.loader_kwargs(streaming=True))
+        validation_data = DataLoader(self.validation_dataset, **self.loader_kwargs(streaming=True))
+        return supervision_data, validation_data
+
+    def updating_data(self, data_state=None):
+        # Replay an update of the data (resumed training), or record its state for the checkpoints
+        if data_state is not None:
+            self.partial_data_state = data_state['partial_data_state']
+            set_rng_state(data_state['rng'])
+        self.data_state = {'partial_data_state': self.partial_data_state, 'rng': rng_state()}
+
+        if getattr(self, 'dataset_names', None) is None :
+            # First time (generate) and get files names of the data
+            self.dataset_names = self.supervision_files()
 
         ic(len(self.dataset_names))
         # Load a 10th of the data
         dataset = self.load_partial_data()
 
+        # Labels of the loaded part, from the side files of its shards (no pass over the data)
+        labels = np.concatenate([shard_labels(file) for file in self.partial_files]).astype(int)
+        self.sizes = [size for file in self.partial_files for size in shard_sizes(file)]
+
         # Take care of the loaded dataset part to
         if self.supervision_function == 'rf':
-            if self.balanced_dataset == 1 :
-                action_counter = np.zeros(self.vocab_size + 1)
-                data_list = []
-                for i in range(self.vocab_size + 1):
-                    data_list.append([])
-                for data in dataset:
-                    o, a = data
-                    action_counter[a] += 1
-                    data_list[a].append(data)
-
-                min_nb = int(min(action_counter[action_counter > 0]))
-                fin_data = []
-                for i in range(len(action_counter)):
-                    if action_counter[i] > 0:
-                        fin_data = fin_data + data_list[i][:min_nb]
-
-                dataset = SupervisionDataset(fin_data, augment=self.augmentation, typ=self.typ)
-
-            elif self.balanced_dataset == 2 :
-                # Over sampling method
-                action_counter = np.zeros(self.vocab_size + 1)
-                data_list = []
-                for i in range(self.vocab_size + 1):
-                    data_list.append([])
-                for data in dataset:
-                    o, a = data
-                    action_counter[a] += 1
-                    data_list[a].append(data)
-
-                min_nb = int(min(action_counter[action_counter > 0]))
-                max_nb = int(max(action_counter[action_counter > 0]))
-                fin_data = []
-                for i in range(len(action_counter)):
-                    if action_counter[i] < max_nb and action_counter[i] > 0:
-                        for j in range(int(max_nb/min_nb)) :
-                            fin_data = fin_data + data_list[i]
-                ic(len(fin_data))
-                ic(len(fin_data)/max_nb)
-                ic(len(action_counter))
-                dataset = SupervisionDataset(fin_data, augment=self.augmentation, typ=self.typ)
-
-            # If not balanced, weight the cross entropy respectivly to min_size/size
-            else :
-                action_counter = np.zeros(self.vocab_size + 1)
-                for data in dataset:
-                    o, a = data
-                    action_counter[a] += 1
-                min_nb = int(min(action_counter[action_counter > 0]))
-                max_nb = int(max(action_counter[action_counter > 0]))
-                action_counter[action_counter == 0] = min_nb
-                ic(min_nb/max_nb)
-                ic(max_nb/action_counter)
-                weights = max_nb/action_counter
-                if self.balanced_dataset == 3 :
-                    weights[0] = 0.5
-                elif self.balanced_dataset == 4 :
-                    weights[0] = 0.9
-                self.criterion.weight = torch.from_numpy(max_nb/action_counter).to(self.device)
-                dataset = SupervisionDataset(dataset, augment=self.augmentation, typ=self.typ)
-
             # Divide the dataset into a validation and a training set.
             dataset_size = len(dataset)
             indices = list(range(dataset_size))
             split = int(np.floor(0.1 * dataset_size))
-            # if self.shuffle and False :
-            #     np.random.shuffle(indices)
             train_indices, val_indices = indices[split:], indices[:split]
             if self.shuffle :
                 np.random.shuffle(train_indices)
                 np.random.shuffle(val_indices)
+            action_counter = np.bincount(labels[train_indices], minlength=self.vocab_size + 1).astype(float)
+
+            # Each process trains on its part of the training indices
+            rank_indices = self.shard_indices(train_indices)
+
+            if self.balanced_dataset in [1, 2] :
+                if self.bucketing :
+                    print(' /!\ The balanced batches are padded but not grouped by instance size')
+                # Under sampling (1) or over sampling (2) as sampling weights of the training samples
+                nb_actions = np.sum(action_counter > 0)
+                sample_weights = np.zeros(dataset_size)
+                sample_weights[rank_indices] = self.class_rates(action_counter)[labels[rank_indices]]
+                if self.balanced_dataset == 1 :
+                    train_sampler = WeightedRandomSampler(torch.from_numpy(sample_weights),
+                                                          num_samples=int(min(action_counter[action_counter > 0]) * nb_actions) // self.world_size,
+                                                          replacement=False)
+                else :
+                    train_sampler = WeightedRandomSampler(torch.from_numpy(sample_weights),
+                                                          num_samples=int(max(action_counter) * nb_actions) // self.world_size,
+                                                          replacement=True)
+            # If not balanced, weight the cross entropy respectivly to min_size/size
+            else :
+                self.criterion.weight = torch.from_numpy(self.loss_weights(action_counter)).to(self.device, self.dtype)
+                train_sampler = SubsetRandomSampler(rank_indices)
 
             # Creating PT data samplers and loaders:
-            train_sampler = SubsetRandomSampler(train_indices)
             valid_sampler = SubsetRandomSampler(val_indices)
 
-            supervision_data = torch.utils.data.DataLoader(dataset, batch_size=self.batch_size,
-                                                       sampler=train_sampler)
-            validation_data = torch.utils.data.DataLoader(dataset, batch_size=self.batch_size,
-                                                        sampler=valid_sampler)
+            if self.bucketing and self.balanced_dataset not in [1, 2] :
+                supervision_data = DataLoader(dataset, **self.loader_kwargs(batch_sampler=self.bucket_sampler(train_indices, distributed=True)))
+                validation_data = DataLoader(dataset, **self.loader_kwargs(batch_sampler=self.bucket_sampler(val_indices)))
+                return supervision_data, validation_data
+
+            supervision_data = torch.utils.data.DataLoader(dataset, sampler=train_sampler, **self.loader_kwargs())
+            validation_data = torch.utils.data.DataLoader(dataset, sampler=valid_sampler, **self.loader_kwargs())
         elif self.pretrain :
             dataset_size = len(dataset)
             indices = list(range(dataset_size))
@@ -1115,34 +1587,83 @@ class SupervisedTrainer():
             if self.shuffle :
                 np.random.shuffle(train_indices)
                 np.random.shuffle(val_indices)
-            train_sampler = SubsetRandomSampler(train_indices)
+            train_sampler = SubsetRandomSampler(self.shard_indices(train_indices))
             valid_sampler = SubsetRandomSampler(val_indices)
-            supervision_data = torch.utils.data.DataLoader(dataset, batch_size=self.batch_size,
-                                                       sampler=train_sampler)
-            validation_data = torch.utils.data.DataLoader(dataset, batch_size=self.batch_size,
-                                                        sampler=valid_sampler)
+            supervision_data = torch.utils.data.DataLoader(dataset, sampler=train_sampler, **self.loader_kwargs())
+            validation_data = torch.utils.data.DataLoader(dataset, sampler=valid_sampler, **self.loader_kwargs())
         else :
-            for data in dataset:
-                o, a = data
-                action_counter[a] += 1
-            self.criterion.weight = torch.from_numpy(action_counter).to(self.device)
-            supervision_data = DataLoader(dataset, batch_size=self.batch_size, shuffle=self.shuffle)
-            validation_data = DataLoader([], batch_size=self.batch_size, shuffle=self.shuffle)
+            action_counter = np.bincount(labels, minlength=self.vocab_size + 1).astype(float)
+            self.criterion.weight = torch.from_numpy(action_counter).to(self.device, self.dtype)
+            if self.bucketing :
+                supervision_data = DataLoader(dataset, **self.loader_kwargs(batch_sampler=self.bucket_sampler(range(len(dataset)), distributed=True)))
+            elif self.distributed :
+                train_sampler = DistributedSampler(dataset, num_replicas=self.world_size, rank=self.rank,
+                                                   shuffle=self.shuffle, seed=self.seed)
+                supervision_data = DataLoader(dataset, sampler=train_sampler, **self.loader_kwargs())
+            else :
+                supervision_data = DataLoader(dataset, shuffle=self.shuffle, **self.loader_kwargs())
+            validation_data = DataLoader([], batch_size=self.batch_size)
 
         return supervision_data,  validation_data
 
 
 
 
+    def evaluation_due(self, epoch):
+        return (epoch + 1) % self.eval_every == 0 or epoch + 1 == self.epochs
+
+    def start_evaluation_worker(self):
+        """ Starts the evaluation process of the run (once, the first checkpoint being written) """
+        if self.rank != 0 or getattr(self, 'evaluation_process', None) is not None:
+            return
+        self.checkpointer.wait()
+        task_id = self.sacred.id if self.sacred else None
+        self.evaluation_process, self.evaluation_stop = start_evaluation_process(self.flags, self.path_name, task_id)
+        print(' - Evaluation process started, pid:', self.evaluation_process.pid)
+
+    def stop_evaluation_worker(self):
+        """ Lets the evaluation process finish the last checkpoints """
+        if getattr(self, 'evaluation_process', None) is None:
+            return
+        print(' - Waiting for the evaluation process')
+        self.evaluation_stop.set()
+        self.evaluation_process.join()
+        self.evaluation_process = None
+
+    def evaluate(self, validation_data=None):
+        """ Evaluation suite of the current epoch (validation data for the offline evaluations) """
+        if self.supervision_function == 'rf':
+            if self.pretrain:
+                self.offline_evaluation(validation_data, saving=True)
+            else :
+                self.offline_evaluation(validation_data, saving=True)
+                self.online_evaluation(full_test=True, supervision=False, saving=False)
+                self.dataset_evaluation()
+        else :
+            if self.pretrain:
+                self.offline_evaluation(validation_data, saving=True)
+            elif self.rl <= self.current_epoch:
+                self.dataset_evaluation()
+            else :
+                self.online_evaluation()
+                if self.dataset:
+                    self.online_evaluation(full_test=False)
+
     def run(self):
         """
             Just the main training loop
             (Eventually generate data)
             Train and evaluate
         """
+        if self.evaluation_dir :
+            return EvaluationWorker(self, poll=self.eval_poll).run()
+
         round_counter = 1e6 // (self.train_rounds -1)
+        start_epoch = 0
+        if self.resume :
+            start_epoch, round_counter = self.resume_checkpoint()
         print('\t ** Learning START ! **')
-        for epoch in range(self.epochs):
+        for epoch in range(start_epoch, self.epochs):
             self.current_epoch = epoch
 
             # Train
@@ -1150,36 +1671,46 @@ class SupervisedTrainer():
                 self.supervision_function = ''
                 self.rl_train()
             else :
-                # Every million visits update the dataset
-                if round_counter * self.batch_size * self.train_rounds > self.data_size // 20:
-                    if 'supervision_data' in locals():
-                        del supervision_data
-                        del validation_data
-                    supervision_data, validation_data = self.updating_data()
-                    round_counter = 0
+                if self.streaming :
+                    # The stream is built once, each epoch moves its window of shards
+                    if 'supervision_data' not in locals():
+                        supervision_data, validation_data = self.updating_stream_data()
+                    self.train_dataset.set_epoch(epoch)
+                else :
+                    if self.resume_state is not None and 'supervision_data' not in locals():
+                        # Resumed training: data part of the interrupted one, with the same shuffles
+                        supervision_data, validation_data = self.updating_data(data_state=self.resume_state['data_state'])
+                        set_rng_state(self.resume_state['rng'])
+                    # Every million visits update the dataset
+                    if round_counter * self.batch_size * self.train_rounds > self.data_size // 20:
+                        if 'supervision_data' in locals():
+                            del supervision_data
+                            del validation_data
+                        supervision_data, validation_data = self.updating_data()
+                        round_counter = 0
+                if isinstance(supervision_data.sampler, DistributedSampler):
+                    supervision_data.sampler.set_epoch(epoch)
+                if isinstance(supervision_data.batch_sampler, BucketBatchSampler):
+                    supervision_data.batch_sampler.set_epoch(epoch)
+                self.round_counter = round_counter
                 self.train(supervision_data)
 
-            # Evaluate
-            if self.supervision_function == 'rf':
-                if self.pretrain:
-                    self.offline_evaluation(validation_data, saving=True)
-                else :
-                    self.offline_evaluation(validation_data, saving=True)
-                    self.online_evaluation(full_test=True, supervision=False, saving=False)
-                    self.dataset_evaluation()
-            else :
-                if self.pretrain:
-                    self.offline_evaluation(validation_data, saving=True)
-                elif self.rl <= epoch:
-                    self.dataset_evaluation()
-                else :
-                    self.online_evaluation()
-                    if self.dataset:
-                        self.online_evaluation(full_test=False)
+            # Evaluate (main process only, the others wait for it)
+            background = self.eval_process and self.rl > epoch
+            if self.rank == 0 and not background and self.evaluation_due(epoch):
+                self.evaluate(locals().get('validation_data'))
+            self.barrier()
 
             round_counter +=1
+            self.round_counter = round_counter
+            if self.rl > epoch:
+                self.save_checkpoint(epoch + 1)
+                if background :
+                    self.start_evaluation_worker()
 
+        self.checkpointer.wait()
         print('\t ** Learning DONE ! **')
+        self.stop_evaluation_worker()
 
 
 
@@ -1203,7 +1734,8 @@ class SupervisedTrainer():
 
         self.model.eval()
         for i, data in enumerate(dataloader):
-            observation, supervised_action = data
+            observation, supervised_action = data[:2]
+            lengths = data[2] if len(data) > 2 else None
 
             if self.emb_typ >= 40 :
                 world, targets, drivers, positions, time_constraints, prior_kwlg = observation
@@ -1220,10 +1752,13 @@ class SupervisedTrainer():
             else :
                 target_tensor = world[1].unsqueeze(-1).type(torch.LongTensor).to(self.device)
 
-            model_action = self.model(info_block,
-                                      target_tensor,
-                                      positions=positions,
-                                      times=time_constraints)
+            with autocast(self.precision, self.device):
+                model_action = self.policy(info_block,
+                                           target_tensor,
+                                           positions=positions,
+                                           times=time_constraints,
+                                           **self.padding_kwargs(lengths))
+            model_action = self.autocast_output(model_action)
 
 
             # model_action = model_action[:,0]
@@ -1289,7 +1824,7 @@ class SupervisedTrainer():
             os.makedirs(self.path_name + '/models/', exist_ok=True)
             print('\t New Best Accuracy Model <3')
             print('\tSaving as:', model_name)
-            torch.save(self.model, model_name)
+            self.checkpointer.save_module(self.model, model_name)
 
             dir = self.path_name + '/example/'
             os.makedirs(dir, exist_ok=True)
@@ -1322,46 +1857,128 @@ class SupervisedTrainer():
             # self.sacred.get_logger().report_scalar(title=eval_name,
             #     series='Step Reward', value=total_reward/total, iteration=self.current_epoch)
 
-    def dataset_evaluation(self):
-        print('\t** ON DATASET :', self.inst_name, '**')
-        eval_name = 'Dataset Test'
+    def inference_policy(self):
+        """ Policy of one evaluation episode: per episode encoder cache (--inference_cache) of the plain model """
+        if self.onnx_policy is not None:
+            # Graphs of the weights being evaluated
+            if self.onnx_epoch != self.current_epoch:
+                self.onnx_policy.reset()
+                self.onnx_epoch = self.current_epoch
+            return self.onnx_policy
+        if self.inference_cache and self.policy is self.model:
+            return InferenceSession(self.model)
+        return self.policy
+
+    def choose_actions(self, logits, envs):
+        """ Greedy actions of [B, V] logits, one per env. With --masked_decoding, the actions
+            out of env.action_mask() are masked first (masking_stats counts the changed decisions).
+        """
+        chosen_actions = logits.argmax(-1)
+        if self.masked_decoding :
+            masked_actions = mask_logits(logits, [env.action_mask() for env in envs]).argmax(-1)
+            self.masking_stats['decisions'] += len(envs)
+            self.masking_stats['changed'] += (masked_actions != chosen_actions).sum().item()
+            chosen_actions = masked_actions
+        return chosen_actions.cpu().tolist()
+
+    def masking_report(self, eval_name):
+        """ Part of the decisions of the evaluation changed by the feasibility mask """
+        if not self.masked_decoding or not self.masking_stats['decisions'] :
+            return
+        changed = 100 * self.masking_stats['changed'] / max(self.masking_stats['decisions'], 1)
+        print('\t-->' + eval_name + 'Masked decisions changed: ', changed, '% of', self.masking_stats['decisions'])
+        if self.sacred :
+            self.sacred.get_logger().report_scalar(title=eval_name,
+                series='Masked decisions changed %', value=changed, iteration=self.current_epoch)
+
+    def greedy_episode(self, env, policy):
+        """ Greedy episode of a policy: (last info, total reward, mean decision latency in ms) """
         done = False
-        observation = self.dataset_env.reset()
+        observation = env.reset()
         total_reward = 0
+        latency, decisions = 0, 0
         while not done:
             if self.emb_typ >= 40 :
-                world, targets, drivers, positions, time_contraints, prior_kwlg = observation
-                time_contraints = [torch.tensor([time_contraints[0]], dtype=torch.float64),
-                             [torch.tensor([time], dtype=torch.float64) for time in time_contraints[1]]]
+                world, targets, drivers, positions, time_contraints, prior_kwlg = collate_observations([observation], dtype=self.dtype)
             else :
-                world, targets, drivers, positions, time_contraints = observation
-                time_contraints = [torch.tensor([time_contraints[0]], dtype=torch.float64),
-                             [torch.tensor([time], dtype=torch.float64) for time in time_contraints[1]],
-                             [torch.tensor([time], dtype=torch.float64) for time in time_contraints[2]]]
-
-            positions = [torch.tensor([positions[0]], dtype=torch.float64),
-                         [torch.tensor([position], dtype=torch.float64) for position in positions[1]],
-                         [torch.tensor([position], dtype=torch.float64) for position in positions[2]]]
-
-            w_t = [torch.tensor([winfo],  dtype=torch.float64) for winfo in world]
-            t_t = [[torch.tensor([tinfo], dtype=torch.float64 ) for tinfo in target] for target in targets]
-            d_t = [[torch.tensor([dinfo],  dtype=torch.float64) for dinfo in driver] for driver in drivers]
-            info_block = [w_t, t_t, d_t]
+                world, targets, drivers, positions, time_contraints = collate_observations([observation], dtype=self.dtype)
+            info_block = [world, targets, drivers]
 
-            target_tensor = torch.tensor([world[1]]).unsqueeze(-1).type(torch.LongTensor).to(self.device)
+            target_tensor = world[1].unsqueeze(-1).type(torch.LongTensor).to(self.device)
 
-            model_action = self.model(info_block,
+            start = time.perf_counter()
+            with torch.no_grad(), autocast(self.precision, self.device):
+                model_action = policy(info_block,
                                       target_tensor,
                                       positions=positions,
                                       times=time_contraints)
+            model_action = self.autocast_output(model_action)
 
             if self.typ >25:
-                chosen_action = model_action.argmax(-1).cpu().item()
+                chosen_action = self.choose_actions(model_action, [env])[0]
             else :
-                chosen_action = model_action[:, 0].argmax(-1).cpu().item()
+                chosen_action = self.choose_actions(model_action[:, 0], [env])[0]
+            latency += time.perf_counter() - start
+            decisions += 1
 
-            observation, reward, done, info = self.dataset_env.step(chosen_action)
+            with self.profiler.phase('Env step'):
+                observation, reward, done, info = env.step(chosen_action)
+            self.profiler.count('Env steps')
             total_reward += reward
+        return info, total_reward, 1000 * latency / max(decisions, 1)
+
+    def decoded_episode(self, env, policy):
+        """ Episode decoded by sampling or beam search (--decoding):
+            (last info, total reward, decoding time per decision in ms)
+        """
+        decoder = TrajectoryDecoder(policy, self.typ,
+                                    decoding=self.decoding,
+                                    width=self.decoding_width,
+                                    temperature=self.decoding_temperature,
+                                    budget=self.decoding_budget,
+                                    masked=bool(self.masked_decoding),
+                                    batch_size=self.eval_batch_size,
+                                    workers=self.decoding_workers,
+                                    model=self.model,
+                                    dtype=self.dtype,
+                                    device=self.device,
+                                    precision=self.precision)
+        env.reset()
+        info, total_reward, steps = decoder(env)
+        print('/- Decoding ' + self.decoding + ':', decoder.stats['trajectories'], 'trajectories in {t:.2f}s'.format(t=decoder.stats['time']))
+        return info, total_reward, 1000 * decoder.stats['time'] / max(steps, 1)
+
+    def teacher_evaluation(self, info, latency):
+        """ Latency and GAP of the distilled model against its teacher on the dataset instance """
+        if self.teacher_stats is None:
+            # The teacher does not change: evaluated once
+            teacher_policy = InferenceSession(self.teacher_model) if self.inference_cache else self.teacher_model
+            teacher_info, _, teacher_latency = self.greedy_episode(self.dataset_env, teacher_policy)
+            self.teacher_stats = {'GAP': teacher_info['GAP'] if teacher_info['fit_solution'] else 300,
+                                  'latency': teacher_latency}
+        gap = info['GAP'] if info['fit_solution'] else 300
+        print('/- Distillation: latency {s:.2f} ms / teacher {t:.2f} ms (x{r:.2f}), GAP {g:.2f} / teacher {tg:.2f}'.format(
+            s=latency, t=self.teacher_stats['latency'], r=self.teacher_stats['latency'] / max(latency, 1e-9),
+            g=gap, tg=self.teacher_stats['GAP']))
+        if self.sacred :
+            for series, value in [('Latency (ms)', latency), ('Teacher latency (ms)', self.teacher_stats['latency']),
+                                  ('GAP', gap), ('Teacher GAP', self.teacher_stats['GAP'])]:
+                self.sacred.get_logger().report_scalar(title='Distillation',
+                    series=series, value=value, iteration=self.current_epoch)
+
+    def dataset_evaluation(self):
+        print('\t** ON DATASET :', self.inst_name, '**')
+        eval_name = 'Dataset Test'
+        self.profiler.start()
+        self.masking_stats = {'decisions': 0, 'changed': 0}
+        policy = self.inference_policy()
+        if self.decoding != 'greedy' :
+            info, total_reward, latency = self.decoded_episode(self.dataset_env, policy)
+        else :
+            info, total_reward, latency = self.greedy_episode(self.dataset_env, policy)
+
+        self.profiler.report(eval_name + ' speed', self.current_epoch)
+        self.masking_report(eval_name)
 
         if info['fit_solution'] and info['GAP'] < self.best_eval_metric[2] :
             print('/-- NEW BEST GAP SOLUTION --\\')
@@ -1373,7 +1990,7 @@ class SupervisedTrainer():
                 model_name = self.path_name + '/models/GAP_model_' + str(self.current_epoch) + '.pt'
             print('\tSaving as:', model_name)
             os.makedirs(self.path_name + '/models/', exist_ok=True)
-            torch.save(self.model, model_name)
+            self.checkpointer.save_module(self.model, model_name)
 
         print('/- Fit solution:', info['fit_solution'])
         print('/- with ',info['delivered'], 'deliveries')
@@ -1396,136 +2013,132 @@ class SupervisedTrainer():
             self.sacred.get_logger().report_scalar(title=eval_name,
                 series='Total Reward', value=total_reward, iteration=self.current_epoch)
 
+        if self.teacher_model is not None :
+            self.teacher_evaluation(info, latency)
+
+
+    def evaluation_envs(self, nb_envs):
+        """ Environments of online evaluation episodes. With the rf supervision, each one gets its
+            own generated instance file (solved after the episodes, see online_evaluation).
+        """
+        if self.supervision_function != 'rf' :
+            return [copy.deepcopy(self.eval_env) for _ in range(nb_envs)], []
+        out_dir = self.rootdir + '/dialRL/strategies/data/DARP_cordeau/'
+        file_gen = DataFileGenerator(env=self.eval_env, out_dir=out_dir, data_size=1)
+        envs, instance_files = [], []
+        for k in range(nb_envs):
+            instance_file_name = file_gen.generate_file(tmp_name='eval_instance', seed=np.random.randint(1, 2**31 - 1))[0]
+            episode_file_name = out_dir + '/eval_instance_' + str(k) + '.txt'
+            shutil.copyfile(instance_file_name, episode_file_name)
+            reward_function = globals()[self.reward_function]()
+            envs.append(DarSeqEnv(size=self.image_size, target_population=self.nb_target, driver_population=self.nb_drivers,
+                                  rep_type=self.rep_type, reward_function=reward_function, test_env=True, dataset=episode_file_name))
+            instance_files.append(episode_file_name)
+        return envs, instance_files
+
+    def rf_lower_bound(self, episode_file_name):
+        """ Lower bound of the rf solver on an instance file, solved as eval_instance (run_rf_algo('0')) """
+        shutil.copyfile(episode_file_name, self.rootdir + '/dialRL/strategies/data/DARP_cordeau/eval_instance.txt')
+        solution_file = ''
+        while not solution_file :
+            if not self.verbose:
+                sys.stdout = open('test_file.out', 'w')
+            try :
+                with self.profiler.phase('Solver'):
+                    solution_file, supervision_perf, l_bound = run_rf_algo('0')
+                if not self.verbose :
+                    sys.stdout = sys.__stdout__
+                if l_bound is None :
+                    print('Wrong solution ?')
+                    solution_file = ''
+            except:
+                if not self.verbose :
+                    sys.stdout = sys.__stdout__
+                print('ERROR in RUN RF ALGO. PASSING THROUGH')
+        return l_bound
 
     def online_evaluation(self, full_test=True, supervision=True, saving=True):
         """
             Online evaluation of the model according to the supervision method.
             As it is online, we  can maximise the testing informtion about the model.
+            The episodes run in lockstep, by --eval_batch_size: one batched forward per step
+            over the episodes that are not done.
         """
-        correct = total = running_loss = total_reward = 0
+        stats = {'correct': 0, 'total': 0, 'loss': 0}
+        total_reward = 0
         delivered = 0
         gap = 0
         fit_sol = 0
-        self.supervision.env = self.eval_env
         if full_test :
             eval_name = 'Test stats'
         else :
             eval_name = 'Supervised Test stats'
 
         self.model.eval()
-        for eval_step in range(self.eval_episodes):
-
-            # Generate solution and evironement instance.
-            if self.supervision_function == 'rf' :
-                file_gen = DataFileGenerator(env=self.eval_env, out_dir=self.rootdir + '/dialRL/strategies/data/DARP_cordeau/', data_size=1)
-                instance_file_name = file_gen.generate_file(tmp_name='eval_instance')[0]
-                reward_function = globals()[self.reward_function]()
-                self.eval_env = DarSeqEnv(size=self.image_size, target_population=self.nb_target, driver_population=self.nb_drivers,
-                                          rep_type=self.rep_type, reward_function=reward_function, test_env=True, dataset=instance_file_name)
-
-            done = False
-            observation = self.eval_env.reset()
-
-            if self.example_format == 'svg':
-                to_save = [self.eval_env.get_svg_representation() if full_test else 0]
-            else :
-                to_save = [self.eval_env.get_image_representation() if full_test else 0]
-            save_rewards = [0]
-            last_time = 0
-
-            while not done:
+        self.profiler.start()
+        self.masking_stats = {'decisions': 0, 'changed': 0}
+        for first_episode in range(0, self.eval_episodes, self.eval_batch_size):
+            # Generate the evironement instances.
+            envs, instance_files = self.evaluation_envs(min(self.eval_batch_size, self.eval_episodes - first_episode))
+            policy = self.inference_policy()
+
+            def decide(indices, observations):
                 if self.emb_typ >= 40 :
-                    world, targets, drivers, positions, time_contraints, prior_kwlg = observation
-                    time_contraints = [torch.tensor([time_contraints[0]], dtype=torch.float64),
-                                 [torch.tensor([time], dtype=torch.float64) for time in time_contraints[1]]]
+                    world, targets, drivers, positions, time_contraints, prior_kwlg = collate_observations(observations, dtype=self.dtype)
                 else :
-                    world, targets, drivers, positions, time_contraints = observation
-                    time_contraints = [torch.tensor([time_contraints[0]], dtype=torch.float64),
-                                 [torch.tensor([time], dtype=torch.float64) for time in time_contraints[1]],
-                                 [torch.tensor([time], dtype=torch.float64) for time in time_contraints[2]]]
-
-                positions = [torch.tensor([positions[0]], dtype=torch.float64),
-                             [torch.tensor([position], dtype=torch.float64) for position in positions[1]],
-                             [torch.tensor([position], dtype=torch.float64) for position in positions[2]]]
-
-                w_t = [torch.tensor([winfo],  dtype=torch.float64) for winfo in world]
-                t_t = [[torch.tensor([tinfo], dtype=torch.float64 ) for tinfo in target] for target in targets]
-                d_t = [[torch.tensor([dinfo],  dtype=torch.float64) for dinfo in driver] for driver in drivers]
-                info_block = [w_t, t_t, d_t]
+                    world, targets, drivers, positions, time_contraints = collate_observations(observations, dtype=self.dtype)
+                info_block = [world, targets, drivers]
 
                 if self.typ in [17, 18, 19]:
-                    target_tensor = w_t
+                    target_tensor = world
                 else :
-                    target_tensor = torch.tensor([world[1]]).unsqueeze(-1).type(torch.LongTensor).to(self.device)
+                    target_tensor = world[1].unsqueeze(-1).type(torch.LongTensor).to(self.device)
 
-                model_action = self.model(info_block,
+                with torch.no_grad(), autocast(self.precision, self.device):
+                    model_action = policy(info_block,
                                           target_tensor,
                                           positions=positions,
                                           times=time_contraints)
-
-                if supervision :
-                    supervised_action = self.supervision.action_choice()
-                    supervised_action = torch.tensor([supervised_action]).type(torch.LongTensor).to(self.device)
+                model_action = self.autocast_output(model_action)
 
                 if self.typ >25:
-                    chosen_action = model_action.argmax(-1).cpu().item()
+                    logits = model_action
                 else :
-                    chosen_action = model_action[:, 0].argmax(-1).cpu().item()
-
-                if full_test :
-                    observation, reward, done, info = self.eval_env.step(chosen_action)
-                elif supervision :
-                    observation, reward, done, info = self.eval_env.step(supervised_action)
-
-                # self.eval_env.render()
-                if supervision :
-                    loss = self.criterion(model_action[:,0], supervised_action)
-                    running_loss += loss.item()
-                    correct += (chosen_action == supervised_action).cpu().numpy()[0]
+                    logits = model_action[:, 0]
+                chosen_actions = self.choose_actions(logits, [envs[k] for k in indices])
+                stats['total'] += len(indices)
+
+                if not supervision :
+                    return chosen_actions
+                supervised_actions = []
+                for k in indices:
+                    self.supervision.env = envs[k]
+                    supervised_actions.append(self.supervision.action_choice())
+                supervised_action = torch.tensor(supervised_actions).type(torch.LongTensor).to(self.device)
+                stats['loss'] += self.criterion(logits, supervised_action).item() * len(indices)
+                stats['correct'] += sum(chosen == supervised for chosen, supervised in zip(chosen_actions, supervised_actions))
+                return chosen_actions if full_test else supervised_actions
+
+            seeds = np.random.randint(1, 2**31 - 1, size=len(envs))
+            infos, rewards, steps = lockstep_episodes(envs, decide, seeds=seeds, profiler=self.profiler)
+            # Envs are done
+
+            for k, info in enumerate(infos):
+                if self.supervision_function == 'rf' :
+                    if info['fit_solution']:
+                        # Get a solution from the supervision
+                        gap += envs[k].get_GAP(best_cost=self.rf_lower_bound(instance_files[k]))
                 else :
-                    correct += 0
-                    running_loss += 0
-                    loss = 0
-
-                total_reward += reward
-                total += 1
+                    # If not rf supervision
+                    gap += info['GAP']
 
-                if self.eval_env.time_step > last_time and full_test:
-                    last_time = self.eval_env.time_step
-                    if self.example_format == 'svg':
-                        to_save.append(self.eval_env.get_svg_representation())
-                    else :
-                        to_save.append(self.eval_env.get_image_representation())
-                    save_rewards.append(reward)
-            # Env is done
-
-            if self.supervision_function == 'rf' :
-                if info['fit_solution']:
-                    # Get a solution from the supervision
-                    solution_file = ''
-                    while not solution_file :
-                        if not self.verbose:
-                            sys.stdout = open('test_file.out', 'w')
-                        try :
-                            rf_time = time.time()
-                            solution_file, supervision_perf, l_bound = run_rf_algo('0')
-                            rf_time = time.time() - rf_time
-                            if not self.verbose :
-                                sys.stdout = sys.__stdout__
-                            if l_bound is None :
-                                print('Wrong solution ?')
-                                solution_file = ''
-                        except:
-                            if not self.verbose :
-                                sys.stdout = sys.__stdout__
-                            print('ERROR in RUN RF ALGO. PASSING THROUGH')
-                    gap += self.eval_env.get_GAP(best_cost=l_bound)
-            else :
-                # If not rf supervision
-                gap += info['GAP']
+                fit_sol += info['fit_solution'] #self.eval_env.is_fit_solution()
+                delivered += info['delivered']
+                total_reward += rewards[k]
+        correct, total, running_loss = stats['correct'], stats['total'], stats['loss']
 
-            fit_sol += info['fit_solution'] #self.eval_env.is_fit_solution()
-            delivered += info['delivered']
+        self.profiler.report(eval_name + ' speed', self.current_epoch)
+        self.masking_report(eval_name)
 
         # To spare time, only the last example is saved
         eval_acc = 100 * correct/total
@@ -1547,7 +2160,7 @@ class SupervisedTrainer():
             os.makedirs(self.path_name + '/models/', exist_ok=True)
             print('\t New Best online GAP Model <3')
             print('\tSaving as:', model_name)
-            torch.save(self.model, model_name)
+            self.checkpointer.save_module(self.model, model_name)
 
             # Saving an example
             # if self.example_format == 'svg':
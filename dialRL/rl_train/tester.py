@@ -6,6 +6,8 @@ import time
 import json
 import numpy as np
 import math
+import copy
+import shutil
 
 
 # from stable_baselines.common.policies import MlpPolicy, MlpLstmPolicy
@@ -40,11 +42,13 @@ from dialRL.strategies.external.darp_rf.run_rf_algo import run_rf_algo
 from dialRL.models import *
 from dialRL.utils.reward_functions import *
 from dialRL.environments import DarEnv, DarPixelEnv, DarSeqEnv
-from dialRL.utils import get_device, trans25_coord2int, objdict
+from dialRL.utils import get_device, torch_load, autocast, trans25_coord2int, objdict, collate_observations, mask_logits
 from dialRL.dataset import DataFileGenerator
 # from dialRL.rl_train.callback import MonitorCallback
 # from dialRL.strategies import NNStrategy, NNStrategyV2
 from dialRL.dataset import RFGenerator
+from dialRL.rl_train.lockstep import lockstep_episodes, add_episodes
+from dialRL.rl_train.decoding import TrajectoryDecoder, DECODINGS
 
 torch.autograd.set_detect_anomaly(True)
 # os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'  # FATAL
@@ -84,6 +88,8 @@ class Tester():
         self.sacred = sacred
 
         self.device = get_device()
+        # float64 by default, bf16 runs float32 weights under autocast
+        self.dtype = torch.float64 if self.precision == 'float64' else torch.float32
 
         #### RL elements
         self.encoder_bn = False
@@ -245,7 +251,7 @@ class Tester():
                                                  src_pad_idx=self.image_size,
                                                  trg_pad_idx=self.image_size,
                                                  dropout=self.dropout,
-                                                 device=self.device).to(self.device).double()
+                                                 device=self.device).to(self.device, self.dtype)
         elif self.model=='Trans2':
             self.model = globals()[self.model](src_vocab_size=1000,
                                                  trg_vocab_size=self.nb_target + 1,
@@ -254,7 +260,7 @@ class Tester():
                                                  trg_pad_idx=self.image_size,
                                                  dropout=self.dropout,
                                                  extremas=self.gen_env.extremas,
-                                                 device=self.device).to(self.device).double()
+                                                 device=self.device).to(self.device, self.dtype)
         elif self.model=='Trans25':
             self.model = globals()[self.model](src_vocab_size=1000,
                                                  trg_vocab_size=1000,
@@ -263,7 +269,7 @@ class Tester():
                                                  trg_pad_idx=-1,
                                                  dropout=self.dropout,
                                                  extremas=self.gen_env.extremas,
-                                                 device=self.device).to(self.device).double()
+                                                 device=self.device).to(self.device, self.dtype)
         elif self.model=='Trans27':
             self.model = globals()[self.model](src_vocab_size=50000,
                                                  trg_vocab_size=self.nb_target + 1,
@@ -273,7 +279,7 @@ class Tester():
                                                  dropout=self.dropout,
                                                  extremas=self.gen_env.extremas,
                                                  device=self.device,
-                                                 typ=self.typ).to(self.device).double()
+                                                 typ=self.typ).to(self.device, self.dtype)
         elif self.model=='Trans28':
             self.model = globals()[self.model](src_vocab_size=50000,
                                                  trg_vocab_size=self.vocab_size + 1,
@@ -285,7 +291,7 @@ class Tester():
                                                  extremas=self.gen_env.extremas,
                                                  device=self.device,
                                                  typ=self.typ,
-                                                 max_time=int(self.gen_env.time_end)).to(self.device).double()
+                                                 max_time=int(self.gen_env.time_end)).to(self.device, self.dtype)
         elif self.model=='Trans18':
             self.model = globals()[self.model](src_vocab_size=50000,
                                                  trg_vocab_size=self.vocab_size + 1,
@@ -303,7 +309,7 @@ class Tester():
                                                  max_time=int(self.gen_env.time_end),
                                                  classifier_type=self.classifier_type,
                                                  encoder_bn=self.encoder_bn,
-                                                 decoder_bn=self.decoder_bn).to(self.device).double()
+                                                 decoder_bn=self.decoder_bn).to(self.device, self.dtype)
         else :
             raise "self.model in PPOTrainer is not found"
 
@@ -334,10 +340,51 @@ class Tester():
         # Checkpoint
         if self.checkpoint_dir :
             print(' -- -- -- -- -- Loading  -- -- -- -- -- --')
-            self.model = torch.load(self.rootdir + '/data/rl_experiments/' + self.checkpoint_dir)
+            saved = torch_load(self.rootdir + '/data/rl_experiments/' + self.checkpoint_dir)
+            if isinstance(saved, nn.Module) and is_quantized(saved):
+                # Whole quantized model (see --quantize), float32 CPU inference
+                self.model = saved.eval()
+                self.quantize = True
+            elif isinstance(saved, nn.Module):
+                # Whole saved model
+                self.model = saved.to(self.dtype)
+            else :
+                # Training checkpoint (state dicts)
+                self.model.load_state_dict(saved['model'])
             print(' -- The model weights has been loaded ! --')
             print(' -----------------------------------------')
 
+        # Dynamic INT8 quantization of the Linear layers, CPU inference (--quantize)
+        if self.quantize :
+            if not is_quantized(self.model):
+                self.model = quantize_model(self.model)
+                if self.checkpoint_dir :
+                    quantized_name = self.path_name + '/quantized_model.pt'
+                    os.makedirs(self.path_name, exist_ok=True)
+                    save_quantized(self.model, quantized_name)
+                    print(' -- Quantized model saved as:', quantized_name)
+            self.device, self.dtype = 'cpu', torch.float32
+
+        # Attention kernels (--attention_backend einsum, sdpa or sparse), same weights
+        self.attention_backend = set_attention_backend(self.model, self.attention_backend,
+                                                       neighbours=self.neighbours, time_weight=self.time_weight)
+        if self.attention_backend == 'sparse' and (self.compile or self.onnx):
+            print('/!\\ The sparse attention neighbours are computed outside of the model graph, no compiled / ONNX forward')
+            self.compile, self.onnx = '', 0
+
+        if self.onnx and self.quantize :
+            print('/!\\ The dynamic quantized model can not be exported to ONNX, using the quantized torch model')
+            self.onnx = 0
+
+        # Compiled forward passes (--compile jit or compile) or onnxruntime inference (--onnx)
+        if self.onnx :
+            self.policy = OnnxPolicy(self.model, directory=self.path_name + '/onnx/',
+                                     threads=torch.get_num_threads(), device=self.device)
+        elif self.compile :
+            self.policy = CompiledPolicy(self.model, backend=self.compile)
+        else :
+            self.policy = self.model
+
         # number of elements passed throgh the model for each epoch
         self.testing_size = self.batch_size * (10000 // self.batch_size)    #About 10k
         self.training_size = self.batch_size * (100000 // self.batch_size)   #About 100k
@@ -351,6 +398,11 @@ class Tester():
         #                               sacred=self.sacred)
         self.current_epoch = 0
 
+        # Feasibility masked decoding: decisions changed by the mask, per evaluation
+        self.masking_stats = {'decisions': 0, 'changed': 0}
+        if self.decoding not in DECODINGS :
+            raise ValueError('--decoding should be one of ' + str(DECODINGS) + ', not ' + str(self.decoding))
+
         #RF generation info
         self.dir_path = self.rootdir + '/dialRL/strategies/data/DARP_cordeau/'
         self.tmp_name = self.alias + time.strftime("%d-%H-%M")
@@ -423,6 +475,52 @@ class Tester():
             self.online_evaluation(full_test=True, supervision=supervision)
 
 
+    def inference_policy(self):
+        """ Policy of one evaluation episode: per episode encoder cache (--inference_cache) of the plain model """
+        if self.inference_cache and self.policy is self.model:
+            return InferenceSession(self.model)
+        return self.policy
+
+    def choose_actions(self, logits, envs):
+        """ Greedy actions of [B, V] logits, one per env. With --masked_decoding, the actions
+            out of env.action_mask() are masked first (masking_stats counts the changed decisions).
+        """
+        chosen_actions = logits.argmax(-1)
+        if self.masked_decoding :
+            masked_actions = mask_logits(logits, [env.action_mask() for env in envs]).argmax(-1)
+            self.masking_stats['decisions'] += len(envs)
+            self.masking_stats['changed'] += (masked_actions != chosen_actions).sum().item()
+            chosen_actions = masked_actions
+        return chosen_actions.cpu().tolist()
+
+    def masking_report(self, eval_name):
+        """ Part of the decisions of the evaluation changed by the feasibility mask """
+        if not self.masked_decoding or not self.masking_stats['decisions'] :
+            return
+        changed = 100 * self.masking_stats['changed'] / max(self.masking_stats['decisions'], 1)
+        print('\t-->' + eval_name + 'Masked decisions changed:', changed, '% of', self.masking_stats['decisions'])
+        if self.sacred :
+            self.sacred.get_logger().report_scalar(title=eval_name,
+                series='Masked decisions changed %', value=changed, iteration=self.current_epoch)
+
+    def decoded_episode(self, env, policy):
+        """ Episode of a reset env decoded by sampling or beam search (--decoding): (last info, total reward, steps) """
+        decoder = TrajectoryDecoder(policy, self.typ,
+                                    decoding=self.decoding,
+                                    width=self.decoding_width,
+                                    temperature=self.decoding_temperature,
+                                    budget=self.decoding_budget,
+                                    masked=bool(self.masked_decoding),
+                                    batch_size=self.eval_batch_size,
+                                    workers=self.decoding_workers,
+                                    model=self.model,
+                                    dtype=self.dtype,
+                                    device=self.device,
+                                    precision=self.precision)
+        info, total_reward, steps = decoder(env)
+        print('- - Decoding ' + self.decoding + ':', decoder.stats['trajectories'], 'trajectories in', decoder.stats['time'])
+        return info, total_reward, steps
+
     def dataset_evaluation(self):
         self.dataset_instance_folder = self.rootdir + '/data/instances/cordeau2006/'
         inst_name = 'a' + str(self.nb_drivers) + '-' + str(self.nb_target)
@@ -451,32 +549,27 @@ class Tester():
 
         done = False
         observation = self.dataset_env.reset()
+        policy = self.inference_policy()
+        self.masking_stats = {'decisions': 0, 'changed': 0}
+        if self.decoding != 'greedy' :
+            # The best decoded solution is replayed on the env
+            info = self.decoded_episode(self.dataset_env, policy)[0]
+            done = True
         while not done:
-            world, targets, drivers, positions, time_contraints = observation
-            w_t = [torch.tensor([winfo],  dtype=torch.float64) for winfo in world]
-            t_t = [[torch.tensor([tinfo], dtype=torch.float64 ) for tinfo in target] for target in targets]
-            d_t = [[torch.tensor([dinfo],  dtype=torch.float64) for dinfo in driver] for driver in drivers]
-            info_block = [w_t, t_t, d_t]
+            world, targets, drivers, positions, time_contraints = collate_observations([observation], dtype=self.dtype)[:5]
+            info_block = [world, targets, drivers]
+            target_tensor = world[1].unsqueeze(-1).type(torch.LongTensor).to(self.device)
 
-            positions = [torch.tensor([positions[0]], dtype=torch.float64),
-                         [torch.tensor([position], dtype=torch.float64) for position in positions[1]],
-                         [torch.tensor([position], dtype=torch.float64) for position in positions[2]]]
-
-            time_contraints = [torch.tensor([time_contraints[0]], dtype=torch.float64),
-                         [torch.tensor([time], dtype=torch.float64) for time in time_contraints[1]],
-                         [torch.tensor([time], dtype=torch.float64) for time in time_contraints[2]]]
-
-            target_tensor = torch.tensor([world[1]]).unsqueeze(-1).type(torch.LongTensor).to(self.device)
-
-            model_action = self.model(info_block,
+            with autocast(self.precision, self.device):
+                model_action = policy(info_block,
                                       target_tensor,
                                       positions=positions,
                                       times=time_contraints)
 
             if self.typ >25:
-                chosen_action = model_action.argmax(-1).cpu().item()
+                chosen_action = self.choose_actions(model_action, [self.dataset_env])[0]
             else :
-                chosen_action = model_action[:, 0].argmax(-1).cpu().item()
+                chosen_action = self.choose_actions(model_action[:, 0], [self.dataset_env])[0]
 
             observation, reward, done, info = self.dataset_env.step(chosen_action)
             # self.dataset_env.render()
@@ -487,161 +580,169 @@ class Tester():
 
         print('- Optim Total distance:', self.dataset_env.best_cost)
         print('- Model Total distance:', self.dataset_env.total_distance)
+        self.masking_report('Dataset Test')
+
 
+    def rf_instances(self, nb_envs, first_episode):
+        """ Generated instances solved by the rf algorithm, one file per episode:
+            (envs with the solver bound as best cost, solver distances, solver times)
+        """
+        envs, supervision_perfs, rf_times = [], [], []
+        for k in range(first_episode, first_episode + nb_envs):
+            file_gen = DataFileGenerator(env=self.gen_env, out_dir=self.dir_path, data_size=1)
+            instance_file_name = file_gen.generate_file(tmp_name=self.tmp_name, seed=np.random.randint(1, 2**31 - 1))[0]
+
+            print('\t ** Solution N° ', k,' searching with RF Started for: ', instance_file_name)
+            solution_file = ''
+            while not solution_file :
+                if not self.verbose:
+                    sys.stdout = open('test_file.out', 'w')
+                rf_time = time.time()
+                solution_file, supervision_perf, l_bound = run_rf_algo('0')
+                rf_time = time.time() - rf_time
+                if not self.verbose :
+                    sys.stdout = sys.__stdout__
+                if l_bound is None :
+                    print('Wrong solution ?')
+                    solution_file = ''
+
+            # The next instance is generated under the same name
+            episode_file_name = self.dir_path + '/' + self.tmp_name + '_' + str(k) + '.txt'
+            shutil.copyfile(instance_file_name, episode_file_name)
+            reward_function = globals()[self.reward_function]()
+            env = DarSeqEnv(size=self.image_size, target_population=self.nb_target, driver_population=self.nb_drivers,
+                            rep_type=self.rep_type, reward_function=reward_function, test_env=True, dataset=episode_file_name)
+            env.best_cost = l_bound
+            envs.append(env)
+            supervision_perfs.append(supervision_perf)
+            rf_times.append(rf_time)
+        return envs, supervision_perfs, rf_times
 
     def online_evaluation(self, full_test=True, supervision=False, saving=True, rf=False):
         """
             Online evaluation of the model according to the supervision method.
             As it is online, we  can maximise the testing informtion about the model.
+            The episodes run in lockstep, by --eval_batch_size: one batched forward per step
+            over the episodes that are not done.
         """
         print(' ** Eval started ** ')
-        correct = total = running_loss = total_reward = 0
-        delivered = 0
-        gap = 0
-        fit_sol = 0
-        i=0
-        self.supervision.env = self.eval_env
+        stats = {'correct': 0, 'total': 0, 'loss': 0}
+        totals = None
         if full_test :
             eval_name = 'Test stats'
         else :
             eval_name = 'Supervised Test stats'
 
         self.model.eval()
-        for eval_step in range(self.eval_episodes):
-            done = False
-
+        self.masking_stats = {'decisions': 0, 'changed': 0}
+        for first_episode in range(0, self.eval_episodes, self.eval_batch_size):
+            nb_envs = min(self.eval_batch_size, self.eval_episodes - first_episode)
             if rf :
-                # Generate solution and evironement instance.
-                file_gen = DataFileGenerator(env=self.gen_env, out_dir=self.dir_path, data_size=1)
-                instance_file_name = file_gen.generate_file(tmp_name=self.tmp_name)[0]
-                solution_file = ''
-
-                print('\t ** Solution N° ', i,' searching with RF Started for: ', instance_file_name)
-                solution_file = ''
-                while not solution_file :
-                    if not self.verbose:
-                        sys.stdout = open('test_file.out', 'w')
-                    # try :
-                    rf_time = time.time()
-                    solution_file, supervision_perf, l_bound = run_rf_algo('0')
-                    rf_time = time.time() - rf_time
-                    if not self.verbose :
-                        sys.stdout = sys.__stdout__
-                    if l_bound is None :
-                        print('Wrong solution ?')
-                        solution_file = ''
-                # except:
-                #     if not self.verbose :
-                #         sys.stdout = sys.__stdout__
-                #     print('ERROR in RUN RF ALGO. PASSING THROUGH')
-
-                reward_function = globals()[self.reward_function]()
-
-                self.eval_env = DarSeqEnv(size=self.image_size, target_population=self.nb_target, driver_population=self.nb_drivers,
-                                          rep_type=self.rep_type, reward_function=reward_function, test_env=True, dataset=instance_file_name)
-                self.eval_env.best_cost = l_bound
-
-            observation = self.eval_env.reset()
-            image = self.eval_env.get_svg_representation()
-            image.saveSvg(self.path_name + '/example_random.svg')
-            # return
-            if saving:
-                if self.example_format == 'svg':
-                    to_save = [self.eval_env.get_svg_representation() if full_test else 0]
-                else :
-                    to_save = [self.eval_env.get_image_representation() if full_test else 0]
-            save_rewards = [0]
-            last_time = 0
-
-            round_counter = 0
-            trans_time = time.time()
-
-            while not done:
-                world, targets, drivers, positions, time_contraints = observation
-                w_t = [torch.tensor([winfo],  dtype=torch.float64) for winfo in world]
-                t_t = [[torch.tensor([tinfo], dtype=torch.float64 ) for tinfo in target] for target in targets]
-                d_t = [[torch.tensor([dinfo],  dtype=torch.float64) for dinfo in driver] for driver in drivers]
-                info_block = [w_t, t_t, d_t]
-
-                positions = [torch.tensor([positions[0]], dtype=torch.float64),
-                             [torch.tensor([position], dtype=torch.float64) for position in positions[1]],
-                             [torch.tensor([position], dtype=torch.float64) for position in positions[2]]]
-
-                time_contraints = [torch.tensor([time_contraints[0]], dtype=torch.float64),
-                             [torch.tensor([time], dtype=torch.float64) for time in time_contraints[1]],
-                             [torch.tensor([time], dtype=torch.float64) for time in time_contraints[2]]]
-
-                target_tensor = torch.tensor([world[1]]).unsqueeze(-1).type(torch.LongTensor).to(self.device)
-
-                model_action = self.model(info_block,
+                envs, supervision_perfs, rf_times = self.rf_instances(nb_envs, first_episode)
+                seeds = None
+            else :
+                envs = [copy.deepcopy(self.eval_env) for _ in range(nb_envs)]
+                supervision_perfs, rf_times = [None] * nb_envs, [None] * nb_envs
+                seeds = np.random.randint(1, 2**31 - 1, size=nb_envs)
+
+            to_save = [[] for _ in envs]
+            save_rewards = [[0] for _ in envs]
+            last_times = [0] * nb_envs
+            policy = self.inference_policy()
+
+            def decide(indices, observations):
+                world, targets, drivers, positions, time_contraints = collate_observations(observations, dtype=self.dtype)[:5]
+                info_block = [world, targets, drivers]
+                target_tensor = world[1].unsqueeze(-1).type(torch.LongTensor).to(self.device)
+
+                with torch.no_grad(), autocast(self.precision, self.device):
+                    model_action = policy(info_block,
                                           target_tensor,
                                           positions=positions,
                                           times=time_contraints)
 
-                if supervision :
-                    supervised_action = self.supervision.action_choice()
-                    supervised_action = torch.tensor([supervised_action]).type(torch.LongTensor).to(self.device)
-
                 if self.typ >25:
-                    chosen_action = model_action.argmax(-1).cpu().item()
+                    logits = model_action
                 else :
-                    chosen_action = model_action[:, 0].argmax(-1).cpu().item()
-
-                if full_test :
-                    observation, reward, done, info = self.eval_env.step(chosen_action)
+                    logits = model_action[:, 0]
+                chosen_actions = self.choose_actions(logits, [envs[k] for k in indices])
+                stats['total'] += len(indices)
+
+                if not supervision :
+                    return chosen_actions
+                supervised_actions = []
+                for k in indices:
+                    self.supervision.env = envs[k]
+                    supervised_actions.append(self.supervision.action_choice())
+                supervised_action = torch.tensor(supervised_actions).type(torch.LongTensor).to(self.device)
+                stats['loss'] += self.criterion(logits, supervised_action).item() * len(indices)
+                stats['correct'] += sum(chosen == supervised for chosen, supervised in zip(chosen_actions, supervised_actions))
+                return chosen_actions if full_test else supervised_actions
+
+            def on_step(k, reward):
+                if saving and full_test and envs[k].time_step > last_times[k]:
+                    last_times[k] = envs[k].time_step
+                    if self.example_format == 'svg':
+                        to_save[k].append(envs[k].get_svg_representation())
+                    else :
+                        to_save[k].append(envs[k].get_image_representation())
+                    save_rewards[k].append(reward)
+
+            # First frame of the episodes: the seeded resets give the instances of the lockstep run
+            for k, env in enumerate(envs[:nb_envs if saving else 1]):
+                if seeds is None :
+                    env.reset()
                 else :
-                    observation, reward, done, info = self.eval_env.step(supervised_action)
-
-                # self.eval_env.render()
-                if supervision :
-                    loss = self.criterion(model_action[:,0], supervised_action)
-                    running_loss += loss.item()
-                else :
-                    loss = 0
-                    running_loss += 0
-
-                total_reward += reward
-                total += 1
-                round_counter += 1
-                if supervision:
-                    correct += (chosen_action == supervised_action).cpu().numpy()
-                else :
-                    correct += 0
-
-                if saving:
-                    if self.eval_env.time_step > last_time and full_test:
-                        last_time = self.eval_env.time_step
-                        if self.example_format == 'svg':
-                            to_save.append(self.eval_env.get_svg_representation())
-                        else :
-                            to_save.append(self.eval_env.get_image_representation())
-                        save_rewards.append(reward)
+                    env.reset(seed=int(seeds[k]))
+                if k == 0:
+                    env.get_svg_representation().saveSvg(self.path_name + '/example_random.svg')
+                if saving and full_test:
+                    if self.example_format == 'svg':
+                        to_save[k].append(env.get_svg_representation())
+                    else :
+                        to_save[k].append(env.get_image_representation())
+                elif saving :
+                    to_save[k].append(0)
 
+            trans_time = time.time()
+            if self.decoding != 'greedy' :
+                infos, rewards, steps = [], [], []
+                for k, env in enumerate(envs):
+                    if seeds is None :
+                        env.reset()
+                    else :
+                        env.reset(seed=int(seeds[k]))
+                    info, reward, nb_steps = self.decoded_episode(env, policy)
+                    infos.append(info)
+                    rewards.append(reward)
+                    steps.append(nb_steps)
+                stats['total'] += sum(steps)
+            else :
+                infos, rewards, steps = lockstep_episodes(envs, decide, seeds=seeds, on_step=on_step)
             trans_time = time.time() - trans_time
 
-            fit_sol += info['fit_solution'] #self.eval_env.is_fit_solution()
-            delivered += info['delivered']
-            if fit_sol and l_bound is not None:
-                gap += info['GAP']
-            if l_bound is None:
-                print('!NO LOW BOUND FOUND!')
-                print()
-            print('* Model did: ', info['fit_solution'], ' *')
-            print('- Supvi Total distance:', supervision_perf)
-            print('- Model Total distance:', self.eval_env.total_distance)
-
-            print('- - Supvi Time:', rf_time)
-            print('- - Model Time:', trans_time)
-            print('- - Passe Time:', trans_time/round_counter)
-
-            # Saving an example
-            if saving :
-                if self.example_format == 'svg':
-                    self.save_svg_example(to_save, save_rewards, i, time_step=self.current_epoch)
-                else :
-                    self.save_example(to_save, save_rewards, 0, time_step=self.current_epoch)
-            i += 1
-
+            totals = add_episodes(totals, infos, rewards, gap_counted=[not rf or env.best_cost is not None for env in envs])
+            for k, info in enumerate(infos):
+                if rf and envs[k].best_cost is None:
+                    print('!NO LOW BOUND FOUND!')
+                    print()
+                print('* Model did: ', info['fit_solution'], ' *')
+                print('- Supvi Total distance:', supervision_perfs[k])
+                print('- Model Total distance:', envs[k].total_distance)
+                print('- - Supvi Time:', rf_times[k])
+
+                # Saving an example
+                if saving :
+                    if self.example_format == 'svg':
+                        self.save_svg_example(to_save[k], save_rewards[k], first_episode + k, time_step=self.current_epoch)
+                    else :
+                        self.save_example(to_save[k], save_rewards[k], first_episode + k, time_step=self.current_epoch)
+
+            print('- - Model Time (', nb_envs, 'episodes):', trans_time)
+            print('- - Passe Time:', trans_time/max(steps))
+        correct, total, running_loss = stats['correct'], stats['total'], stats['loss']
+        fit_sol, delivered, gap, total_reward = totals['fit_solution'], totals['delivered'], totals['gap'], totals['reward']
+        self.masking_report(eval_name)
 
         # To spare time, only the last example is saved
         eval_acc = 100 * correct/total
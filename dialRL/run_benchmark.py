@@ -0,0 +1,61 @@
+import sys
+import argparse
+
+from dialRL.rl_train.benchmark import run_benchmark
+
+'''
+Benchmark of whole saved models over every instance of the Cordeau folders (a2-16 ... a8-96, tabu1 ...).
+Each instance is decoded greedily by the first --models of its size, the instances being spread
+over --processes processes. Per instance: fit, GAP to the best known solution, decisions, p50 / p99
+decision latency, in <--out>.csv and <--out>.json (with the summary) to compare checkpoints.
+
+python dialRL/run_benchmark.py --models <rootdir>/data/rl_experiments/<run>/models/best_GAP_model.pt \
+    --instances <rootdir>/data/instances/cordeau2006/ <rootdir>/data/instances/cordeau2003/ --processes 8 --out results/<run>
+'''
+
+
+def get_args(args):
+    parser = argparse.ArgumentParser(
+        description="Parse argument used when running a benchmark.",
+        epilog="python run_benchmark.py --models FILE [FILE ...] --instances DIR [DIR ...]")
+    parser.add_argument('--models', nargs='+', type=str, required=True)
+    parser.add_argument('--instances', nargs='+', type=str, required=True)
+    parser.add_argument('--out', default='', type=str)
+    parser.add_argument('--processes', default=1, type=int)
+    parser.add_argument('--threads', default=1, type=int)
+    parser.add_argument('--rep_type', default='16', type=str)
+    parser.add_argument('--reward_function', default='ConstantReward', type=str)
+    parser.add_argument('--masked_decoding', default=0, type=int)
+
+    return parser.parse_known_args(args)[0]
+
+
+def goooo():
+    # Get params
+    args = get_args(sys.argv[1:])
+
+    rows, summary = run_benchmark(args.instances, args.models,
+                                  out=args.out,
+                                  processes=args.processes,
+                                  threads=args.threads,
+                                  rep_type=args.rep_type,
+                                  reward_function=args.reward_function,
+                                  masked_decoding=bool(args.masked_decoding))
+
+    print('\n{:>10} {:>5} {:>10} {:>10} {:>10} {:>10} {:>10} {:>10}'.format('instance', 'fit', 'delivered', 'GAP', 'decisions',
+                                                                         'p50 ms', 'p99 ms', 'time s'))
+    for row in rows:
+        if row['skipped'] :
+            print('{:>10} skipped: {}'.format(row['instance'], row['skipped']))
+            continue
+        print('{:>10} {:>5} {:>10} {:>10} {:>10} {:>10.2f} {:>10.2f} {:>10.2f}'.format(
+            row['instance'], row['fit'], row['delivered'], 'None' if row['GAP'] is None else '{:.2f}'.format(row['GAP']),
+            row['decisions'], row['latency p50 (ms)'], row['latency p99 (ms)'], row['time (s)']))
+    print('\nFit solutions: {f}/{e} evaluated instances ({n} found), mean GAP: {g}, wall time: {t:.1f}s'.format(
+        f=summary['fit'], e=summary['evaluated'], n=summary['instances'], g=summary['mean GAP'], t=summary['wall time (s)']))
+    if args.out :
+        print('Results in', args.out + '.csv', args.out + '.json')
+
+
+if __name__ == '__main__':
+    goooo()
@@ -0,0 +1,113 @@
+import os
+import sys
+import argparse
+import datetime
+import numpy as np
+import time
+
+from clearml import Task
+from icecream import ic
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from dialRL.utils import objdict
+from dialRL.rl_train import SupervisedTrainer
+from dialRL.run_supervised_rl_clearML import get_args, millify
+
+'''
+Data parallel supervised training (torch.distributed, gloo backend so that it runs on CPU only nodes).
+Takes the arguments of run_supervised_rl_clearML.py plus the layout of the processes:
+    --nprocs processes on each of the --nnodes machines, this one being --node_rank.
+Every process trains on its part of the data and the gradients are all reduced at each step.
+The main process (rank 0) alone generates the missing data, reports to ClearML, evaluates and saves the models.
+With several nodes, the data folder (--rootdir / --datadir) has to be shared by all of them.
+
+Single machine with 8 processes:
+    python dialRL/run_distributed_supervised.py --nprocs 8 <training arguments>
+Two machines:
+    python dialRL/run_distributed_supervised.py --nprocs 8 --nnodes 2 --node_rank 0 --master_addr <ip of node 0> <training arguments>
+    python dialRL/run_distributed_supervised.py --nprocs 8 --nnodes 2 --node_rank 1 --master_addr <ip of node 0> <training arguments>
+'''
+
+
+def get_distributed_args(args):
+    parser = argparse.ArgumentParser(
+        description="Parse the processes layout of a distributed train.",
+        epilog="python run_distributed_supervised.py --nprocs INT")
+    parser.add_argument('--nprocs', default=2, type=int)
+    parser.add_argument('--nnodes', default=1, type=int)
+    parser.add_argument('--node_rank', default=0, type=int)
+    parser.add_argument('--master_addr', default='127.0.0.1', type=str)
+    parser.add_argument('--master_port', default=29500, type=int)
+    parser.add_argument('--dist_backend', default='gloo', type=str)
+    # Minutes a process may wait on the others (data generation and evaluations of the main process)
+    parser.add_argument('--dist_timeout', default=600, type=int)
+    # Torch threads of each process, 0: cores of the machine / nprocs
+    parser.add_argument('--threads', default=0, type=int)
+
+    return parser.parse_known_args(args)[0]
+
+
+def worker(local_rank, parameters, layout):
+    rank = layout.node_rank * layout.nprocs + local_rank
+    world_size = layout.nnodes * layout.nprocs
+    parameters.rank = rank
+    parameters.local_rank = local_rank
+    parameters.world_size = world_size
+
+    # Share the cores of the machine
+    threads = layout.threads if layout.threads else max(1, (os.cpu_count() or 1) // layout.nprocs)
+    torch.set_num_threads(threads)
+
+    os.environ['MASTER_ADDR'] = layout.master_addr
+    os.environ['MASTER_PORT'] = str(layout.master_port)
+    dist.init_process_group(backend=layout.dist_backend,
+                            rank=rank,
+                            world_size=world_size,
+                            timeout=datetime.timedelta(minutes=layout.dist_timeout))
+
+    # Same numpy seed everywhere (identical data splits), torch seed per process (augmentation, dropout)
+    # The model weights are broadcasted from rank 0 by the DDP wrapper
+    np.random.seed(parameters.seed)
+    torch.manual_seed(parameters.seed + rank)
+
+    task = None
+    if parameters.clearml and rank == 0:
+        n = np.random.randint(10000)
+        tags_list = ['Gp: d'+str(parameters.nb_drivers)+'d'+str(parameters.nb_target)+ parameters.supervision_function +' '+millify(parameters.data_size),
+                     'x' + str(world_size) + ' processes']
+        if parameters.tag :
+            tags_list.append(parameters.tag)
+        task = Task.init(
+            project_name="DaRP",
+            task_name="experiment" + str(n),
+            auto_connect_frameworks={'pytorch': False},
+            tags=tags_list)
+
+    # Get the trainer object
+    trainer = SupervisedTrainer(parameters, sacred=task)
+
+    # Start a train
+    trainer.run()
+
+    dist.destroy_process_group()
+
+
+def goooo():
+    # Get params
+    parameters = objdict(vars(get_args(sys.argv[1:])))
+    layout = get_distributed_args(sys.argv[1:])
+
+    # The seed has to be shared by every process (and node)
+    if parameters.seed is None:
+        parameters.seed = int(time.time())
+        ic(parameters.seed)
+        if layout.nnodes > 1:
+            print('/!\\ No --seed given, the data splits of the nodes will differ')
+
+    mp.spawn(worker, args=(parameters, layout), nprocs=layout.nprocs, join=True)
+
+
+if __name__ == '__main__':
+    goooo()
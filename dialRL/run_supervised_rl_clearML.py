@@ -33,6 +33,10 @@ def get_args(args):
     parser.add_argument('--patience', default=50, type=int)
     parser.add_argument('--scheduler', default='plateau', type=str)
     parser.add_argument('--checkpoint_dir', default='', type=str)
+    # Distillation of a whole saved teacher model (rl_experiments/<run>/models/best_*.pt) into the model of the flags
+    parser.add_argument('--teacher', default='', type=str)
+    parser.add_argument('--distillation_temperature', default=2., type=float)
+    parser.add_argument('--distillation_weight', default=0.9, type=float)
     parser.add_argument('--input_type', type=str, default='flatmap')
     parser.add_argument('--output_type', type=str, default='flatmap')
     parser.add_argument('--layers', default=[64, 64], nargs='+', type=int)
@@ -41,6 +45,15 @@ def get_args(args):
     parser.add_argument('--example_freq', default=100000, type=int)
     parser.add_argument('--example_format', default='svg', type=str)
     parser.add_argument('--eval_episodes', default=4, type=int)
+    parser.add_argument('--eval_batch_size', default=64, type=int)
+    # Decoding restricted to the feasible actions of the current driver (env.action_mask())
+    parser.add_argument('--masked_decoding', default=0, type=int)
+    # Decoding of the evaluation episodes: greedy, best of --decoding_width sampled trajectories or beam search
+    parser.add_argument('--decoding', default='greedy', type=str)
+    parser.add_argument('--decoding_width', default=16, type=int)
+    parser.add_argument('--decoding_temperature', default=1., type=float)
+    parser.add_argument('--decoding_budget', default=0., type=float)
+    parser.add_argument('--decoding_workers', default=0, type=int)
     parser.add_argument('--verbose', default=1, type=int)
     parser.add_argument('--max_step', default=10000, type=int)
     parser.add_argument('--nb_target', default=5, type=int)
@@ -68,6 +81,44 @@ def get_args(args):
     parser.add_argument('--pretrain', default=0, type=int)
     parser.add_argument('--datadir', default='', type=str)
     parser.add_argument('--augmentation', default=1, type=int)
+    parser.add_argument('--augmentation_device', default=0, type=int)
+    parser.add_argument('--streaming', default=0, type=int)
+    parser.add_argument('--shuffle_buffer', default=20000, type=int)
+    parser.add_argument('--epochs_per_pass', default=20, type=int)
+    parser.add_argument('--read_ahead', default=2, type=int)
+    parser.add_argument('--num_workers', default=0, type=int)
+    parser.add_argument('--pin_memory', default=0, type=int)
+    parser.add_argument('--prefetch_factor', default=2, type=int)
+    parser.add_argument('--persistent_workers', default=0, type=int)
+    # Instances of different sizes: padded batches, grouped by size (Trans18)
+    parser.add_argument('--bucketing', default=0, type=int)
+    parser.add_argument('--precision', default='float64', type=str)
+    parser.add_argument('--compile', default='', type=str)
+    parser.add_argument('--attention_backend', default='einsum', type=str)
+    # --attention_backend sparse: nearest target tokens attended to, weight of the time windows in the metric
+    parser.add_argument('--neighbours', default=16, type=int)
+    parser.add_argument('--time_weight', default=1., type=float)
+    parser.add_argument('--inference_cache', default=0, type=int)
+    parser.add_argument('--onnx', default=0, type=int)
+    # Effective batch size: --batch_size, split in micro batches (0: no split, -1: probed)
+    parser.add_argument('--micro_batch_size', default=0, type=int)
+    parser.add_argument('--memory_budget', default=0., type=float)
+    # Training checkpoints every N batches (0: end of the epochs only), last ones kept, resume from
+    parser.add_argument('--checkpoint_every', default=0, type=int)
+    parser.add_argument('--keep_checkpoints', default=3, type=int)
+    parser.add_argument('--resume', default='', type=str)
+    # Evaluations every N epochs, in a separate process watching the checkpoints (--eval_process 1)
+    # --evaluation_dir: run folder to evaluate (evaluation process only)
+    parser.add_argument('--eval_every', default=1, type=int)
+    parser.add_argument('--eval_process', default=0, type=int)
+    parser.add_argument('--eval_threads', default=1, type=int)
+    parser.add_argument('--eval_poll', default=10, type=int)
+    parser.add_argument('--evaluation_dir', default='', type=str)
+    # Time / throughput metrics of the epochs and evaluations (logger and <run>/metrics.jsonl)
+    parser.add_argument('--profile', default=1, type=int)
+    parser.add_argument('--world_size', default=1, type=int)
+    parser.add_argument('--rank', default=0, type=int)
+    parser.add_argument('--local_rank', default=0, type=int)
 
     return parser.parse_known_args(args)[0]
 
@@ -37,6 +37,15 @@ def get_args(args):
     parser.add_argument('--example_freq', default=100000, type=int)
     parser.add_argument('--example_format', default='svg', type=str)
     parser.add_argument('--eval_episodes', default=4, type=int)
+    parser.add_argument('--eval_batch_size', default=64, type=int)
+    # Decoding restricted to the feasible actions of the current driver (env.action_mask())
+    parser.add_argument('--masked_decoding', default=0, type=int)
+    # Decoding of the evaluation episodes: greedy, best of --decoding_width sampled trajectories or beam search
+    parser.add_argument('--decoding', default='greedy', type=str)
+    parser.add_argument('--decoding_width', default=16, type=int)
+    parser.add_argument('--decoding_temperature', default=1., type=float)
+    parser.add_argument('--decoding_budget', default=0., type=float)
+    parser.add_argument('--decoding_workers', default=0, type=int)
     parser.add_argument('--verbose', default=1, type=int)
     parser.add_argument('--max_step', default=5000, type=int)
     parser.add_argument('--nb_target', default=5, type=int)
@@ -58,6 +67,15 @@ def get_args(args):
     parser.add_argument('--num_layers', default=6, type=int)
     parser.add_argument('--heads', default=8, type=int)
     parser.add_argument('--forward_expansion', default=4, type=int)
+    parser.add_argument('--precision', default='float64', type=str)
+    parser.add_argument('--compile', default='', type=str)
+    parser.add_argument('--attention_backend', default='einsum', type=str)
+    # --attention_backend sparse: nearest target tokens attended to, weight of the time windows in the metric
+    parser.add_argument('--neighbours', default=16, type=int)
+    parser.add_argument('--time_weight', default=1., type=float)
+    parser.add_argument('--inference_cache', default=0, type=int)
+    parser.add_argument('--onnx', default=0, type=int)
+    parser.add_argument('--quantize', default=0, type=int)
 
 
 
@@ -1,4 +1,6 @@
-from dialRL.utils.objects import SupervisionDataset,MemoryDataset, objdict
+from dialRL.utils.objects import SupervisionDataset,MemoryDataset, StreamingSupervisionDataset, BucketBatchSampler, objdict
+from dialRL.utils.augmentation import BatchAugmentation
+from dialRL.utils.collate import collate_observations, collate_padded, collate_supervision, move_to_device, split_batch
 from dialRL.utils import utils
 from dialRL.utils.utils import (image_coordonates2indices,
                                 indice2image_coordonates,
@@ -8,6 +10,8 @@ from dialRL.utils.utils import (image_coordonates2indices,
                                 indice_map2image,
                                 distance,
                                 get_device,
+                                torch_load,
+                                autocast,
                                 visualize,
                                 GAP_function,
                                 float_equality,
@@ -16,13 +20,25 @@ from dialRL.utils.utils import (image_coordonates2indices,
                                 time2int,
                                 plotting,
                                 trans25_coord2int,
-                                quinconx)
+                                quinconx,
+                                stack_features,
+                                assemble_sequence,
+                                batched_positional_encoding,
+                                batched_times_encoding,
+                                sequence_padding_mask,
+                                mask_logits)
 from dialRL.utils.representation import instance2Image_rep
 from dialRL.utils.reward_functions import ConstantReward, ProportionalReward, ProportionalEndDistance, NoNegativeProportionalReward, EndReward, NoNegativeEndReward
 
 __all__ = ['coord2int',
            'ProportionalEndDistance',
            'quinconx',
+           'stack_features',
+           'assemble_sequence',
+           'batched_positional_encoding',
+           'batched_times_encoding',
+           'sequence_padding_mask',
+           'mask_logits',
            'trans25_coord2int',
            'plotting',
            'time2int',
@@ -38,6 +54,17 @@ __all__ = ['coord2int',
            'indice_map2image',
            'distance',
            'get_device',
+           'torch_load',
+           'autocast',
            'objdict',
+           'SupervisionDataset',
+           'StreamingSupervisionDataset',
+           'BucketBatchSampler',
+           'BatchAugmentation',
+           'collate_observations',
+           'collate_padded',
+           'collate_supervision',
+           'move_to_device',
+           'split_batch',
            'visualize',
            'obs2int']
@@ -0,0 +1,79 @@
+import numpy as np
+import torch
+
+
+class BatchAugmentation():
+    """ Data augmentation of collated supervision batches.
+        All the 2D points of the batch are mirrored, rotated, translated and dilated
+        in a single batched matmul. Times are shifted (half of the time by an integer)
+        and dilated, the driver to target distances follow the dilatation.
+        The random parameters of the whole batch are drawn as one tensor.
+    """
+    def __init__(self, device=None, max_translation=1., max_time_shift=10., max_dilatation=0.1):
+        self.device = device
+        self.max_translation = max_translation
+        self.max_time_shift = max_time_shift
+        self.max_dilatation = max_dilatation
+
+    def draw(self, bsz, dtype, device):
+        """ Per sample parameters:
+            0: time shift, 1: time rounding, 2-3: translation, 4: rotation, 5: mirror, 6: dilatation
+        """
+        rand_vect = torch.rand(bsz, 7, dtype=dtype, device=device)
+
+        time_shift = rand_vect[:, 0] * self.max_time_shift
+        time_shift = torch.where(rand_vect[:, 1] > 0.5, torch.round(time_shift), time_shift)
+        translation = (rand_vect[:, 2:4] * 2 - 1) * self.max_translation
+        theta = (rand_vect[:, 4] * 2 - 1) * np.pi
+        mirror = torch.where(rand_vect[:, 5] > 0.5, -torch.ones_like(theta), torch.ones_like(theta))
+        dilate = 1 + (rand_vect[:, 6] * 2 - 1) * self.max_dilatation
+
+        # Row vectors convention: p' = p @ (M @ R), M mirrors the x axis
+        transform = torch.stack([torch.stack([mirror * torch.cos(theta), -mirror * torch.sin(theta)], dim=-1),
+                                 torch.stack([torch.sin(theta), torch.cos(theta)], dim=-1)], dim=1)
+        return transform, translation, time_shift, dilate
+
+    def positions_augmentation(self, positions, transform, translation, dilate):
+        depot, targets, drivers = positions
+        bsz = depot.shape[0]
+        nb_targets, nb_drivers = len(targets), len(drivers)
+
+        # Every point in one [B, 1 + 2T + D, 2] tensor
+        points = torch.cat([depot.unsqueeze(1),
+                            torch.stack(targets, dim=1).reshape(bsz, 2 * nb_targets, 2)] +
+                           ([torch.stack(drivers, dim=1)] if nb_drivers else []), dim=1)
+        points = (torch.bmm(points, transform) + translation.unsqueeze(1)) * dilate.view(bsz, 1, 1)
+
+        depot = points[:, 0]
+        targets = list(points[:, 1:1 + 2 * nb_targets].reshape(bsz, nb_targets, 4).unbind(1))
+        drivers = list(points[:, 1 + 2 * nb_targets:].unbind(1))
+        return [depot, targets, drivers]
+
+    def time_augmentation(self, times, time_shift, dilate):
+        current = (times[0] + time_shift) * dilate
+        targets = list(((torch.stack(times[1], dim=1) + time_shift.view(-1, 1, 1)) * dilate.view(-1, 1, 1)).unbind(1))
+        if len(times) > 2 and len(times[2]):
+            # Drivers next available time
+            drivers = list(((torch.stack(times[2], dim=1) + time_shift.view(-1, 1)) * dilate.view(-1, 1)).unbind(1))
+            return [current, targets, drivers]
+        return [current, targets] + list(times[2:])
+
+    def distance_dilatation(self, targets, dilate):
+        return [target[:3] + [target[3] * dilate, target[4] * dilate] + list(target[5:]) if len(target) > 4 else target
+                for target in targets]
+
+    def __call__(self, observation):
+        world, targets, drivers, positions, time_constraints = observation[:5]
+        device = self.device if self.device is not None else positions[0].device
+        to_device = lambda x: x.to(device)
+
+        positions = [to_device(positions[0]), list(map(to_device, positions[1])), list(map(to_device, positions[2]))]
+        time_constraints = [to_device(time_constraints[0])] + [list(map(to_device, times)) for times in time_constraints[1:]]
+        targets = [list(map(to_device, target)) for target in targets]
+
+        transform, translation, time_shift, dilate = self.draw(positions[0].shape[0], positions[0].dtype, device)
+        positions = self.positions_augmentation(positions, transform, translation, dilate)
+        time_constraints = self.time_augmentation(time_constraints, time_shift, dilate)
+        targets = self.distance_dilatation(targets, dilate)
+
+        return [world, targets, drivers, positions, time_constraints] + list(observation[5:])
@@ -0,0 +1,127 @@
+import numpy as np
+import torch
+
+'''
+Collation of the DarSeqEnv observations:
+    [world, targets, drivers, positions, time_constraints (, prior_kwlg)]
+into the nested lists of [B, ...] tensors the models take as input.
+Each rectangular block is converted with a single numpy array instead of
+one tensor per scalar as done by the default collate function.
+Observations of different sizes (number of targets / drivers) are zero padded
+to the largest of the batch by collate_padded, along with their lengths.
+'''
+
+# Nesting depth of the python lists in each block (the rest is the leaf shape)
+OBSERVATION_DEPTHS = [1, 2, 2, [0, 1, 1], [0, 1, 1]]
+
+
+def unstack(tensor, depth):
+    """ [B, d1, .., d_depth, *leaf] tensor -> nested lists of [B, *leaf] tensors """
+    if depth == 0:
+        return tensor
+    return [unstack(tensor[:, k], depth - 1) for k in range(tensor.shape[1])]
+
+
+def collate_nested(items, dtype):
+    """ Generic fallback for the irregular blocks """
+    first = items[0]
+    if isinstance(first, (list, tuple)):
+        return [collate_nested([item[k] for item in items], dtype) for k in range(len(first))]
+    if torch.is_tensor(first):
+        return torch.stack(items).to(dtype)
+    return torch.as_tensor(np.asarray(items), dtype=dtype)
+
+
+def collate_block(items, depth, dtype):
+    if isinstance(depth, list):
+        return [collate_block([item[k] for item in items], sub_depth, dtype) for k, sub_depth in zip(range(len(items[0])), depth)]
+    try :
+        array = np.asarray(items, dtype=np.float64)
+    except (ValueError, TypeError):
+        return collate_nested(items, dtype)
+    if array.ndim < depth + 1:
+        return collate_nested(items, dtype)
+    return unstack(torch.from_numpy(array).to(dtype), depth)
+
+
+def collate_observations(observations, dtype=torch.float64):
+    """ Batch a list of observations, a single one being batched as [observation] """
+    blocks = [collate_block([observation[k] for observation in observations], depth, dtype)
+              for k, depth in enumerate(OBSERVATION_DEPTHS)]
+    # Other blocks (prior knowledge in pretrain)
+    for k in range(len(OBSERVATION_DEPTHS), len(observations[0])):
+        blocks.append(collate_nested([observation[k] for observation in observations], dtype))
+    return blocks
+
+
+def pad_block(items, length, depth, dtype):
+    """ Per sample lists of entities (targets or drivers) -> [B, length, *leaf] zero padded array,
+        unstacked as collate_block
+    """
+    leaf = next(np.asarray(item, dtype=np.float64).shape[1:] for item in items if len(item))
+    array = np.zeros((len(items), length) + leaf, dtype=np.float64)
+    for k, item in enumerate(items):
+        if len(item):
+            array[k, :len(item)] = item
+    return unstack(torch.from_numpy(array).to(dtype), depth)
+
+
+def collate_padded(observations, dtype=torch.float64):
+    """ collate_observations of observations of different sizes: the targets and drivers are
+        zero padded to the largest of the batch (see Trans18.forward lengths / sequence_padding_mask).
+        Returns the blocks and the [B, 2] (targets, drivers) lengths of the samples.
+    """
+    lengths = torch.tensor([[len(observation[1]), len(observation[2])] for observation in observations])
+    nb_targets, nb_drivers = lengths.max(dim=0).values.tolist()
+    world = collate_block([observation[0] for observation in observations], OBSERVATION_DEPTHS[0], dtype)
+    targets = pad_block([observation[1] for observation in observations], nb_targets, 2, dtype)
+    drivers = pad_block([observation[2] for observation in observations], nb_drivers, 2, dtype)
+    # positions and time constraints: [depot / current time, targets, drivers]
+    blocks = [world, targets, drivers]
+    for k in [3, 4]:
+        blocks.append([collate_block([observation[k][0] for observation in observations], 0, dtype),
+                       pad_block([observation[k][1] for observation in observations], nb_targets, 1, dtype),
+                       pad_block([observation[k][2] for observation in observations], nb_drivers, 1, dtype)])
+    return blocks, lengths
+
+
+def collate_supervision(batch, dtype=torch.float64, pad=False):
+    """ collate_fn of the supervision DataLoaders: [observation, supervised action] samples.
+        pad: instances of different sizes, the batch is (observation, actions, lengths) (see collate_padded)
+    """
+    observations, actions = zip(*batch)
+    actions = torch.stack([torch.as_tensor(action) for action in actions])
+    if pad :
+        observation, lengths = collate_padded(observations, dtype)
+        return observation, actions, lengths
+    return collate_observations(observations, dtype), actions
+
+
+def split_batch(data, size, nb_parts=None):
+    """ Nested lists of [B, ...] tensors -> list of the nested micro batches of `size` samples """
+    if nb_parts is None:
+        nb_parts = int(np.ceil(first_tensor(data).shape[0] / size))
+    if torch.is_tensor(data):
+        return list(torch.split(data, size))
+    elif isinstance(data, (list, tuple)):
+        parts = [split_batch(elmt, size, nb_parts) for elmt in data]
+        return [[part[k] for part in parts] for k in range(nb_parts)]
+    return [data for _ in range(nb_parts)]
+
+
+def first_tensor(data):
+    if torch.is_tensor(data):
+        return data
+    for elmt in data:
+        tensor = first_tensor(elmt) if isinstance(elmt, (list, tuple)) or torch.is_tensor(elmt) else None
+        if tensor is not None:
+            return tensor
+    return None
+
+
+def move_to_device(data, device, non_blocking=False):
+    if torch.is_tensor(data):
+        return data.to(device, non_blocking=non_blocking)
+    elif isinstance(data, (list, tuple)):
+        return [move_to_device(elmt, device, non_blocking) for elmt in data]
+    return data
@@ -1,8 +1,12 @@
 from torch.utils.data import DataLoader
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, IterableDataset, get_worker_info
 from icecream import ic
+from queue import Queue, Empty, Full
+import threading
+import random
 import torch
-import numpy as np
+
+from dialRL.utils.utils import torch_load
 
 class MemoryDataset(Dataset):
     """ Customed Dataset class for our Instances data
@@ -33,75 +37,176 @@ class SupervisionDataset(Dataset):
         return len(self.data)
 
 
-    def pos_augmentation(self, positions, rand_vect, dilate=None):
-        ''' Transposing all popsition information by a 2D vectors in [-1,1]²
-            In addition the 2D points are rotated by a random value [-pi, pi]
-        '''
-        depot, targets, drivers = positions
-
-        get_rot = lambda theta: torch.tensor([[torch.cos(theta*np.pi), -torch.sin(theta*np.pi)],
-                                [torch.sin(theta*np.pi), torch.cos(theta*np.pi)]]).double()
-
-        rand_vect = rand_vect * 2 - 1
-        rot = get_rot(torch.tensor(rand_vect[2]))
-        trsp = rand_vect[:2]
-        mirror = rand_vect[3]
-
-        comp_aug2d = lambda pos: (torch.matmul(pos, rot) + trsp) * dilate if torch.is_tensor(pos) else (torch.matmul(torch.from_numpy(pos), rot) + trsp) * dilate
-        comp_aug4d = lambda pos: torch.cat([torch.matmul(pos[:2], rot) + trsp,
-                                            torch.matmul(pos[2:], rot) + trsp]) * dilate if torch.is_tensor(pos) else torch.cat([torch.matmul(torch.from_numpy(pos[:2]), rot) + trsp,
-                                                                                                                                 torch.matmul(torch.from_numpy(pos[2:]), rot) + trsp]) * dilate
-
-        depot = comp_aug2d(depot)
-        targets = list(map(comp_aug4d, targets))
-        drivers = list(map(comp_aug2d, drivers))
-
-        return [depot, targets, drivers]
-
-
-    def time_augmentation(self, time, rand_vect, dilate=None):
-        ''' Shifting all time information by a random amount
-            This transposition value is in [0, 10]
-            half of the time it's rounded to an integer
-        '''
-        current, targets, drivers = time
-        rand1, rand2 = rand_vect
-
-        # rand1, rand2 = torch.rand(2)
-        trsp = rand1 * 10
-        if rand2 > 0.5:
-            trsp = torch.round(trsp)
-
-        aug4d = lambda tem: (tem + trsp) * dilate if torch.is_tensor(tem) else (torch.from_numpy(tem) + trsp) * dilate
-        aug1d = lambda tem: (tem + trsp) * dilate
-
-        current = aug1d(current)
-        targets = list(map(aug4d, targets))
-        drivers = list(map(aug1d, drivers))
-
-        return [current, targets, drivers]
-
-    def distance_dilatation(self, targets, dilate):
-        dilat_distance = lambda t: [t[0], t[1], t[2], t[3]*dilate, t[4]*dilate]
-        targets = list(map(dilat_distance, targets))
-        return targets
-
-
-
     def __getitem__(self, idx):
-        """ simple idx """
-        if hasattr(self, 'augment') and self.augment is not None and self.augment:
-            obs, sup = self.data[idx]
-            world, targets, drivers, positions, time_constraints = obs
-            rand_vect = torch.rand(2+4+1).double()     # 2 for time (1round, 1shift) + 4 for pos (2transp vect, 1rot, 1miror)  + 1dilation
-            dilate = 1 + (rand_vect[-1] * 2 - 1)/10
-            positions = self.pos_augmentation(positions, rand_vect[2:-1], dilate)
-            time_constraints = self.time_augmentation(time_constraints, rand_vect[:2], dilate)
-            targets = self.distance_dilatation(targets, dilate)
-            return [world, targets, drivers, positions, time_constraints], sup
-
-        else :
-            return self.data[idx]
+        """ simple idx
+            (augmentation is done on the collated batches, see utils.augmentation)
+        """
+        return self.data[idx]
+
+
+class StreamingSupervisionDataset(IterableDataset):
+    """ Iterable Dataset streaming the saved supervision shards (.pt files)
+        Shards are read one after the other by a background thread (read ahead),
+        their samples are mixed through a bounded shuffle buffer. Each epoch
+        visits a window of the shards so that the whole data is covered every
+        `epochs_per_pass` epochs. Memory holds at most the buffer + read ahead shards.
+        `class_rates` (indexed by the supervised action) balances the stream: each sample
+        is yielded on average `rate` times (under sampling < 1 < over sampling).
+        With distributed training, each of the `world_size` processes streams its own shards.
+    """
+    def __init__(self, files_names, shuffle_buffer=10000, epochs_per_pass=1, read_ahead=2, shuffle=True, seed=0, class_rates=None,
+                 rank=0, world_size=1):
+        self.files_names = sorted(files_names)
+        self.shuffle_buffer = max(1, shuffle_buffer)
+        self.epochs_per_pass = max(1, min(epochs_per_pass, len(self.files_names)))
+        self.read_ahead = max(1, read_ahead)
+        self.shuffle = shuffle
+        self.seed = seed
+        self.class_rates = class_rates
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def epoch_files(self):
+        """ Window of the shards visited at the current epoch.
+            The shards order is redrawn at each new pass on the data.
+        """
+        files_names = list(self.files_names)
+        data_pass, window = divmod(self.epoch, self.epochs_per_pass)
+        if self.shuffle:
+            random.Random(self.seed + data_pass).shuffle(files_names)
+        part_size = len(files_names) / self.epochs_per_pass
+        return files_names[int(round(window * part_size)):int(round((window + 1) * part_size))]
+
+    def read_shards(self, files_names, queue, stop):
+        """ Reader thread: loads the shards in order, None marks the end.
+            A loading error is passed on to the consumer instead of a shard.
+        """
+        def shards():
+            try :
+                for file in files_names:
+                    yield torch_load(file)
+            except Exception as err:
+                yield err
+            yield None
+
+        for shard in shards():
+            while not stop.is_set():
+                try :
+                    queue.put(shard, timeout=0.1)
+                    break
+                except Full:
+                    pass
+
+    def repetitions(self, sample, rng):
+        if self.class_rates is None:
+            return 1
+        rate = self.class_rates[int(sample[1])]
+        return int(rate) + (rng.random() < rate - int(rate))
+
+    def __iter__(self):
+        files_names = self.epoch_files()
+        worker_info = get_worker_info()
+        num_workers, worker_id = 1, 0
+        if worker_info is not None:
+            num_workers, worker_id = worker_info.num_workers, worker_info.id
+        # Each (process, worker) gets its own shards
+        worker_id = self.rank * num_workers + worker_id
+        files_names = files_names[worker_id::self.world_size * num_workers]
+
+        rng = random.Random(self.seed + 1000 * self.epoch + worker_id)
+        queue = Queue(maxsize=self.read_ahead)
+        stop = threading.Event()
+        reader = threading.Thread(target=self.read_shards, args=(files_names, queue, stop), daemon=True)
+        reader.start()
+
+        buffer = []
+        try :
+            while True:
+                shard = queue.get()
+                if shard is None:
+                    break
+                elif isinstance(shard, Exception):
+                    raise shard
+                order = list(range(len(shard)))
+                if self.shuffle:
+                    rng.shuffle(order)
+                for idx in order:
+                    for _ in range(self.repetitions(shard[idx], rng)):
+                        if not self.shuffle:
+                            yield shard[idx]
+                        elif len(buffer) < self.shuffle_buffer:
+                            buffer.append(shard[idx])
+                        else :
+                            # Swap a random element of the full buffer out
+                            j = rng.randrange(self.shuffle_buffer)
+                            sample = buffer[j]
+                            buffer[j] = shard[idx]
+                            yield sample
+                del shard
+            rng.shuffle(buffer)
+            while buffer:
+                yield buffer.pop()
+        finally :
+            stop.set()
+            # Unblock the reader if the iteration has been stopped early
+            while reader.is_alive():
+                try :
+                    queue.get_nowait()
+                except Empty:
+                    reader.join(0.1)
+
+
+class BucketBatchSampler():
+    """ batch_sampler of the supervision DataLoaders for instances of different sizes:
+        the samples are grouped by size (targets, drivers) so that the batches hold the
+        samples of one size, and need no padding (see collate_padded).
+        sizes: [targets, drivers] of every sample of the dataset, indices: the samples to batch.
+        The batches are shuffled within and across the sizes, at each epoch (set_epoch).
+        With distributed training, each of the `world_size` processes takes its share of the batches.
+    """
+    def __init__(self, sizes, batch_size, indices=None, shuffle=True, seed=0, drop_last=False, rank=0, world_size=1):
+        self.buckets = {}
+        for idx in (range(len(sizes)) if indices is None else indices):
+            self.buckets.setdefault(tuple(sizes[idx]), []).append(idx)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.drop_last = drop_last
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def batches(self):
+        rng = random.Random(self.seed + self.epoch)
+        batches = []
+        for size in sorted(self.buckets):
+            indices = list(self.buckets[size])
+            if self.shuffle:
+                rng.shuffle(indices)
+            for k in range(0, len(indices), self.batch_size):
+                batch = indices[k:k + self.batch_size]
+                if len(batch) == self.batch_size or not self.drop_last:
+                    batches.append(batch)
+        if self.shuffle:
+            rng.shuffle(batches)
+        if self.world_size > 1:
+            # Same number of batches on each process (wrapped around)
+            nb_batches = -(-len(batches) // self.world_size) * self.world_size
+            batches = (batches * self.world_size)[:nb_batches][self.rank::self.world_size]
+        return batches
+
+    def __iter__(self):
+        return iter(self.batches())
+
+    def __len__(self):
+        return len(self.batches())
 
 
 class objdict(dict):
@@ -7,6 +7,8 @@ import tempfile
 from icecream import ic
 import time
 import math
+import inspect
+import contextlib
 
 def get_device():
     if is_available(): #False: #
@@ -16,6 +18,21 @@ def get_device():
     print(' - Device: ', device, ' - ')
     return device
 
+def torch_load(file_name, map_location=None):
+    """ torch.load of a whole pickled object (model, dataset, checkpoint with the numpy / python rng states).
+        weights_only=False where torch.load has it (it defaults to True from torch 2.6),
+        older torch (1.10 of environment.yml) always unpickles.
+    """
+    if 'weights_only' in inspect.signature(torch.load).parameters:
+        return torch.load(file_name, map_location=map_location, weights_only=False)
+    return torch.load(file_name, map_location=map_location)
+
+def autocast(precision, device):
+    """ bf16 autocast context of the model calls when asked for (--precision bf16) """
+    if precision == 'bf16':
+        return torch.autocast(device_type=str(device).split(':')[0], dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
 def trans25_coord2int(coord, src_vocab_size, extremas):
     siderange = int(math.sqrt(src_vocab_size))
     boxh, boxw = abs(extremas[2] - extremas[0]) / siderange, abs(extremas[3] - extremas[1]) / siderange
@@ -35,6 +52,79 @@ def quinconx(l, d=1):
         a, b, c, dd = l
         return torch.cat([a.unsqueeze(-1), b.unsqueeze(-1), c.unsqueeze(-1), dd.unsqueeze(-1)], dim=-1).flatten(start_dim=d)
 
+def stack_features(entities):
+    """ N entities, each a list of F [B] features -> [B, N, F] tensor (one stack) """
+    features = [feature for entity in entities for feature in entity]
+    return torch.stack(features, dim=-1).view(features[0].shape[0], len(entities), len(entities[0]))
+
+def assemble_sequence(depot, pickups, dropoffs, drivers):
+    """ [B, E] depot, [B, T, E] pickups and dropoffs, [B, D, E] drivers -> [B, 1 + 2T + D, E]
+        sequence (depot, pickup and dropoff of each target, drivers) written in one buffer
+    """
+    bsz, nb_targets, emb = pickups.shape
+    dtype = torch.promote_types(torch.promote_types(depot.dtype, pickups.dtype), torch.promote_types(dropoffs.dtype, drivers.dtype))
+    sequence = torch.empty(bsz, 1 + 2*nb_targets + drivers.shape[1], emb, dtype=dtype, device=pickups.device)
+    sequence[:, 0] = depot
+    sequence[:, 1:2*nb_targets+1:2] = pickups
+    sequence[:, 2:2*nb_targets+2:2] = dropoffs
+    sequence[:, 2*nb_targets+1:] = drivers
+    return sequence
+
+def batched_positional_encoding(position, depot_emb, pickup_emb, dropoff_emb, dtype, device):
+    """ Positions ([B, 2] depot, T [B, 4] targets, D [B, 2] drivers) -> [B, 1 + 2T + D, E] sequence of
+        their linear embeddings, each layer applied once (depot_emb to the depot and the drivers)
+    """
+    depot_position = position[0].to(dtype).to(device)
+    targets = torch.stack(position[1], dim=1).to(dtype).to(device)
+    drivers = torch.stack(position[2], dim=1).to(dtype).to(device)
+    return assemble_sequence(depot_emb(depot_position),
+                             pickup_emb(targets[..., 0:2]),
+                             dropoff_emb(targets[..., 2:]),
+                             depot_emb(drivers))
+
+def batched_times_encoding(times, world_emb, window_emb, max_time, device, world=None, drivers=None):
+    """ Times ([B] current time, T [B, 4] time windows, D [B] drivers times) -> [B, 1 + 2T + D, E] sequence:
+        one window_emb lookup of the windows relative to the current time ([B, T, 4] offsets), the start
+        and end embeddings interleaved. The world and drivers tokens are world_emb of their time,
+        unless given.
+    """
+    current_time = times[0]
+    if world is None:
+        world = world_emb(current_time.long().to(device))
+
+    # Targets: (start, end) of the pickup and dropoff windows
+    offsets = torch.stack(times[1], dim=1) - current_time.view(-1, 1, 1) + max_time
+    windows = window_emb(offsets.to(device).long())
+    pickups = quinconx([windows[..., 0, :], windows[..., 1, :]], d=-2)
+    dropoffs = quinconx([windows[..., 2, :], windows[..., 3, :]], d=-2)
+
+    if drivers is None:
+        drivers = world_emb(torch.stack(times[2], dim=1).long().to(device))
+    return assemble_sequence(world, pickups, dropoffs, drivers)
+
+def sequence_padding_mask(lengths, nb_targets, nb_drivers):
+    """ [B, 2] (targets, drivers) lengths of padded instances -> [B, 1 + 2T + D] boolean mask
+        of the sequence (depot, pickup and dropoff of each target, drivers), False on the padding
+    """
+    lengths = torch.as_tensor(lengths)
+    targets = torch.arange(nb_targets, device=lengths.device) < lengths[:, :1]
+    drivers = torch.arange(nb_drivers, device=lengths.device) < lengths[:, 1:2]
+    mask = torch.ones(lengths.shape[0], 1 + 2*nb_targets + nb_drivers, dtype=torch.bool, device=lengths.device)
+    mask[:, 1:2*nb_targets+1:2] = targets
+    mask[:, 2:2*nb_targets+2:2] = targets
+    mask[:, 2*nb_targets+1:] = drivers
+    return mask
+
+def mask_logits(logits, masks):
+    """ [B, ..., V] logits -> logits of the infeasible actions set to -inf.
+        masks: B boolean action masks (env.action_mask()), the actions past them being infeasible.
+    """
+    mask = torch.zeros(logits.shape[0], logits.shape[-1], dtype=torch.bool, device=logits.device)
+    for b, action_mask in enumerate(masks):
+        mask[b, :len(action_mask)] = torch.as_tensor(action_mask[:logits.shape[-1]], device=logits.device)
+    mask = mask.view(logits.shape[0], *[1] * (logits.dim() - 2), logits.shape[-1])
+    return logits.masked_fill(~mask, float('-inf'))
+
 def norm_image(self, image, type=None, scale=1):
     image = np.kron(image, np.ones((scale, scale)))
     if type=='rgb':
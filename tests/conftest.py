@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+import torch
+
+from dialRL.models import Trans18, Trans28
+from dialRL.environments import DarSeqEnv
+from dialRL.utils.reward_functions import ConstantReward
+
+
+def pytest_addoption(parser):
+    parser.addoption('--checkpoint', default='', help='Whole saved model of the checkpoint tests (test_precision.py)')
+    parser.addoption('--instances', default='', help='Cordeau instances folder of the checkpoint tests')
+
+
+class Instances():
+    """ Small DarSeqEnv instances and Trans models of the equality tests
+        (the timings are in the dialRL/additional_code/benchmark_*.py scripts)
+    """
+    def env(self, nb_targets=16, nb_drivers=2, **kwargs):
+        return DarSeqEnv(size=10, target_population=nb_targets, driver_population=nb_drivers,
+                         reward_function=ConstantReward(), rep_type='16', **kwargs)
+
+    def observations(self, env, nb):
+        """ Observations of random episodes of the env """
+        batch = []
+        observation = env.reset()
+        while len(batch) < nb:
+            batch.append(observation)
+            observation, reward, done, info = env.step(env.action_space.sample())
+            if done :
+                observation = env.reset()
+        return batch
+
+    def model(self, env, model_class=Trans18, typ=26, nb_targets=None, nb_drivers=None, embed_size=64, heads=8, dropout=0.):
+        """ Double precision model in eval mode, sized for the env (or nb_targets / nb_drivers) """
+        nb_targets = env.target_population if nb_targets is None else nb_targets
+        nb_drivers = env.driver_population if nb_drivers is None else nb_drivers
+        kwargs = dict(src_vocab_size=400,
+                      trg_vocab_size=nb_targets + 1,
+                      max_length=nb_targets*2 + nb_drivers + 1,
+                      src_pad_idx=-1,
+                      trg_pad_idx=-1,
+                      embed_size=embed_size,
+                      dropout=dropout,
+                      extremas=env.extremas,
+                      device='cpu',
+                      num_layers=2,
+                      heads=heads,
+                      forward_expansion=2,
+                      typ=typ,
+                      max_time=int(env.time_end))
+        if model_class != Trans28:
+            kwargs['classifier_type'] = 1
+        return model_class(**kwargs).double().eval()
+
+
+@pytest.fixture
+def darp():
+    # The env constructor draws the depot position from numpy
+    np.random.seed(0)
+    torch.manual_seed(0)
+    return Instances()
@@ -0,0 +1,26 @@
+import copy
+import pytest
+
+from dialRL.rl_train.decoding import TrajectoryDecoder, solution_key
+
+
+def decoded_solution(model, env, decoding, width, masked):
+    """ Solution key of the decoded episode, replayed on a copy of the env """
+    decoder = TrajectoryDecoder(model, 26, decoding=decoding, width=width, masked=masked, seed=0)
+    decoded_env = copy.deepcopy(env)
+    info, total_reward, steps = decoder(decoded_env)
+    return solution_key(info, decoded_env.total_distance)
+
+
+@pytest.mark.parametrize('masked', [False, True])
+@pytest.mark.parametrize('decoding', ['sampling', 'beam'])
+def test_decoding_not_worse_than_greedy(darp, decoding, masked):
+    """ The sampling / beam solution is the best one found, never worse than the greedy one
+        (the first trajectory of a sampling of width 1)
+    """
+    env = darp.env(12, 2, test_env=True)
+    model = darp.model(env)
+    for seed in [1, 3, 8]:
+        env.reset(seed=seed)
+        greedy = decoded_solution(model, env, 'sampling', 1, masked)
+        assert decoded_solution(model, env, decoding, 4, masked) >= greedy, seed
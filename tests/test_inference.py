@@ -0,0 +1,43 @@
+import pytest
+import torch
+
+from dialRL.models import Trans18, Trans19, Trans28, InferenceSession, OnnxPolicy
+from dialRL.strategies import NNStrategy
+from dialRL.utils import collate_observations
+
+TOLERANCE = 1e-10
+
+
+@pytest.mark.parametrize('typ', [16, 26])
+def test_inference_session(darp, typ):
+    """ Along an episode of the nearest neighbour strategy, the session outputs are the model forward """
+    env = darp.env()
+    supervision = NNStrategy(reward_function='ConstantReward', env=env)
+    model = darp.model(env, typ=typ, embed_size=128, dropout=0.1)
+    session = InferenceSession(model)
+    observation = env.reset()
+    done = False
+    while not done:
+        world, targets, drivers, positions, times = collate_observations([observation])[:5]
+        trg = world[1].unsqueeze(-1).long()
+        with torch.no_grad():
+            reference = model([world, targets, drivers], trg, positions=positions, times=times)
+        assert torch.equal(reference, session([world, targets, drivers], trg, positions=positions, times=times))
+        observation, reward, done, info = env.step(supervision.action_choice())
+
+
+@pytest.mark.parametrize('model_class, typ', [(Trans18, 16), (Trans18, 17), (Trans18, 26), (Trans19, 26), (Trans28, 16)])
+def test_onnx_policy(darp, tmp_path, model_class, typ):
+    """ onnxruntime policy equal to the torch model, for a batch of 1 and a larger one (dynamic batch dimension) """
+    pytest.importorskip('onnxruntime')
+    env = darp.env()
+    batch = darp.observations(env, 8)
+    model = darp.model(env, model_class, typ, embed_size=128, dropout=0.1)
+    policy = OnnxPolicy(model, directory=str(tmp_path) + '/', verbose=False)
+    for size in [1, len(batch)]:
+        world, targets, drivers, positions, times = collate_observations(batch[:size])[:5]
+        src = [world, targets, drivers]
+        trg = world if typ in [17, 18, 19] else world[1].unsqueeze(-1).long()
+        with torch.no_grad():
+            reference = model(src, trg, positions=positions, times=times)
+        assert (reference - policy(src, trg, positions=positions, times=times)).abs().max().item() <= TOLERANCE
@@ -0,0 +1,66 @@
+import copy
+import numpy as np
+import pytest
+import torch
+
+from dialRL.utils import collate_observations, mask_logits
+from dialRL.rl_train.lockstep import lockstep_episodes, add_episodes
+
+
+def greedy_actions(model, observations, envs):
+    """ Feasible (masked) argmax actions of the model, so that the episodes deliver the targets """
+    world, targets, drivers, positions, times = collate_observations(observations)[:5]
+    with torch.no_grad():
+        logits = model([world, targets, drivers], world[1].unsqueeze(-1).long(), positions=positions, times=times)
+    return mask_logits(logits, [env.action_mask() for env in envs]).argmax(-1).tolist()
+
+
+def lockstep_run(model, envs, seeds):
+    return lockstep_episodes(envs, lambda indices, observations: greedy_actions(model, observations, [envs[k] for k in indices]),
+                             seeds=seeds)
+
+
+def sequential_episode(env, seed, model):
+    """ Plain greedy episode: env.reset(seed) then env.step(argmax) until done """
+    observation = env.reset(seed=int(seed))
+    done = False
+    total_reward, steps = 0, 0
+    while not done:
+        observation, reward, done, info = env.step(greedy_actions(model, [observation], [env])[0])
+        total_reward += reward
+        steps += 1
+    return info, total_reward, steps
+
+
+def test_lockstep_episodes(darp):
+    """ Episodes in lockstep: same rewards, steps and results as the sequential episodes (seeded instances) """
+    env = darp.env(test_env=True)
+    model = darp.model(env)
+    seeds = np.random.RandomState(0).randint(1, 2**31 - 1, size=8)
+    infos, rewards, steps = lockstep_run(model, [copy.deepcopy(env) for _ in seeds], seeds)
+    for k, seed in enumerate(seeds):
+        info, total_reward, nb_steps = sequential_episode(copy.deepcopy(env), seed, model)
+        assert abs(total_reward - rewards[k]) <= 1e-9
+        assert nb_steps == steps[k]
+        assert info == infos[k]
+
+
+@pytest.mark.parametrize('eval_batch_size', [1, 3, 8])
+def test_lockstep_evaluation_totals(darp, eval_batch_size):
+    """ Totals of an online evaluation run by eval_batch_size chunks (as Tester.online_evaluation)
+        equal to the sums over the sequential episodes
+    """
+    env = darp.env(test_env=True)
+    model = darp.model(env)
+    seeds = np.random.RandomState(0).randint(1, 2**31 - 1, size=8)
+    totals = None
+    for first_episode in range(0, len(seeds), eval_batch_size):
+        chunk = seeds[first_episode:first_episode + eval_batch_size]
+        infos, rewards, steps = lockstep_run(model, [copy.deepcopy(env) for _ in chunk], chunk)
+        totals = add_episodes(totals, infos, rewards)
+
+    episodes = [sequential_episode(copy.deepcopy(env), seed, model) for seed in seeds]
+    assert totals['fit_solution'] == sum(info['fit_solution'] for info, total_reward, nb_steps in episodes)
+    assert totals['delivered'] == sum(info['delivered'] for info, total_reward, nb_steps in episodes)
+    assert abs(totals['reward'] - sum(total_reward for info, total_reward, nb_steps in episodes)) <= 1e-9
+    assert abs(totals['gap'] - sum(info['GAP'] for info, total_reward, nb_steps in episodes if info['fit_solution'])) <= 1e-9
@@ -0,0 +1,121 @@
+import pytest
+import torch
+
+from dialRL.models import Trans18, Trans19, Trans28, SelfAttention, set_attention_backend
+from dialRL.utils import collate_observations, collate_padded, BucketBatchSampler
+
+TOLERANCE = 1e-10
+
+
+def forward(model, world, targets, drivers, positions, times, lengths=None):
+    kwargs = {} if lengths is None else {'lengths': lengths}
+    with torch.no_grad():
+        return model([world, targets, drivers], world[1].unsqueeze(-1).long(), positions=positions, times=times, **kwargs)
+
+
+@pytest.mark.parametrize('model_class, typ', [(Trans18, 16), (Trans18, 17), (Trans18, 18), (Trans18, 19), (Trans18, 26),
+                                              (Trans19, 26), (Trans19, 40), (Trans28, 16)])
+def test_batched_encodings(darp, model_class, typ):
+    """ Batched env, positions and times encodings equal to the per target / driver loops """
+    env = darp.env()
+    world, targets, drivers, positions, times = collate_observations(darp.observations(env, 16))[:5]
+    model = darp.model(env, model_class, typ)
+    for name, inputs in [('env', [world, targets, drivers]), ('positional', positions), ('times', times)]:
+        if not hasattr(model, 'batched_' + name + '_encoding'):
+            continue
+        with torch.no_grad():
+            loop = getattr(model, 'loop_' + name + '_encoding')(inputs)
+            batched = getattr(model, 'batched_' + name + '_encoding')(inputs)
+        assert torch.equal(loop, batched), name + '_encoding'
+
+
+@pytest.mark.parametrize('dtype, tolerance', [(torch.float64, TOLERANCE), (torch.float32, 1e-4)])
+@pytest.mark.parametrize('mask_type', ['none', 'padding', 'causal'])
+def test_attention_backends(dtype, tolerance, mask_type):
+    """ Outputs and gradients of SelfAttention equal with the einsum and sdpa backends """
+    torch.manual_seed(0)
+    attention = SelfAttention(64, 8).to(dtype)
+    x = torch.randn(8, 35, 64, dtype=dtype)
+    padding = torch.rand(8, 35) > 0.2
+    padding[:, 0] = True
+    mask = {'none': None,
+            'padding': padding.unsqueeze(1).unsqueeze(2),
+            'causal': torch.tril(torch.ones(35, 35)).expand(8, 1, 35, 35)}[mask_type]
+
+    results = []
+    for backend in ['einsum', 'sdpa']:
+        set_attention_backend(attention, backend)
+        inputs = x.clone().requires_grad_(True)
+        attention.zero_grad()
+        out = attention(inputs, inputs, inputs, mask)
+        out.sum().backward()
+        results.append((out.detach(), inputs.grad, attention.queries.weight.grad.clone()))
+    assert max((a - b).abs().max().item() for a, b in zip(*results)) <= tolerance
+
+
+def test_attention_backends_model(darp):
+    env = darp.env()
+    model = darp.model(env)
+    inputs = collate_observations(darp.observations(env, 8))[:5]
+    logits = {}
+    for backend in ['einsum', 'sdpa']:
+        set_attention_backend(model, backend)
+        logits[backend] = forward(model, *inputs)
+    assert (logits['einsum'] - logits['sdpa']).abs().max().item() <= TOLERANCE
+    assert torch.equal(logits['einsum'].argmax(-1), logits['sdpa'].argmax(-1))
+
+
+def test_incremental_decoding(darp):
+    """ Each Trans28 decode_step gives the full decoder recompute on the target prefix """
+    env = darp.env(16, 3)
+    world, targets, drivers, positions, times = collate_observations(darp.observations(env, 4))[:5]
+    src = [world, targets, drivers]
+    model = darp.model(env, Trans28, typ=16)
+    # Decoder tokens: drivers indices (1 to 3)
+    trg = torch.randint(1, 4, (4, 16))
+    with torch.no_grad():
+        full = [model(src, trg[:, :t+1], positions=positions, times=times)[:, -1] for t in range(trg.shape[1])]
+        cache = model.start_decoding(src, positions, times)
+        steps = [model.decode_step(cache, trg[:, t])[:, 0] for t in range(trg.shape[1])]
+    assert max((a - b).abs().max().item() for a, b in zip(full, steps)) <= TOLERANCE
+
+
+@pytest.mark.parametrize('typ', [16, 26])
+def test_padded_batch(darp, typ):
+    """ A padded batch mixing the instance sizes gives the logits of each instance alone """
+    observations = []
+    for nb_targets, nb_drivers in [(8, 2), (16, 2), (12, 3)]:
+        env = darp.env(nb_targets, nb_drivers)
+        observations += darp.observations(env, 3)
+    model = darp.model(env, typ=typ, nb_targets=16, nb_drivers=3)
+
+    inputs, lengths = collate_padded(observations)
+    padded = forward(model, *inputs, lengths=lengths)
+    alone = torch.cat([forward(model, *collate_observations([observation])[:5]) for observation in observations])
+    assert (padded - alone).abs().max().item() <= TOLERANCE
+
+
+def test_bucket_sampler_covers_dataset():
+    instance_sizes = [size for size in [(16, 2), (24, 3), (32, 4)] for _ in range(100)]
+    batches = list(BucketBatchSampler(instance_sizes, 32, seed=0))
+    assert sorted(idx for batch in batches for idx in batch) == list(range(len(instance_sizes)))
+    for batch in batches:
+        assert len(set(instance_sizes[idx] for idx in batch)) == 1
+
+
+@pytest.mark.parametrize('typ', [16, 26])
+def test_sparse_attention_all_neighbours(darp, typ):
+    """ With every target token as neighbour, the sparse attention is the full attention """
+    env = darp.env(12, 2)
+    batch = darp.observations(env, 2)
+    small_batch = darp.observations(darp.env(8, 3), 2)
+    model = darp.model(env, typ=typ, nb_targets=12, nb_drivers=3)
+    inputs = collate_observations(batch)[:5]
+    padded_inputs, lengths = collate_padded(batch + small_batch)
+
+    set_attention_backend(model, 'einsum')
+    full = forward(model, *inputs)
+    full_padded = forward(model, *padded_inputs, lengths=lengths)
+    set_attention_backend(model, 'sparse', neighbours=2*12)
+    assert (forward(model, *inputs) - full).abs().max().item() <= TOLERANCE
+    assert (forward(model, *padded_inputs, lengths=lengths) - full_padded).abs().max().item() <= TOLERANCE
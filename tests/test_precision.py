@@ -0,0 +1,63 @@
+import os
+import copy
+import pytest
+import torch
+
+from dialRL.environments import DarSeqEnv
+from dialRL.utils import collate_observations, torch_load, autocast
+from dialRL.utils.reward_functions import ConstantReward
+
+TIE = 1e-3
+TOLERANCE = 0.01
+
+
+@pytest.fixture
+def checkpoint(request):
+    """ Whole saved model (float64 and float32 copies on cpu) and instances folder given to pytest """
+    file_name, instances = request.config.getoption('--checkpoint'), request.config.getoption('--instances')
+    if not file_name or not instances:
+        pytest.skip('needs --checkpoint=<whole saved model> --instances=<cordeau instances folder>')
+    model64 = torch_load(file_name, map_location='cpu').double()
+    for module in model64.modules():
+        if hasattr(module, 'device'):
+            module.device = 'cpu'
+    model64.eval()
+    return model64, copy.deepcopy(model64).float(), instances
+
+
+def decide(model, observation, dtype, precision):
+    world, targets, drivers, positions, times = collate_observations([observation], dtype=dtype)[:5]
+    with torch.no_grad(), autocast(precision, 'cpu'):
+        logits = model([world, targets, drivers], world[1].unsqueeze(-1).long(), positions=positions, times=times)
+    return logits.double().reshape(-1, logits.shape[-1])[0]
+
+
+@pytest.mark.parametrize('precision', ['float32', 'bf16'])
+def test_precision_decisions(checkpoint, precision):
+    """ Along the float64 greedy episode of each Cordeau instance, the float32 / bf16 decisions only change
+        (beyond the tolerance) where the float64 logits are tied
+    """
+    model64, model32, instances = checkpoint
+    evaluated = 0
+    for file in sorted(os.listdir(instances)):
+        if not file.endswith('.txt') or not file.startswith('a'):
+            continue
+        env = DarSeqEnv(size=10, target_population=1, driver_population=1, reward_function=ConstantReward(),
+                        rep_type='16', test_env=True, dataset=instances + '/' + file)
+        if 2 * env.target_population + env.driver_population + 1 != model64.max_length:
+            continue
+
+        observation = env.reset()
+        done = False
+        decisions, mismatch = 0, 0
+        while not done:
+            logits64 = decide(model64, observation, torch.float64, 'float64')
+            action = logits64.argmax().item()
+            top2 = logits64.topk(2).values
+            if (top2[0] - top2[1]).item() >= TIE and decide(model32, observation, torch.float32, precision).argmax().item() != action:
+                mismatch += 1
+            decisions += 1
+            observation, reward, done, info = env.step(action)
+        assert mismatch <= TOLERANCE * decisions, file + ': ' + str(mismatch) + ' / ' + str(decisions) + ' decisions changed'
+        evaluated += 1
+    assert evaluated > 0, 'No instance of the model size in ' + instances